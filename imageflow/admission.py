@@ -0,0 +1,229 @@
+"""Контроль допуска запросов по бюджету памяти процесса.
+
+Каждый запрос /render получает резервацию (contextvar). Перед тяжёлыми
+шагами модули дорезервируют оценку пикового потребления:
+- fetch_image - по размерам из заголовка изображения, до полного декодирования;
+- full_pipeline - рабочий набор стадий после Seedream.
+
+Если резерв не помещается в бюджет, запрос ждёт освобождения памяти до
+IMAGEFLOW_ADMISSION_TIMEOUT секунд, затем отклоняется (503). Запрос, который
+сам по себе больше бюджета, отклоняется сразу (413).
+
+Переменные окружения:
+- IMAGEFLOW_MEMORY_BUDGET_MB - бюджет процесса (по умолчанию 70% лимита cgroup или 2048 МБ)
+- IMAGEFLOW_ADMISSION_TIMEOUT - сколько ждать в очереди, секунды (по умолчанию 30)
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+from .metrics import counter, gauge
+from . import deadline
+
+MB = 1024 * 1024
+
+# Pillow хранит RGB/RGBA как 4 байта на пиксель; во время декодирования и
+# последующих convert/resize одновременно живут примерно две такие копии
+BYTES_PER_PIXEL = 4
+DECODE_OVERHEAD = 2.0
+
+# Пиковый рабочий набор стадий после Seedream на холсте 1024x1280:
+# RGBA-копии холста, float-маски и промежуточные массивы смешивания фона
+PIPELINE_WORKING_SET_BYTES = 160 * MB
+
+MEMORY_RESERVED_BYTES = gauge(
+    "imageflow_memory_reserved_bytes",
+    "Память, зарезервированная выполняющимися запросами (оценка)"
+)
+MEMORY_BUDGET_BYTES = gauge(
+    "imageflow_memory_budget_bytes",
+    "Бюджет памяти процесса для контроля допуска"
+)
+ADMISSION_TOTAL = counter(
+    "imageflow_admission_total",
+    "Решения контроля допуска по памяти",
+    ["result"]
+)
+
+
+class AdmissionRejected(Exception):
+    """Запрос не допущен: не хватает бюджета памяти."""
+
+    def __init__(self, message: str, status_code: int = 503, retry_after: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def _cgroup_memory_limit() -> Optional[int]:
+    """Лимит памяти контейнера (cgroup v2 или v1), если он задан."""
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value.isdigit() and int(value) < (1 << 60):
+            return int(value)
+    return None
+
+
+def default_budget_bytes() -> int:
+    configured = os.getenv("IMAGEFLOW_MEMORY_BUDGET_MB")
+    if configured:
+        return int(float(configured) * MB)
+    limit = _cgroup_memory_limit()
+    if limit:
+        return int(limit * 0.7)
+    return 2048 * MB
+
+
+def estimate_decoded_bytes(width: int, height: int) -> int:
+    """Оценка пиковой памяти на декодирование изображения width x height."""
+    return int(width * height * BYTES_PER_PIXEL * DECODE_OVERHEAD)
+
+
+class MemoryBudget:
+    """Счётчик зарезервированной памяти с ожиданием освобождения."""
+
+    def __init__(self, budget_bytes: int, queue_timeout: float = 30.0):
+        self.budget_bytes = budget_bytes
+        self.queue_timeout = queue_timeout
+        self._reserved = 0
+        self._cond = threading.Condition()
+        MEMORY_BUDGET_BYTES.set(budget_bytes)
+        MEMORY_RESERVED_BYTES.set(0)
+
+    @property
+    def reserved(self) -> int:
+        with self._cond:
+            return self._reserved
+
+    def acquire(self, nbytes: int, timeout: Optional[float] = None) -> None:
+        """
+        Зарезервировать nbytes, дождавшись свободного бюджета.
+
+        Raises:
+            AdmissionRejected: 413 - больше всего бюджета, 503 - не дождались за timeout
+        """
+        if nbytes > self.budget_bytes:
+            ADMISSION_TOTAL.inc(result="rejected_too_large")
+            raise AdmissionRejected(
+                f"Оценка памяти запроса {nbytes // MB} МБ превышает бюджет процесса {self.budget_bytes // MB} МБ",
+                status_code=413
+            )
+
+        timeout = self.queue_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        queued = False
+        with self._cond:
+            while self._reserved + nbytes > self.budget_bytes:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    ADMISSION_TOTAL.inc(result="rejected_timeout")
+                    raise AdmissionRejected(
+                        f"Нет свободной памяти для запроса ({nbytes // MB} МБ): зарезервировано "
+                        f"{self._reserved // MB} из {self.budget_bytes // MB} МБ",
+                        status_code=503,
+                        retry_after=max(1, int(self.queue_timeout))
+                    )
+                if not queued:
+                    queued = True
+                    print(f"[Admission] Ожидание памяти: нужно {nbytes // MB} МБ, "
+                          f"зарезервировано {self._reserved // MB}/{self.budget_bytes // MB} МБ", flush=True)
+                self._cond.wait(remaining)
+            self._reserved += nbytes
+            MEMORY_RESERVED_BYTES.set(self._reserved)
+        ADMISSION_TOTAL.inc(result="queued" if queued else "admitted")
+
+    def release(self, nbytes: int) -> None:
+        if nbytes <= 0:
+            return
+        with self._cond:
+            self._reserved = max(0, self._reserved - nbytes)
+            MEMORY_RESERVED_BYTES.set(self._reserved)
+            self._cond.notify_all()
+
+
+class Reservation:
+    """Резервация одного запроса: растёт по мере работы и освобождается целиком в конце."""
+
+    def __init__(self, budget: MemoryBudget):
+        self.budget = budget
+        self.nbytes = 0
+        self.released = False
+        self._lock = threading.Lock()
+
+    def grow(self, nbytes: int, label: str = "") -> None:
+        """
+        Raises:
+            AdmissionRejected: Бюджет не освободился вовремя
+            RuntimeError: Резервация уже освобождена (запрос завершён)
+        """
+        self._check_active()
+        # В очереди ждём не дольше, чем осталось до дедлайна запроса
+        left = deadline.remaining()
+        self.budget.acquire(nbytes, timeout=None if left is None else max(0.0, min(self.budget.queue_timeout, left)))
+        with self._lock:
+            released = self.released
+            if not released:
+                self.nbytes += nbytes
+        if released:
+            # release() прошёл, пока ждали бюджет - байты вернуть сразу, иначе они утекут
+            self.budget.release(nbytes)
+            self._check_active()
+        print(f"[Admission] Резерв {label}: +{nbytes // MB} МБ (запрос: {self.nbytes // MB} МБ, "
+              f"процесс: {self.budget.reserved // MB}/{self.budget.budget_bytes // MB} МБ)", flush=True)
+
+    def release(self) -> None:
+        with self._lock:
+            nbytes, self.nbytes = self.nbytes, 0
+            self.released = True
+        self.budget.release(nbytes)
+
+    def _check_active(self) -> None:
+        if self.released:
+            raise RuntimeError("Резервация уже освобождена: запрос завершён")
+
+
+_budget: Optional[MemoryBudget] = None
+_budget_lock = threading.Lock()
+_current: ContextVar[Optional[Reservation]] = ContextVar("imageflow_reservation", default=None)
+
+
+def get_budget() -> MemoryBudget:
+    global _budget
+    if _budget is None:
+        with _budget_lock:
+            if _budget is None:
+                _budget = MemoryBudget(
+                    default_budget_bytes(),
+                    queue_timeout=float(os.getenv("IMAGEFLOW_ADMISSION_TIMEOUT", 30))
+                )
+    return _budget
+
+
+@contextmanager
+def request_scope() -> Iterator[Reservation]:
+    """Резервация на время запроса; всё зарезервированное освобождается на выходе."""
+    reservation = Reservation(get_budget())
+    token = _current.set(reservation)
+    try:
+        yield reservation
+    finally:
+        _current.reset(token)
+        reservation.release()
+
+
+def reserve(nbytes: int, label: str = "") -> None:
+    """
+    Дорезервировать память для текущего запроса.
+
+    Вне request_scope (скрипты, бенчмарки) ничего не делает.
+    """
+    reservation = _current.get()
+    if reservation is not None:
+        reservation.grow(nbytes, label)
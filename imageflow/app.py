@@ -2,15 +2,29 @@
 import os
 import io
 import re
+import zipfile
 import requests
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import Response
+import anyio
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import FileResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, ValidationError
+from starlette.datastructures import UploadFile
+from typing import Callable, Dict, List, Mapping, Optional, Tuple
 from dotenv import load_dotenv
-from .pipeline import full_pipeline
-from .utils import pil_to_bytes
+from .pipeline import RENDER_AT_TARGET, TEXT_OVERLAY, render_variants
+from . import metrics
+from . import tracing
+from . import admission
+from .circuit_breaker import SEEDREAM_BREAKER
+from . import deadline
+from . import outputs
+from . import profiler
+from . import coalesce
+from . import scheduler
+from . import thread_budget
+from . import uploads
 
 # Загружаем переменные окружения
 load_dotenv(os.path.join(os.path.dirname(__file__), ".env"))
@@ -24,9 +38,19 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Trace-Id", "Retry-After"],
 )
 
 
+@app.on_event("startup")
+async def configure_thread_pool():
+    """Пулы потоков: пул запросов вмещает слоты и очереди планировщика, библиотеки - по бюджету потоков."""
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    limiter.total_tokens = max(limiter.total_tokens, scheduler.thread_capacity())
+    # Пулы OpenCV/BLAS - по бюджету потоков до первого рендера
+    thread_budget.apply()
+
+
 def sanitize_filename(text: str) -> str:
     """
     Очистить текст для использования в имени файла.
@@ -39,34 +63,246 @@ def sanitize_filename(text: str) -> str:
     return text
 
 
+CONCEPTS = ("v1", "v2")
+
+# Фиксированный seed Seedream: одинаковые запросы дают одинаковый результат
+RENDER_SEED = 2069714305
+
+
+def build_zip(files: Dict[str, bytes]) -> bytes:
+    """Собрать zip-архив без сжатия (PNG уже сжаты)."""
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_STORED) as archive:
+        for name, data in files.items():
+            archive.writestr(name, data)
+    return buf.getvalue()
+
+
 class RenderRequest(BaseModel):
     """Запрос на рендеринг изображения."""
-    image_url: str
+    image_url: Optional[str] = None  # URL исходника; не нужен, если изображение загружено в запрос
     game_title: str
     provider: str
     filename: Optional[str] = None  # Опциональное имя файла
     concept: Optional[str] = "v1"  # Концепция обработки: "v1" (с блюром фона) или "v2" (без блюра фона)
+    concepts: Optional[List[str]] = None  # Несколько концепций за один проход - ответ zip-архивом
+    sizes: Optional[List[str]] = None  # Выходные размеры "WxH" (по умолчанию 512x640), несколько - ответ zip-архивом
+    render_at_target: Optional[bool] = None  # Рендер сразу в наибольшем из sizes (None - по IMAGEFLOW_RENDER_AT_TARGET)
+    text_overlay: Optional[bool] = None  # Название игры и провайдер поверх рендера (None - по IMAGEFLOW_TEXT_OVERLAY)
+
+
+@app.middleware("http")
+async def render_metrics_middleware(request: Request, call_next):
+    """Учёт запросов /render в метриках: in-flight, статусы, отданные байты."""
+    if request.url.path != "/render":
+        return await call_next(request)
+    
+    with metrics.REQUESTS_IN_FLIGHT.track_inprogress():
+        response = await call_next(request)
+    
+    metrics.REQUESTS_TOTAL.inc(status=str(response.status_code))
+    content_length = response.headers.get("content-length")
+    if content_length:
+        metrics.BYTES_OUT_TOTAL.inc(int(content_length))
+    return response
+
+
+@app.middleware("http")
+async def render_trace_middleware(request: Request, call_next):
+    """Трасса запроса /render: span'ы стадий уходят в Server-Timing и (опционально) в OTLP."""
+    if request.url.path != "/render":
+        return await call_next(request)
+    
+    trace = tracing.start_trace(request.headers.get("traceparent"))
+    with tracing.span("render"):
+        response = await call_next(request)
+    
+    response.headers["Server-Timing"] = trace.server_timing()
+    response.headers["X-Trace-Id"] = trace.trace_id
+    tracing.export_trace(trace)
+    return response
 
 
 @app.get("/health")
 def health_check():
     """Проверка здоровья сервиса."""
-    return {"status": "ok"}
+    return {"status": "ok", "seedream_circuit": SEEDREAM_BREAKER.state}
+
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """Метрики сервиса в формате Prometheus."""
+    return Response(content=metrics.render_latest(), media_type=metrics.CONTENT_TYPE)
+
+
+def _check_admin(request: Request) -> None:
+    """Доступ к /admin/*: заголовок X-Admin-Token, если задан IMAGEFLOW_ADMIN_TOKEN."""
+    token = os.getenv("IMAGEFLOW_ADMIN_TOKEN")
+    if token and request.headers.get("X-Admin-Token") != token:
+        raise HTTPException(status_code=403, detail="Неверный X-Admin-Token")
+
+
+@app.get("/admin/profiles")
+def list_profiles(request: Request):
+    """Профили медленных запросов, новые первыми (см. profiler)."""
+    _check_admin(request)
+    return {"threshold_s": profiler.threshold(), "mode": profiler.mode(), "profiles": profiler.list_profiles()}
+
+
+@app.get("/admin/profiles/{profile_id}")
+def download_profile(profile_id: str, request: Request, format: str = "json"):
+    """
+    Скачать профиль.
+    
+    format: json - запись целиком (стадии, стеки или топ cProfile), collapsed -
+    свёрнутые стеки для flamegraph.pl/speedscope, pstats - .prof для pstats/snakeviz.
+    """
+    _check_admin(request)
+    if format == "collapsed":
+        content = profiler.collapsed_stacks(profile_id)
+        if content is None:
+            raise HTTPException(status_code=404, detail="Профиль не найден")
+        return Response(content=content, media_type="text/plain; charset=utf-8")
+    
+    extensions = {"json": ".json", "pstats": ".prof"}
+    if format not in extensions:
+        raise HTTPException(status_code=400, detail="format должен быть json, collapsed или pstats")
+    path = profiler.profile_path(profile_id, extensions[format])
+    if path is None:
+        raise HTTPException(status_code=404, detail="Профиль не найден")
+    return FileResponse(path, filename=os.path.basename(path))
+
+
+@app.get("/uploads/{token}")
+def download_upload(token: str):
+    """Загруженный в /render исходник по короткой ссылке для Seedream (живёт до конца рендера)."""
+    upload = uploads.STORE.get(token)
+    if upload is None:
+        raise HTTPException(status_code=404, detail="Загрузка не найдена или истекла")
+    return Response(content=upload.data, media_type=upload.content_type, headers={"Cache-Control": "no-store"})
+
+
+# Поле multipart с файлом исходника; списочные параметры формы и query string
+# передаются повторением или через запятую
+UPLOAD_FIELD = "image"
+_LIST_FIELDS = ("concepts", "sizes")
+
+
+def _form_request(values: Mapping, getlist: Callable[[str], List]) -> RenderRequest:
+    """RenderRequest из полей multipart-формы или query string."""
+    params = {}
+    for name in RenderRequest.model_fields:
+        if name in _LIST_FIELDS:
+            items = [item.strip() for value in getlist(name) for item in str(value).split(",") if item.strip()]
+            if items:
+                params[name] = items
+        elif name in values:
+            params[name] = values[name]
+    return RenderRequest.model_validate(params)
+
 
+def _check_upload_length(http_request: Request) -> None:
+    declared = http_request.headers.get("content-length", "")
+    if declared.isdigit() and int(declared) > uploads.MAX_UPLOAD_BYTES + 64 * 1024:
+        raise HTTPException(status_code=413, detail=f"Тело запроса больше допустимого ({uploads.MAX_UPLOAD_BYTES} байт)")
 
-@app.post("/render")
-def render_image(request: RenderRequest):
+
+async def _read_upload_body(http_request: Request) -> bytes:
+    """Бинарное тело запроса не больше MAX_UPLOAD_BYTES (больше - 413 без чтения остатка)."""
+    _check_upload_length(http_request)
+    chunks, total = [], 0
+    async for chunk in http_request.stream():
+        total += len(chunk)
+        if total > uploads.MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail=f"Изображение больше допустимого ({uploads.MAX_UPLOAD_BYTES} байт)")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+async def render_body(http_request: Request) -> Tuple[RenderRequest, Optional[uploads.Upload]]:
+    """
+    Тело /render: JSON с image_url или сам исходник.
+
+    - application/json - RenderRequest;
+    - multipart/form-data - файл в поле image, параметры - полями формы;
+    - image/* или application/octet-stream - байты изображения, параметры - в query string.
+    """
+    content_type = http_request.headers.get("content-type", "").split(";")[0].strip().lower()
+    try:
+        if content_type.startswith("multipart/"):
+            _check_upload_length(http_request)
+            async with http_request.form() as form:
+                file = form.get(UPLOAD_FIELD)
+                if not isinstance(file, UploadFile):
+                    raise HTTPException(status_code=400, detail=f"multipart: изображение ожидается в поле {UPLOAD_FIELD}")
+                data = await file.read(uploads.MAX_UPLOAD_BYTES + 1)
+                request = _form_request(
+                    {k: v for k, v in form.items() if isinstance(v, str)},
+                    lambda name: [v for v in form.getlist(name) if isinstance(v, str)]
+                )
+        elif content_type.startswith("image/") or content_type == "application/octet-stream":
+            data = await _read_upload_body(http_request)
+            request = _form_request(http_request.query_params, http_request.query_params.getlist)
+        else:
+            return RenderRequest.model_validate_json(await http_request.body()), None
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+
+    if request.image_url:
+        raise HTTPException(status_code=400, detail="Передайте либо image_url, либо изображение в теле запроса")
+    try:
+        upload = uploads.inspect(data)
+    except ValueError as e:
+        status_code = 413 if len(data) > uploads.MAX_UPLOAD_BYTES else 400
+        raise HTTPException(status_code=status_code, detail=f"Некорректное изображение: {e}")
+    print(f"[API] Изображение загружено в запрос: {upload.format} {upload.size}, {len(upload)} байт", flush=True)
+    metrics.BYTES_IN_TOTAL.inc(len(upload), source="upload")
+    return request, upload
+
+
+_RENDER_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "application/json": {"schema": RenderRequest.model_json_schema()},
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": [UPLOAD_FIELD, "game_title", "provider"],
+                    "properties": {
+                        UPLOAD_FIELD: {"type": "string", "format": "binary"},
+                        **{
+                            name: field for name, field in RenderRequest.model_json_schema()["properties"].items()
+                            if name != "image_url"
+                        },
+                    },
+                }
+            },
+            "image/*": {"schema": {"type": "string", "format": "binary"}},
+        },
+    }
+}
+
+
+@app.post("/render", openapi_extra=_RENDER_OPENAPI)
+def render_image(http_request: Request, body: Tuple[RenderRequest, Optional[uploads.Upload]] = Depends(render_body)):
     """
     Обработать изображение по полному пайплайну.
     
-    Возвращает PNG изображение как бинарные данные.
+    Возвращает PNG изображение как бинарные данные. Заголовок X-Request-Timeout
+    (секунды) сокращает время на запрос; по истечении дедлайна - ответ 504.
+    X-Priority (interactive, default, batch) и X-Client-Id задают класс и
+    клиента в очереди планировщика; при перегрузке - ответ 429 с Retry-After.
+    Исходник можно передать вместо image_url прямо в теле (см. render_body).
     """
     import time
     import sys
     import traceback
     
+    request, upload = body
+    
     # Валидация входных данных
-    if not request.image_url or not request.image_url.strip():
+    if upload is None and (not request.image_url or not request.image_url.strip()):
         raise HTTPException(status_code=400, detail="image_url не может быть пустым")
     
     if not request.game_title or not request.game_title.strip():
@@ -76,7 +312,7 @@ def render_image(request: RenderRequest):
         raise HTTPException(status_code=400, detail="provider не может быть пустым")
     
     # Валидация URL
-    if not request.image_url.startswith(('http://', 'https://')):
+    if upload is None and not request.image_url.startswith(('http://', 'https://')):
         raise HTTPException(status_code=400, detail="image_url должен быть валидным HTTP/HTTPS URL")
     
     # Получаем API ключ из переменных окружения
@@ -89,40 +325,101 @@ def render_image(request: RenderRequest):
     
     # Валидация концепции
     concept = request.concept or "v1"
-    if concept not in ("v1", "v2"):
+    if concept not in CONCEPTS:
         raise HTTPException(status_code=400, detail="concept должен быть 'v1' или 'v2'")
     
+    # Несколько концепций за один проход пайплайна (порядок сохраняется, повторы убираются)
+    concepts = list(dict.fromkeys(request.concepts or [concept]))
+    invalid = [c for c in concepts if c not in CONCEPTS]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"concepts может содержать только 'v1' и 'v2', получено: {invalid}")
+    
+    # Выходные размеры: одна пирамида resize из одного рендера
     try:
-        print(f"[API] Начало обработки запроса: image_url={request.image_url[:50]}..., concept={concept}", flush=True)
-        
-        # Запускаем пайплайн
-        pipeline_start = time.time()
-        result_image = full_pipeline(
-            image_url=request.image_url,
-            game_title=request.game_title,
-            provider=request.provider,
-            fal_api_key=fal_api_key,
-            seed=2069714305,
-            concept=concept  # Передаем концепцию в пайплайн
-        )
-        
-        if result_image is None:
-            raise RuntimeError("Пайплайн вернул None вместо изображения")
+        sizes = outputs.validate_sizes(request.sizes) if request.sizes else [outputs.OUTPUT_SIZE]
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Некорректный sizes: {e}")
+    
+    try:
+        request_timeout = deadline.parse_timeout(http_request.headers.get(deadline.HEADER))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Некорректный {deadline.HEADER}: {e}")
+    
+    try:
+        priority = scheduler.parse_priority(http_request.headers.get(scheduler.PRIORITY_HEADER))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Некорректный {scheduler.PRIORITY_HEADER}: {e}")
+    # Честная очередь - по клиенту из заголовка, иначе по адресу
+    client_id = http_request.headers.get(scheduler.CLIENT_HEADER) or (
+        http_request.client.host if http_request.client else "unknown"
+    )
+    claim = scheduler.Claim(priority, client_id)
+    
+    try:
+        source_label = f"upload={upload.digest[:16]}" if upload is not None else f"image_url={request.image_url[:50]}..."
+        print(f"[API] Начало обработки запроса: trace_id={tracing.current_trace_id()}, {source_label}, concepts={','.join(concepts)}", flush=True)
         
-        print(f"[API] Пайплайн завершен за {time.time() - pipeline_start:.2f}с, размер изображения: {result_image.size}", flush=True)
+        def render_and_encode() -> Dict:
+            # Слот планировщика и резервация памяти живут до конца кодирования PNG
+            # (держит только вычисляющий запрос, объединённые дубликаты слот не занимают,
+            # но повышают класс его заявки до своего)
+            # Загруженный исходник Seedream получает data URI или короткой ссылкой на время рендера
+            with scheduler.slot(claim), admission.request_scope(), \
+                    uploads.seedream_source(request.image_url, upload) as image_url:
+                # Запускаем пайплайн: общие стадии один раз на все концепции
+                pipeline_start = time.time()
+                result_images = render_variants(
+                    image_url=image_url,
+                    game_title=request.game_title,
+                    provider=request.provider,
+                    fal_api_key=fal_api_key,
+                    seed=RENDER_SEED,
+                    concepts=concepts,  # Передаем концепции в пайплайн
+                    sizes=sizes,
+                    render_at_target=request.render_at_target,
+                    text_overlay=request.text_overlay,
+                    image_data=upload.data if upload is not None else None
+                )
+                
+                result_images = {
+                    (c, size): result_images.get(c, {}).get(size) for c in concepts for size in sizes
+                }
+                if any(image is None for image in result_images.values()):
+                    raise RuntimeError("Пайплайн вернул None вместо изображения")
+                
+                print(f"[API] Пайплайн завершен за {time.time() - pipeline_start:.2f}с, изображений: {len(result_images)}", flush=True)
+                
+                # Конвертируем в PNG байты (несколько изображений - параллельно)
+                convert_start = time.time()
+                try:
+                    png_outputs = outputs.encode_parallel(result_images, format="PNG")
+                except Exception as e:
+                    print(f"[API] Ошибка конвертации в PNG: {type(e).__name__}: {e}", flush=True)
+                    raise RuntimeError(f"Ошибка конвертации изображения в PNG: {e}") from e
+                print(f"[API] Конвертация в PNG завершена за {time.time() - convert_start:.2f}с, размер: "
+                      f"{sum(len(b) for b in png_outputs.values())} байт", flush=True)
+                return png_outputs
         
-        # Конвертируем в PNG байты
-        convert_start = time.time()
-        try:
-            png_bytes = pil_to_bytes(result_image, format="PNG")
-        except Exception as e:
-            print(f"[API] Ошибка конвертации в PNG: {type(e).__name__}: {e}", flush=True)
-            raise RuntimeError(f"Ошибка конвертации изображения в PNG: {e}") from e
+        # Дедлайн действует и на ожидание одинакового запроса, который уже считается
+        with deadline.request_deadline(request_timeout):
+            if coalesce.enabled():
+                text_overlay = TEXT_OVERLAY if request.text_overlay is None else request.text_overlay
+                key = coalesce.request_key(
+                    request.image_url if upload is None else f"upload:{upload.digest}",
+                    concepts,
+                    sizes,
+                    render_at_target=RENDER_AT_TARGET if request.render_at_target is None else request.render_at_target,
+                    text=(request.game_title, request.provider) if text_overlay else None,
+                    seed=RENDER_SEED
+                )
+                png_outputs, coalesced = coalesce.RENDERS.do(key, render_and_encode, claim)
+                if coalesced:
+                    print(f"[API] Результат получен от одинакового запроса, который уже выполнялся", flush=True)
+            else:
+                png_outputs = render_and_encode()
         
-        if not png_bytes or len(png_bytes) == 0:
+        if any(not png_bytes for png_bytes in png_outputs.values()):
             raise RuntimeError("Конвертация в PNG вернула пустой результат")
-        
-        print(f"[API] Конвертация в PNG завершена за {time.time() - convert_start:.2f}с, размер: {len(png_bytes)} байт", flush=True)
         sys.stdout.flush()
         
         # Генерируем имя файла: игра__провайдер (двойное подчеркивание для уникального разделения)
@@ -135,20 +432,37 @@ def render_image(request: RenderRequest):
             provider_clean = sanitize_filename(request.provider)
             filename = f"{game_clean}__{provider_clean}"  # Двойное подчеркивание для уникального разделения
         
-        # Добавляем расширение если его нет
-        if not filename.endswith('.png'):
-            filename = f"{filename}.png"
+        if len(png_outputs) > 1:
+            # Несколько концепций и/или размеров - zip-архив <имя>[_<концепция>][_<W>x<H>].png
+            base = filename[:-4] if filename.endswith('.png') else filename
+            files = {}
+            for (c, (width, height)), png_bytes in png_outputs.items():
+                name = base
+                if len(concepts) > 1:
+                    name = f"{name}_{c}"
+                if len(sizes) > 1:
+                    name = f"{name}_{width}x{height}"
+                files[f"{name}.png"] = png_bytes
+            content = build_zip(files)
+            media_type = "application/zip"
+            filename = f"{base}.zip"
+        else:
+            content = next(iter(png_outputs.values()))
+            media_type = "image/png"
+            # Добавляем расширение если его нет
+            if not filename.endswith('.png'):
+                filename = f"{filename}.png"
         
-        print(f"[API] Подготовка ответа: filename={filename}, размер={len(png_bytes)} байт", flush=True)
+        print(f"[API] Подготовка ответа: filename={filename}, размер={len(content)} байт", flush=True)
         sys.stdout.flush()
         
-        # Возвращаем бинарные данные PNG с правильным именем файла
+        # Возвращаем бинарные данные с правильным именем файла
         response = Response(
-            content=png_bytes,
-            media_type="image/png",
+            content=content,
+            media_type=media_type,
             headers={
                 "Content-Disposition": f'attachment; filename="{filename}"',
-                "Content-Length": str(len(png_bytes))
+                "Content-Length": str(len(content))
             }
         )
         
@@ -161,6 +475,19 @@ def render_image(request: RenderRequest):
         # Пробрасываем HTTPException как есть
         raise
     
+    except admission.AdmissionRejected as e:
+        print(f"[API] Запрос отклонён контролем памяти: {e}", flush=True)
+        headers = {"Retry-After": str(e.retry_after)} if e.retry_after else None
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers=headers)
+    
+    except scheduler.SchedulerRejected as e:
+        print(f"[API] Запрос отклонён планировщиком: {e}", flush=True)
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    
+    except deadline.DeadlineExceeded as e:
+        print(f"[API] {e}", flush=True)
+        raise HTTPException(status_code=504, detail=str(e))
+    
     except requests.exceptions.RequestException as e:
         error_msg = f"Ошибка сетевого запроса: {type(e).__name__}: {str(e)}"
         print(f"[API] {error_msg}", flush=True)
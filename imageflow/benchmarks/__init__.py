@@ -0,0 +1,4 @@
+"""Офлайн-бенчмарки стадий пайплайна на синтетических изображениях.
+
+Запуск: python -m imageflow.benchmarks --help
+"""
@@ -0,0 +1,158 @@
+"""CLI офлайн-бенчмарка стадий пайплайна.
+
+Примеры:
+    python -m imageflow.benchmarks --sizes 512,1024 --coverages 0.1,0.5,0.97
+    python -m imageflow.benchmarks --output new.json --compare baseline.json --threshold 0.15
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import platform
+import subprocess
+import sys
+from typing import Dict, List, Optional
+
+from .runner import measure
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _environment() -> Dict[str, Optional[str]]:
+    import numpy
+    import cv2
+    import PIL
+    return {
+        "git_revision": _git_revision(),
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": numpy.__version__,
+        "opencv": cv2.__version__,
+        "pillow": PIL.__version__,
+        "cv2_threads": str(cv2.getNumThreads()),
+    }
+
+
+def _result_key(result: Dict) -> tuple:
+    return result["stage"], result["size"], result["coverage"]
+
+
+def run_benchmarks(
+    stage_names: List[str],
+    sizes: List[int],
+    coverages: List[float],
+    repeat: int,
+    warmup: int,
+    verbose: bool = False
+) -> List[Dict]:
+    from .stages import STAGES
+
+    results = []
+    for name in stage_names:
+        setup, uses_coverage = STAGES[name]
+        for size in sizes:
+            for coverage in (coverages if uses_coverage else [None]):
+                label = f"{name} size={size}" + (f" coverage={coverage}" if coverage is not None else "")
+                # Стадии пайплайна активно пишут в stdout - по умолчанию глушим
+                quiet = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+                try:
+                    with quiet:
+                        fn = setup(size, coverage)
+                        stats = measure(fn, repeat=repeat, warmup=warmup)
+                except ImportError as e:
+                    print(f"[Bench] {label}: пропущено, нет зависимости ({e})", flush=True)
+                    break
+
+                result = {"stage": name, "size": size, "coverage": coverage, "repeat": repeat, **stats}
+                results.append(result)
+                rss = f"{stats['peak_rss_mb']:.1f}" if stats["peak_rss_mb"] is not None else "n/a"
+                print(
+                    f"[Bench] {label}: wall {stats['wall_ms_median']:.1f} мс (min {stats['wall_ms_min']:.1f}), "
+                    f"cpu {stats['cpu_ms_median']:.1f} мс, traced {stats['peak_traced_mb']:.1f} МБ, rss +{rss} МБ",
+                    flush=True
+                )
+    return results
+
+
+def compare(results: List[Dict], baseline: Dict, threshold: float) -> List[str]:
+    """
+    Сравнить медианное wall time с базовым прогоном.
+
+    Returns:
+        Список описаний регрессий (замедление больше threshold, доля)
+    """
+    base = {_result_key(r): r for r in baseline.get("results", [])}
+    regressions = []
+    for r in results:
+        b = base.get(_result_key(r))
+        if b is None or b["wall_ms_median"] <= 0:
+            continue
+        ratio = r["wall_ms_median"] / b["wall_ms_median"]
+        marker = ""
+        if ratio > 1 + threshold:
+            marker = "  <-- РЕГРЕССИЯ"
+            regressions.append(f"{r['stage']} size={r['size']} coverage={r['coverage']}: x{ratio:.2f}")
+        print(
+            f"[Compare] {r['stage']} size={r['size']} coverage={r['coverage']}: "
+            f"{b['wall_ms_median']:.1f} -> {r['wall_ms_median']:.1f} мс (x{ratio:.2f}){marker}",
+            flush=True
+        )
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from .stages import STAGES
+
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк стадий ImageFlow на синтетических изображениях")
+    parser.add_argument("--stages", default=",".join(STAGES), help="Стадии через запятую")
+    parser.add_argument("--sizes", default="512,1024", help="Стороны входного изображения через запятую")
+    parser.add_argument("--coverages", default="0.1,0.5,0.97", help="Доли покрытия маски через запятую")
+    parser.add_argument("--repeat", type=int, default=3, help="Количество замеров на комбинацию")
+    parser.add_argument("--warmup", type=int, default=1, help="Прогревочные запуски (загрузка моделей, кэши)")
+    parser.add_argument("--output", default="bench_results.json", help="Файл для результатов (JSON)")
+    parser.add_argument("--compare", help="JSON предыдущего прогона для сравнения")
+    parser.add_argument("--threshold", type=float, default=0.15, help="Допустимое замедление при сравнении (доля)")
+    parser.add_argument("--verbose", action="store_true", help="Не глушить вывод стадий")
+    args = parser.parse_args(argv)
+
+    stage_names = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = [s for s in stage_names if s not in STAGES]
+    if unknown:
+        parser.error(f"Неизвестные стадии: {', '.join(unknown)}")
+
+    results = run_benchmarks(
+        stage_names,
+        sizes=[int(s) for s in args.sizes.split(",")],
+        coverages=[float(c) for c in args.coverages.split(",")],
+        repeat=args.repeat,
+        warmup=args.warmup,
+        verbose=args.verbose
+    )
+
+    report = {"environment": _environment(), "results": results}
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"[Bench] Результаты сохранены в {args.output}", flush=True)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"[Compare] Найдено регрессий: {len(regressions)}", flush=True)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,393 @@
+"""Скорость и качество приближённых путей: эталон против кандидата.
+
+Любой более быстрый blur, выбор цветов, инпейнтинг или рендер в меньшем
+разрешении меняет пиксели. Харнесс прогоняет render_variants (тот же путь,
+что full_pipeline, но Seedream заменён локальным изображением корпуса) в
+эталонной и кандидатной конфигурации и сообщает по каждому изображению:
+- ускорение по стадиям (span'ы трассы запроса) и общее CPU;
+- SSIM и PSNR каждого выхода (концепция x размер) относительно эталона;
+- ΔE (CIEDE2000) доминантного цвета, выбранного пайплайном для градиента.
+С порогами --min-ssim / --min-psnr / --max-delta-e код выхода 1 при нарушении.
+
+Конфигурация - список настроек через --reference / --candidate (повторяемые):
+- render_at_target=1, text_overlay=1 - аргументы render_variants;
+- env:IMAGEFLOW_X=значение - переменная окружения на время прогона;
+- patch:imageflow.модуль.АТРИБУТ=литерал - подмена константы модуля (Python-литерал).
+
+Примеры:
+    python -m imageflow.benchmarks.evaluate --corpus ./corpus --candidate render_at_target=1 --min-ssim 0.99
+    python -m imageflow.benchmarks.evaluate --synthetic 3 --mask-coverage 0.9 \\
+        --candidate render_at_target=1 --max-delta-e 2 --output eval.json
+"""
+import argparse
+import ast
+import contextlib
+import contextvars
+import importlib
+import io
+import json
+import os
+import statistics
+import sys
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from PIL import Image
+
+from ..outputs import OUTPUT_SIZE, parse_size
+from .quality import delta_e, psnr, ssim
+from .synthetic import make_foreground, make_image, make_mask
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".bmp")
+
+# Аргументы render_variants, которые можно задать в конфигурации
+RENDER_OPTIONS = ("render_at_target", "text_overlay")
+
+# Окружение всех прогонов: без хеджирования (fallback-ветке нечего скачивать) и без профайлера
+BASE_ENV = {"IMAGEFLOW_HEDGE": "", "IMAGEFLOW_PROFILE_MODE": "off"}
+
+
+class Config:
+    """Конфигурация прогона: аргументы render_variants, окружение и подмены констант."""
+
+    def __init__(self, name: str, items: Sequence[str] = ()):
+        self.name = name
+        self.items = list(items)
+        self.render: Dict[str, bool] = {}
+        self.env: Dict[str, str] = {}
+        self.patches: List[Tuple[str, str, object]] = []
+        for item in self.items:
+            key, sep, value = item.partition("=")
+            if not sep:
+                raise ValueError(f"Настройка должна быть вида ключ=значение, получено: {item!r}")
+            if key.startswith("env:"):
+                self.env[key[4:]] = value
+            elif key.startswith("patch:"):
+                module, _, attr = key[6:].rpartition(".")
+                if not module:
+                    raise ValueError(f"patch: нужен полный путь модуль.АТРИБУТ, получено: {key[6:]!r}")
+                self.patches.append((module, attr, ast.literal_eval(value)))
+            elif key in RENDER_OPTIONS:
+                self.render[key] = value.lower() in ("1", "true", "yes", "on")
+            else:
+                raise ValueError(f"Неизвестная настройка {key!r}: ожидались {RENDER_OPTIONS}, env:..., patch:...")
+
+    def describe(self) -> str:
+        return ", ".join(self.items) or "по умолчанию"
+
+    @contextlib.contextmanager
+    def applied(self):
+        """Применить окружение и подмены на время прогона, затем вернуть как было."""
+        saved_env = {key: os.environ.get(key) for key in {**BASE_ENV, **self.env}}
+        saved_attrs = []
+        try:
+            os.environ.update({**BASE_ENV, **self.env})
+            for module_name, attr, value in self.patches:
+                module = importlib.import_module(module_name)
+                saved_attrs.append((module, attr, getattr(module, attr)))
+                setattr(module, attr, value)
+            yield
+        finally:
+            for module, attr, value in reversed(saved_attrs):
+                setattr(module, attr, value)
+            for key, value in saved_env.items():
+                if value is None:
+                    os.environ.pop(key, None)
+                else:
+                    os.environ[key] = value
+
+
+def load_corpus(path: str, limit: Optional[int] = None) -> List[Tuple[str, Image.Image]]:
+    """Изображения каталога (по имени файла), в RGB."""
+    names = sorted(name for name in os.listdir(path) if name.lower().endswith(IMAGE_EXTENSIONS))
+    corpus = []
+    for name in names[:limit]:
+        with Image.open(os.path.join(path, name)) as image:
+            corpus.append((name, image.convert("RGB")))
+    if not corpus:
+        raise ValueError(f"В {path} нет изображений {IMAGE_EXTENSIONS}")
+    return corpus
+
+
+def synthetic_corpus(count: int) -> List[Tuple[str, Image.Image]]:
+    return [(f"synthetic-{seed}", make_image(1024, 1024, seed=seed)) for seed in range(count)]
+
+
+@contextlib.contextmanager
+def _offline_pipeline(image: Image.Image, mask_coverage: Optional[float], colors: List):
+    """
+    Пайплайн без сети: Seedream возвращает изображение корпуса, доминантные
+    цвета концепций записываются в colors; с mask_coverage rmbg заменён
+    синтетическим персонажем-эллипсом (модель u2net не нужна).
+    """
+    from .. import pipeline
+
+    extract_main_colors = pipeline.extract_main_colors
+    saved = {name: getattr(pipeline, name) for name in ("_clean_with_seedream", "extract_main_colors", "remove_background")}
+
+    def record_colors(*args, **kwargs):
+        result = extract_main_colors(*args, **kwargs)
+        colors.append(result[0])
+        return result
+
+    pipeline._clean_with_seedream = lambda *args, **kwargs: image
+    pipeline.extract_main_colors = record_colors
+    if mask_coverage is not None:
+        def fake_rmbg(cleaned, model="u2net"):
+            side = cleaned.size[0]
+            return make_foreground(cleaned, 255 - make_mask(side, side, mask_coverage))
+        pipeline.remove_background = fake_rmbg
+    try:
+        yield pipeline
+    finally:
+        for name, value in saved.items():
+            setattr(pipeline, name, value)
+
+
+def run_config(
+    image: Image.Image,
+    config: Config,
+    concepts: Sequence[str],
+    sizes: Sequence[Tuple[int, int]],
+    repeat: int = 1,
+    mask_coverage: Optional[float] = None
+) -> Dict:
+    """
+    Прогнать конфигурацию repeat раз.
+
+    Returns:
+        renders (последнего прогона), stages {стадия: медиана мс}, colors {концепция: RGB},
+        wall_ms / cpu_ms (медианы)
+    """
+    from .. import tracing
+
+    stage_runs: List[Dict[str, float]] = []
+    wall, cpu = [], []
+    for _ in range(repeat):
+        colors: List = []
+
+        def run():
+            trace = tracing.start_trace()
+            wall_start, cpu_start = time.perf_counter(), time.process_time()
+            renders = pipeline.render_variants(
+                "file://corpus", "Game Title", "Provider", fal_api_key="",
+                concepts=tuple(concepts), sizes=tuple(sizes), **config.render
+            )
+            cpu.append((time.process_time() - cpu_start) * 1000)
+            wall.append((time.perf_counter() - wall_start) * 1000)
+            stages: Dict[str, float] = {}
+            for s in trace.spans:
+                stages[s.name] = stages.get(s.name, 0.0) + s.duration_ms
+            stage_runs.append(stages)
+            return renders
+
+        with config.applied(), _offline_pipeline(image, mask_coverage, colors) as pipeline, \
+                contextlib.redirect_stdout(io.StringIO()):
+            # Своя трасса на прогон, не затрагивая контекст вызывающего
+            renders = contextvars.copy_context().run(run)
+
+    names = list(dict.fromkeys(name for stages in stage_runs for name in stages))
+    return {
+        "renders": renders,
+        "stages": {name: statistics.median(stages.get(name, 0.0) for stages in stage_runs) for name in names},
+        "colors": dict(zip(concepts, (tuple(int(v) for v in color) for color in colors))),
+        "wall_ms": statistics.median(wall),
+        "cpu_ms": statistics.median(cpu),
+    }
+
+
+def compare(reference: Dict, candidate: Dict, concepts: Sequence[str], sizes: Sequence[Tuple[int, int]]) -> Dict:
+    """Качество и ускорение кандидата относительно эталона для одного изображения."""
+    outputs = []
+    for concept in concepts:
+        for size in sizes:
+            ref, cand = reference["renders"][concept][size], candidate["renders"][concept][size]
+            outputs.append({
+                "concept": concept,
+                "size": f"{size[0]}x{size[1]}",
+                "psnr_db": psnr(ref, cand),
+                "ssim": ssim(ref, cand),
+            })
+    colors = [
+        {
+            "concept": concept,
+            "reference": "#%02x%02x%02x" % reference["colors"][concept],
+            "candidate": "#%02x%02x%02x" % candidate["colors"][concept],
+            "delta_e": delta_e(reference["colors"][concept], candidate["colors"][concept]),
+        }
+        for concept in concepts
+    ]
+    stages = [
+        {
+            "stage": name,
+            "reference_ms": reference["stages"].get(name),
+            "candidate_ms": candidate["stages"].get(name),
+            "speedup": _speedup(reference["stages"].get(name), candidate["stages"].get(name)),
+        }
+        for name in dict.fromkeys(list(reference["stages"]) + list(candidate["stages"]))
+    ]
+    return {
+        "outputs": outputs,
+        "colors": colors,
+        "stages": stages,
+        "wall_ms": {"reference": reference["wall_ms"], "candidate": candidate["wall_ms"]},
+        "cpu_ms": {"reference": reference["cpu_ms"], "candidate": candidate["cpu_ms"]},
+        "cpu_speedup": _speedup(reference["cpu_ms"], candidate["cpu_ms"]),
+    }
+
+
+def _speedup(reference_ms: Optional[float], candidate_ms: Optional[float]) -> Optional[float]:
+    if not reference_ms or not candidate_ms:
+        return None
+    return reference_ms / candidate_ms
+
+
+def evaluate(
+    corpus: List[Tuple[str, Image.Image]],
+    reference: Config,
+    candidate: Config,
+    concepts: Sequence[str],
+    sizes: Sequence[Tuple[int, int]],
+    repeat: int = 1,
+    mask_coverage: Optional[float] = None,
+    warmup: int = 1
+) -> List[Dict]:
+    """
+    Сравнить конфигурации на каждом изображении корпуса.
+
+    warmup прогонов каждой конфигурации на первом изображении не замеряются:
+    кэши процесса (маска градиента, спрайты текста) иначе прогревает только
+    эталон, и стадии кандидата выглядят быстрее, чем есть.
+    """
+    for _ in range(warmup if corpus else 0):
+        for config in (reference, candidate):
+            run_config(corpus[0][1], config, concepts, sizes, 1, mask_coverage)
+
+    results = []
+    for name, image in corpus:
+        ref = run_config(image, reference, concepts, sizes, repeat, mask_coverage)
+        cand = run_config(image, candidate, concepts, sizes, repeat, mask_coverage)
+        result = {"image": name, **compare(ref, cand, concepts, sizes)}
+        results.append(result)
+        _print_result(result)
+    return results
+
+
+def _print_result(result: Dict) -> None:
+    print(
+        f"[Evaluate] {result['image']}: cpu {result['cpu_ms']['reference']:.0f} -> "
+        f"{result['cpu_ms']['candidate']:.0f} мс (x{result['cpu_speedup'] or 0:.2f})",
+        flush=True
+    )
+    for stage in result["stages"]:
+        ref_ms = "-" if stage["reference_ms"] is None else f"{stage['reference_ms']:.1f}"
+        cand_ms = "-" if stage["candidate_ms"] is None else f"{stage['candidate_ms']:.1f}"
+        speedup = "" if stage["speedup"] is None else f" (x{stage['speedup']:.2f})"
+        print(f"[Evaluate]   {stage['stage']:<18} {ref_ms:>9} -> {cand_ms:>9} мс{speedup}", flush=True)
+    for output in result["outputs"]:
+        print(
+            f"[Evaluate]   {output['concept']} {output['size']}: PSNR {output['psnr_db']:.1f} дБ, SSIM {output['ssim']:.4f}",
+            flush=True
+        )
+    for color in result["colors"]:
+        print(
+            f"[Evaluate]   {color['concept']} цвет {color['reference']} -> {color['candidate']}: ΔE {color['delta_e']:.2f}",
+            flush=True
+        )
+
+
+def breaches(
+    results: List[Dict],
+    min_ssim: Optional[float] = None,
+    min_psnr: Optional[float] = None,
+    max_delta_e: Optional[float] = None
+) -> List[str]:
+    """Нарушения порогов качества, по строке на выход или цвет."""
+    found = []
+    for result in results:
+        for output in result["outputs"]:
+            label = f"{result['image']} {output['concept']} {output['size']}"
+            if min_ssim is not None and output["ssim"] < min_ssim:
+                found.append(f"{label}: SSIM {output['ssim']:.4f} < {min_ssim}")
+            if min_psnr is not None and output["psnr_db"] < min_psnr:
+                found.append(f"{label}: PSNR {output['psnr_db']:.1f} < {min_psnr}")
+        for color in result["colors"]:
+            if max_delta_e is not None and color["delta_e"] > max_delta_e:
+                found.append(f"{result['image']} {color['concept']}: ΔE {color['delta_e']:.2f} > {max_delta_e}")
+    return found
+
+
+def summarize(results: List[Dict]) -> Dict:
+    """Худшее качество по корпусу и медианное ускорение стадий."""
+    speedups: Dict[str, List[float]] = {}
+    for result in results:
+        for stage in result["stages"]:
+            if stage["speedup"] is not None:
+                speedups.setdefault(stage["stage"], []).append(stage["speedup"])
+    cpu_speedups = [r["cpu_speedup"] for r in results if r["cpu_speedup"]]
+    return {
+        "images": len(results),
+        "min_ssim": min(o["ssim"] for r in results for o in r["outputs"]),
+        "min_psnr_db": min(o["psnr_db"] for r in results for o in r["outputs"]),
+        "max_delta_e": max(c["delta_e"] for r in results for c in r["colors"]),
+        "cpu_speedup_median": statistics.median(cpu_speedups) if cpu_speedups else None,
+        "stage_speedup_median": {name: statistics.median(values) for name, values in speedups.items()},
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Скорость и качество кандидатной конфигурации против эталонной")
+    parser.add_argument("--corpus", help="Каталог с изображениями (по умолчанию - синтетические)")
+    parser.add_argument("--limit", type=int, default=None, help="Не больше N изображений корпуса")
+    parser.add_argument("--synthetic", type=int, default=2, help="Синтетических изображений без --corpus")
+    parser.add_argument("--reference", action="append", default=[], help="Настройка эталона (повторяемая)")
+    parser.add_argument("--candidate", action="append", default=[], help="Настройка кандидата (повторяемая)")
+    parser.add_argument("--concepts", default="v1,v2", help="Концепции через запятую")
+    parser.add_argument("--sizes", default=f"{OUTPUT_SIZE[0]}x{OUTPUT_SIZE[1]}", help="Выходные размеры WxH через запятую")
+    parser.add_argument("--repeat", type=int, default=1, help="Прогонов каждой конфигурации на изображение")
+    parser.add_argument("--warmup", type=int, default=1, help="Прогревочных прогонов каждой конфигурации (кэши процесса)")
+    parser.add_argument("--mask-coverage", type=float, default=None,
+                        help="Заменить rmbg синтетическим персонажем, занимающим эту долю кадра")
+    parser.add_argument("--min-ssim", type=float, default=None, help="Минимально допустимый SSIM")
+    parser.add_argument("--min-psnr", type=float, default=None, help="Минимально допустимый PSNR, дБ")
+    parser.add_argument("--max-delta-e", type=float, default=None, help="Максимально допустимый ΔE доминантного цвета")
+    parser.add_argument("--output", help="Сохранить результаты в JSON")
+    args = parser.parse_args(argv)
+
+    try:
+        reference = Config("reference", args.reference)
+        candidate = Config("candidate", args.candidate)
+    except (ValueError, SyntaxError) as e:
+        parser.error(str(e))
+    corpus = load_corpus(args.corpus, args.limit) if args.corpus else synthetic_corpus(args.synthetic)
+    concepts = [c.strip() for c in args.concepts.split(",") if c.strip()]
+    sizes = [parse_size(s) for s in args.sizes.split(",") if s.strip()]
+
+    print(f"[Evaluate] Эталон: {reference.describe()}; кандидат: {candidate.describe()}; изображений: {len(corpus)}", flush=True)
+    results = evaluate(corpus, reference, candidate, concepts, sizes, args.repeat, args.mask_coverage, args.warmup)
+    summary = summarize(results)
+    print(
+        f"[Evaluate] Итого: SSIM ≥ {summary['min_ssim']:.4f}, PSNR ≥ {summary['min_psnr_db']:.1f} дБ, "
+        f"ΔE ≤ {summary['max_delta_e']:.2f}, ускорение CPU x{summary['cpu_speedup_median'] or 0:.2f} (медиана)",
+        flush=True
+    )
+
+    failed = breaches(results, args.min_ssim, args.min_psnr, args.max_delta_e)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({
+                "reference": reference.items,
+                "candidate": candidate.items,
+                "summary": summary,
+                "breaches": failed,
+                "results": results,
+            }, f, ensure_ascii=False, indent=2, default=str)
+    if failed:
+        for line in failed:
+            print(f"[Evaluate] Ниже порога: {line}", flush=True)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+"""Метрики качества для сравнения рендера с эталоном."""
+import cv2
+import numpy as np
+from PIL import Image
+
+
+def _as_float(image: Image.Image) -> np.ndarray:
+    return np.asarray(image.convert("RGB"), dtype=np.float64)
+
+
+def psnr(reference: Image.Image, image: Image.Image) -> float:
+    """PSNR по RGB, дБ (inf для идентичных изображений)."""
+    mse = np.mean((_as_float(reference) - _as_float(image)) ** 2)
+    if mse == 0:
+        return float("inf")
+    return float(10 * np.log10(255.0 ** 2 / mse))
+
+
+def ssim(reference: Image.Image, image: Image.Image) -> float:
+    """
+    SSIM по яркости (Wang et al. 2004): гауссово окно 11x11, sigma 1.5.
+
+    Returns:
+        Среднее SSIM по кадру, 1.0 - идентичные изображения
+    """
+    x = np.asarray(reference.convert("L"), dtype=np.float64)
+    y = np.asarray(image.convert("L"), dtype=np.float64)
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+
+    def blur(a: np.ndarray) -> np.ndarray:
+        return cv2.GaussianBlur(a, (11, 11), 1.5)
+
+    mu_x, mu_y = blur(x), blur(y)
+    var_x = blur(x * x) - mu_x ** 2
+    var_y = blur(y * y) - mu_y ** 2
+    cov = blur(x * y) - mu_x * mu_y
+    ssim_map = ((2 * mu_x * mu_y + c1) * (2 * cov + c2)) / ((mu_x ** 2 + mu_y ** 2 + c1) * (var_x + var_y + c2))
+    return float(ssim_map.mean())
+
+
+def _srgb_to_lab(rgb) -> np.ndarray:
+    """sRGB (0-255) в CIE Lab, опорный белый D65."""
+    c = np.asarray(rgb, dtype=np.float64) / 255.0
+    linear = np.where(c <= 0.04045, c / 12.92, ((c + 0.055) / 1.055) ** 2.4)
+    xyz = np.array([
+        [0.4124564, 0.3575761, 0.1804375],
+        [0.2126729, 0.7151522, 0.0721750],
+        [0.0193339, 0.1191920, 0.9503041],
+    ]) @ linear / np.array([0.95047, 1.0, 1.08883])
+    f = np.where(xyz > (6 / 29) ** 3, np.cbrt(xyz), xyz / (3 * (6 / 29) ** 2) + 4 / 29)
+    return np.array([116 * f[1] - 16, 500 * (f[0] - f[1]), 200 * (f[1] - f[2])])
+
+
+def delta_e(rgb1, rgb2) -> float:
+    """
+    Цветовое отличие CIEDE2000 двух sRGB цветов (0-255).
+
+    ~1 - порог заметности, 2-3 - заметно при сравнении рядом.
+    """
+    (l1, a1, b1), (l2, a2, b2) = _srgb_to_lab(rgb1), _srgb_to_lab(rgb2)
+    c_bar = (np.hypot(a1, b1) + np.hypot(a2, b2)) / 2
+    g = 0.5 * (1 - np.sqrt(c_bar ** 7 / (c_bar ** 7 + 25 ** 7)))
+    a1, a2 = (1 + g) * a1, (1 + g) * a2
+    c1, c2 = np.hypot(a1, b1), np.hypot(a2, b2)
+    h1 = np.degrees(np.arctan2(b1, a1)) % 360 if c1 else 0.0
+    h2 = np.degrees(np.arctan2(b2, a2)) % 360 if c2 else 0.0
+
+    dh = 0.0
+    if c1 * c2:
+        dh = h2 - h1
+        if dh > 180:
+            dh -= 360
+        elif dh < -180:
+            dh += 360
+    d_l, d_c = l2 - l1, c2 - c1
+    d_h = 2 * np.sqrt(c1 * c2) * np.sin(np.radians(dh / 2))
+
+    l_bar, c_bar = (l1 + l2) / 2, (c1 + c2) / 2
+    h_bar = h1 + h2
+    if c1 * c2:
+        h_bar = (h1 + h2) / 2 if abs(h1 - h2) <= 180 else (h1 + h2 + (360 if h1 + h2 < 360 else -360)) / 2
+    t = (1 - 0.17 * np.cos(np.radians(h_bar - 30)) + 0.24 * np.cos(np.radians(2 * h_bar))
+         + 0.32 * np.cos(np.radians(3 * h_bar + 6)) - 0.20 * np.cos(np.radians(4 * h_bar - 63)))
+    s_l = 1 + 0.015 * (l_bar - 50) ** 2 / np.sqrt(20 + (l_bar - 50) ** 2)
+    s_c = 1 + 0.045 * c_bar
+    s_h = 1 + 0.015 * c_bar * t
+    r_t = (-np.sin(np.radians(60 * np.exp(-((h_bar - 275) / 25) ** 2)))
+           * 2 * np.sqrt(c_bar ** 7 / (c_bar ** 7 + 25 ** 7)))
+    return float(np.sqrt(
+        (d_l / s_l) ** 2 + (d_c / s_c) ** 2 + (d_h / s_h) ** 2 + r_t * (d_c / s_c) * (d_h / s_h)
+    ))
@@ -0,0 +1,99 @@
+"""Рендер в выходном размере против рендера 1024x1280 с уменьшением.
+
+Стадии после rmbg (маска, инпейнтинг, фон, цвета, композиция, градиент,
+resize) выполняются в обоих режимах на одних и тех же синтетических
+входах; результат режима render_at_target сравнивается с текущим выходом
+по PSNR и SSIM, время - по CPU.
+
+Примеры:
+    python -m imageflow.benchmarks.render_scale
+    python -m imageflow.benchmarks.render_scale --size 256x320 --concepts v1 --coverages 0.9 --min-ssim 0.99
+"""
+import argparse
+import contextlib
+import io
+import sys
+from typing import Dict, List, Optional, Tuple
+
+from ..outputs import RENDER_SIZE, parse_size
+from .quality import psnr, ssim
+from .runner import measure
+from .synthetic import make_image, make_mask, make_foreground
+
+
+def _render_once(image, foreground, alpha, concept: str, size: Tuple[int, int], render_size: Tuple[int, int]):
+    from ..pipeline import _build_layers, _render_concept
+
+    layers = _build_layers(image, foreground, alpha, render_size)
+    return _render_concept(layers, concept, [size])[size]
+
+
+def compare_modes(
+    size: Tuple[int, int],
+    concepts: List[str],
+    coverages: List[float],
+    repeat: int
+) -> List[Dict]:
+    side = RENDER_SIZE[0]
+    results = []
+    for coverage in coverages:
+        image = make_image(side, side)
+        # Маска персонажа: центр кадра, как у rmbg (белое = объект)
+        foreground, alpha = make_foreground(image, 255 - make_mask(side, side, coverage))
+        for concept in concepts:
+            outputs = {}
+            stats = {}
+            for mode, render_size in (("full", RENDER_SIZE), ("target", size)):
+                def run(render_size=render_size):
+                    outputs[mode] = _render_once(image, foreground, alpha, concept, size, render_size)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    stats[mode] = measure(run, repeat=repeat, warmup=0)
+
+            result = {
+                "concept": concept,
+                "coverage": coverage,
+                "psnr_db": psnr(outputs["full"], outputs["target"]),
+                "ssim": ssim(outputs["full"], outputs["target"]),
+                "cpu_ms_full": stats["full"]["cpu_ms_median"],
+                "cpu_ms_target": stats["target"]["cpu_ms_median"],
+            }
+            results.append(result)
+            print(
+                f"[RenderScale] {concept} coverage={coverage}: PSNR {result['psnr_db']:.1f} дБ, "
+                f"SSIM {result['ssim']:.4f}, cpu {result['cpu_ms_full']:.0f} -> {result['cpu_ms_target']:.0f} мс "
+                f"(x{result['cpu_ms_full'] / max(result['cpu_ms_target'], 1e-9):.1f})",
+                flush=True
+            )
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Качество и CPU рендера в выходном размере против 1024x1280")
+    parser.add_argument("--size", default="512x640", help="Выходной размер WxH")
+    parser.add_argument("--concepts", default="v1,v2", help="Концепции через запятую")
+    parser.add_argument("--coverages", default="0.8,0.9", help="Доли кадра, занятые персонажем, через запятую")
+    parser.add_argument("--repeat", type=int, default=1, help="Количество замеров на режим")
+    parser.add_argument("--min-psnr", type=float, default=None, help="Минимально допустимый PSNR, дБ")
+    parser.add_argument("--min-ssim", type=float, default=None, help="Минимально допустимый SSIM")
+    args = parser.parse_args(argv)
+
+    results = compare_modes(
+        parse_size(args.size),
+        concepts=[c.strip() for c in args.concepts.split(",") if c.strip()],
+        coverages=[float(c) for c in args.coverages.split(",")],
+        repeat=args.repeat
+    )
+
+    failed = [
+        r for r in results
+        if (args.min_psnr is not None and r["psnr_db"] < args.min_psnr)
+        or (args.min_ssim is not None and r["ssim"] < args.min_ssim)
+    ]
+    if failed:
+        print(f"[RenderScale] Ниже порога качества: {len(failed)} из {len(results)}", flush=True)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
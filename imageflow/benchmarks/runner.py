@@ -0,0 +1,80 @@
+"""Замер стадии: wall time, CPU time и пиковая память."""
+import gc
+import statistics
+import time
+import tracemalloc
+from typing import Callable, Dict, Optional
+
+
+def _read_status_kb(field: str) -> Optional[int]:
+    """Прочитать значение из /proc/self/status в килобайтах (только Linux)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def _reset_peak_rss() -> bool:
+    """Сбросить VmHWM (пиковый RSS процесса). Возвращает False, если ядро не позволяет."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def measure(fn: Callable[[], object], repeat: int = 3, warmup: int = 1) -> Dict[str, Optional[float]]:
+    """
+    Выполнить fn несколько раз и собрать статистику.
+    
+    Пиковая память считается двумя способами:
+    - peak_traced_mb: пик аллокаций, видимых tracemalloc (Python объекты и буферы NumPy);
+    - peak_rss_mb: прирост пикового RSS над RSS до запуска (ловит и аллокации OpenCV/Pillow/ONNX),
+      если ядро позволяет сбросить VmHWM; иначе None.
+    
+    Returns:
+        dict с wall_ms_* / cpu_ms_* (min, median, mean) и пиковой памятью
+    """
+    for _ in range(warmup):
+        fn()
+    
+    wall, cpu = [], []
+    peak_traced = 0
+    peak_rss_delta = None
+    
+    for _ in range(repeat):
+        gc.collect()
+        rss_reset = _reset_peak_rss()
+        rss_before = _read_status_kb("VmRSS")
+        tracemalloc.start()
+        
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        fn()
+        cpu.append((time.process_time() - cpu_start) * 1000)
+        wall.append((time.perf_counter() - wall_start) * 1000)
+        
+        _, traced = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        peak_traced = max(peak_traced, traced)
+        
+        hwm = _read_status_kb("VmHWM")
+        if rss_reset and hwm is not None and rss_before is not None:
+            delta = max(hwm - rss_before, 0) / 1024
+            peak_rss_delta = delta if peak_rss_delta is None else max(peak_rss_delta, delta)
+    
+    return {
+        "wall_ms_min": min(wall),
+        "wall_ms_median": statistics.median(wall),
+        "wall_ms_mean": statistics.fmean(wall),
+        "cpu_ms_min": min(cpu),
+        "cpu_ms_median": statistics.median(cpu),
+        "cpu_ms_mean": statistics.fmean(cpu),
+        "peak_traced_mb": peak_traced / (1024 * 1024),
+        "peak_rss_mb": peak_rss_delta,
+    }
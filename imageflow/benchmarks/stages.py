@@ -0,0 +1,125 @@
+"""Определения стадий для бенчмарка.
+
+Каждая стадия - функция setup(size, coverage), которая готовит входы вне
+замера и возвращает callable без аргументов, выполняющий только саму стадию
+с теми же параметрами, что и full_pipeline.
+"""
+import cv2
+from PIL import Image
+from typing import Callable, Dict, Optional
+
+from ..masks import grow_mask_and_blur, invert_mask
+from ..inpaint import inpaint_image
+from ..colors import extract_main_colors
+from ..gradient import create_gradient_background
+from ..compose import composite_images, apply_gradient_overlay
+from ..utils import pil_to_bytes, decode_image
+from .synthetic import make_image, make_mask, make_foreground
+
+
+def _canvas_size(size: int):
+    """Размер холста с панелью (1024x1280 для size=1024)."""
+    return size, size * 5 // 4
+
+
+def setup_remove_background(size: int, coverage: Optional[float]) -> Callable[[], object]:
+    from ..rmbg import remove_background
+    image = make_image(size, size)
+    return lambda: remove_background(image, model="u2net")
+
+
+def setup_grow_mask_and_blur(size: int, coverage: Optional[float]) -> Callable[[], object]:
+    alpha = 255 - make_mask(size, size, coverage)
+    return lambda: grow_mask_and_blur(invert_mask(alpha), grow_pixels=7, blur_size=5)
+
+
+def setup_inpaint_image(size: int, coverage: Optional[float]) -> Callable[[], object]:
+    import numpy as np
+    image = np.array(make_image(size, size))
+    mask = grow_mask_and_blur(make_mask(size, size, coverage), grow_pixels=7, blur_size=5)
+    return lambda: inpaint_image(image, mask, method=cv2.INPAINT_TELEA, inpaint_radius=64, blur_after=0)
+
+
+def setup_extract_main_colors(size: int, coverage: Optional[float]) -> Callable[[], object]:
+    image = make_image(size, size)
+    mask = make_mask(size, size, coverage)
+    return lambda: extract_main_colors(image, num_colors=2, random_state=42, algorithm="elkan", mask=mask)
+
+
+def setup_create_gradient_background(size: int, coverage: Optional[float]) -> Callable[[], object]:
+    width, height = _canvas_size(size)
+    return lambda: create_gradient_background(
+        width, height, "#3a5f8c", "#3a5f8c", direction="vertical", interpolation="linear_rgb"
+    )
+
+
+def setup_composite(size: int, coverage: Optional[float]) -> Callable[[], object]:
+    width, height = _canvas_size(size)
+    background = make_image(width, height, seed=1)
+    foreground, alpha = make_foreground(make_image(width, height, seed=2), make_mask(width, height, coverage))
+    gradient = create_gradient_background(width, height, "#3a5f8c", "#3a5f8c")
+    
+    def run():
+        base = composite_images(background, foreground, alpha)
+        return apply_gradient_overlay(base, gradient, opacity=0.7)
+    return run
+
+
+def setup_resize(size: int, coverage: Optional[float]) -> Callable[[], object]:
+    width, height = _canvas_size(size)
+    image = make_image(width, height)
+    return lambda: image.resize((width // 2, height // 2), Image.Resampling.LANCZOS)
+
+
+def setup_pil_to_bytes(size: int, coverage: Optional[float]) -> Callable[[], object]:
+    width, height = _canvas_size(size)
+    image = make_image(width // 2, height // 2)
+    return lambda: pil_to_bytes(image, format="PNG")
+
+
+def _encoded_source(size: int, fmt: str) -> bytes:
+    """Закодированный исходник size x 3/4*size (генерируем меньше и растягиваем - так дешевле)."""
+    import io
+    width, height = size, size * 3 // 4
+    base = make_image(min(width, 1024), min(height, 768))
+    if base.size != (width, height):
+        base = base.resize((width, height), Image.Resampling.BICUBIC)
+    buf = io.BytesIO()
+    base.save(buf, format=fmt, **({"quality": 90} if fmt == "JPEG" else {}))
+    return buf.getvalue()
+
+
+def _cover_resize(image: Image.Image, target=(1024, 1024)) -> Image.Image:
+    """Cover-resize + центральный crop, как в fallback-ветке full_pipeline."""
+    ratio = max(target[0] / image.size[0], target[1] / image.size[1])
+    new_size = (int(image.size[0] * ratio), int(image.size[1] * ratio))
+    image = image.resize(new_size, Image.Resampling.LANCZOS)
+    left, top = (new_size[0] - target[0]) // 2, (new_size[1] - target[1]) // 2
+    return image.crop((left, top, left + target[0], top + target[1]))
+
+
+def _setup_decode(fmt: str, reduced: bool):
+    def setup(size: int, coverage: Optional[float]) -> Callable[[], object]:
+        data = _encoded_source(size, fmt)
+        target = (1024, 1024) if reduced else None
+        return lambda: _cover_resize(decode_image(data, target))
+    return setup
+
+
+# имя -> (setup, зависит ли стадия от покрытия маски)
+STAGES: Dict[str, tuple] = {
+    "remove_background": (setup_remove_background, False),
+    "grow_mask_and_blur": (setup_grow_mask_and_blur, True),
+    "inpaint_image": (setup_inpaint_image, True),
+    "extract_main_colors": (setup_extract_main_colors, True),
+    "create_gradient_background": (setup_create_gradient_background, False),
+    "composite": (setup_composite, True),
+    "resize": (setup_resize, False),
+    "pil_to_bytes": (setup_pil_to_bytes, False),
+    # Декодирование исходника до рабочих 1024x1024: полное vs уменьшение при декодировании
+    # (имеет смысл при --sizes больше 2048, например 4000,8000)
+    "decode_jpeg_full": (_setup_decode("JPEG", reduced=False), False),
+    "decode_jpeg_reduced": (_setup_decode("JPEG", reduced=True), False),
+    "decode_png_full": (_setup_decode("PNG", reduced=False), False),
+    "decode_png_reduced": (_setup_decode("PNG", reduced=True), False),
+}
@@ -0,0 +1,70 @@
+"""Генерация детерминированных синтетических входов для бенчмарков."""
+import numpy as np
+from PIL import Image
+from typing import Tuple
+
+
+def make_image(width: int, height: int, seed: int = 0) -> Image.Image:
+    """
+    Синтетическая «обложка»: вертикальный градиент, крупные цветные пятна и шум.
+    
+    Содержимое похоже на реальный арт достаточно, чтобы KMeans, инпейнтинг
+    и PNG/JPEG кодеки работали в типичном режиме (не на плоской заливке).
+    """
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    
+    top = rng.integers(0, 256, 3).astype(np.float32)
+    bottom = rng.integers(0, 256, 3).astype(np.float32)
+    t = (y / max(height - 1, 1))[..., None]
+    arr = top * (1 - t) + bottom * t
+    
+    # Несколько размытых цветных пятен
+    for _ in range(6):
+        cx, cy = rng.uniform(0, width), rng.uniform(0, height)
+        radius = rng.uniform(0.1, 0.35) * min(width, height)
+        color = rng.integers(0, 256, 3).astype(np.float32)
+        weight = np.exp(-((x - cx) ** 2 + (y - cy) ** 2) / (2 * radius ** 2))[..., None]
+        arr = arr * (1 - weight) + color * weight
+    
+    arr += rng.normal(0, 6, arr.shape).astype(np.float32)
+    return Image.fromarray(np.clip(arr, 0, 255).astype(np.uint8), "RGB")
+
+
+def make_mask(width: int, height: int, coverage: float) -> np.ndarray:
+    """
+    Маска (H, W) uint8 с эллипсом по центру, занимающим долю `coverage` кадра.
+    
+    coverage близкая к 1 даёт почти полностью белую маску (крайний случай
+    инпейнтинга, когда rmbg не нашёл объект).
+    """
+    coverage = float(np.clip(coverage, 0.0, 1.0))
+    mask = np.zeros((height, width), dtype=np.uint8)
+    if coverage <= 0:
+        return mask
+    if coverage >= 1:
+        mask[:] = 255
+        return mask
+    
+    # Площадь эллипса с полуосями a=k*w/2, b=k*h/2 равна pi*k^2*w*h/4
+    k = np.sqrt(coverage * 4 / np.pi)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    nx = (x - width / 2) / (k * width / 2)
+    ny = (y - height / 2) / (k * height / 2)
+    mask[nx ** 2 + ny ** 2 <= 1] = 255
+    
+    if k > 1:
+        # Эллипс вылезает за кадр - добираем покрытие ближайшими к нему пикселями углов
+        need = int(coverage * width * height) - int((mask > 0).sum())
+        if need > 0:
+            dist = np.where(mask > 0, np.inf, nx ** 2 + ny ** 2).ravel()
+            mask.ravel()[np.argsort(dist)[:need]] = 255
+    return mask
+
+
+def make_foreground(image: Image.Image, mask: np.ndarray) -> Tuple[Image.Image, np.ndarray]:
+    """RGBA «персонаж» в формате remove_background: изображение + альфа (белое = объект)."""
+    alpha = 255 - mask
+    foreground = image.convert("RGBA")
+    foreground.putalpha(Image.fromarray(alpha, "L"))
+    return foreground, alpha
@@ -0,0 +1,166 @@
+"""Пропускная способность при разных разбиениях ядер между рендерами.
+
+Разбиение "CxT" - C одновременных рендеров по T потоков каждой библиотеки
+(OpenCV, ONNX Runtime, BLAS/OpenMP, см. imageflow/thread_budget.py). Каждое
+разбиение запускается в отдельном процессе (пулы библиотек настраиваются
+один раз на процесс): C потоков выполняют стадии после Seedream на
+синтетических входах, пока не обработают --jobs рендеров. Для каждого
+разбиения - рендеров в минуту и перцентили задержки рендера.
+
+Примеры:
+    python -m imageflow.benchmarks.threads
+    python -m imageflow.benchmarks.threads --splits 1x8,2x4,4x2,8x1,4x8 --jobs 16 --output threads.json
+    python -m imageflow.benchmarks.threads --with-rmbg --size 1024x1280
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from ..outputs import parse_size
+from ..thread_budget import available_cpus
+
+
+def parse_split(value: str) -> Tuple[int, int]:
+    """ "CxT" -> (рендеров, потоков на рендер)."""
+    concurrency, _, threads = value.lower().partition("x")
+    concurrency, threads = int(concurrency), int(threads)
+    if concurrency < 1 or threads < 1:
+        raise ValueError(f"Разбиение должно быть CxT с C, T >= 1: {value}")
+    return concurrency, threads
+
+
+def default_splits(cpus: int) -> List[Tuple[int, int]]:
+    """Разбиения ядер без переподписки (1xN, 2xN/2, ..., Nx1) и одно с переподпиской NxN."""
+    splits = []
+    concurrency = 1
+    while concurrency <= cpus:
+        splits.append((concurrency, max(1, cpus // concurrency)))
+        concurrency *= 2
+    if cpus > 1:
+        splits.append((cpus, cpus))
+    return splits
+
+
+def _worker(size: Tuple[int, int], concurrency: int, jobs: int, with_rmbg: bool, coverage: float) -> Dict:
+    """Выполнить jobs рендеров в concurrency потоков текущего процесса."""
+    from ..pipeline import _build_layers, _render_concept
+    from ..thread_budget import apply
+    from .synthetic import make_foreground, make_image, make_mask
+
+    budget = apply()
+    width, height = size
+    image = make_image(width, height)
+    foreground, alpha = make_foreground(image, 255 - make_mask(width, height, coverage))
+
+    def render() -> float:
+        start = time.perf_counter()
+        if with_rmbg:
+            from ..rmbg import remove_background
+            fg, mask = remove_background(image)
+            layers = _build_layers(image, fg, mask, size)
+        else:
+            layers = _build_layers(image, foreground, alpha, size)
+        _render_concept(layers, "v1", [size])
+        return time.perf_counter() - start
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        # Прогрев: загрузка моделей, кэши шрифтов и ядер
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(lambda _: render(), range(concurrency)))
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            latencies = list(pool.map(lambda _: render(), range(jobs)))
+        wall = time.perf_counter() - start
+
+    return {
+        "budget": budget.as_dict(),
+        "jobs": jobs,
+        "wall_s": wall,
+        "renders_per_min": jobs / wall * 60,
+        "latency_p50_s": float(np.percentile(latencies, 50)),
+        "latency_p95_s": float(np.percentile(latencies, 95)),
+    }
+
+
+def run_split(
+    concurrency: int,
+    threads: int,
+    cpus: int,
+    size: Tuple[int, int],
+    jobs: int,
+    with_rmbg: bool,
+    coverage: float
+) -> Dict:
+    """Замерить одно разбиение в отдельном процессе с бюджетом из переменных окружения."""
+    env = dict(
+        os.environ,
+        IMAGEFLOW_THREADS_CPUS=str(cpus),
+        IMAGEFLOW_THREADS_CONCURRENCY=str(concurrency),
+        IMAGEFLOW_THREADS_PER_REQUEST=str(threads),
+    )
+    for library in ("OPENCV", "ORT", "BLAS"):
+        env.pop(f"IMAGEFLOW_THREADS_{library}", None)
+    command = [
+        sys.executable, "-m", "imageflow.benchmarks.threads", "--worker",
+        "--size", f"{size[0]}x{size[1]}", "--concurrency", str(concurrency),
+        "--jobs", str(jobs), "--coverage", str(coverage),
+    ] + (["--with-rmbg"] if with_rmbg else [])
+    completed = subprocess.run(command, env=env, stdout=subprocess.PIPE, text=True, check=True)
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result.update({"split": f"{concurrency}x{threads}", "concurrency": concurrency, "threads": threads})
+    return result
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Пропускная способность ImageFlow при разных разбиениях потоков")
+    parser.add_argument("--splits", help="Разбиения CxT через запятую (по умолчанию 1xN, 2xN/2, ..., Nx1, NxN)")
+    parser.add_argument("--cpus", type=int, default=None, help="Ядер для разбиения (по умолчанию доступные процессу)")
+    parser.add_argument("--size", default="512x640", help="Размер рендера WxH")
+    parser.add_argument("--jobs", type=int, default=None, help="Рендеров на разбиение (по умолчанию 2 x max(C, 4))")
+    parser.add_argument("--coverage", type=float, default=0.8, help="Доля кадра, занятая синтетическим персонажем")
+    parser.add_argument("--with-rmbg", action="store_true", help="Включить rmbg (ONNX Runtime) в каждый рендер")
+    parser.add_argument("--output", help="Файл для результатов (JSON)")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--concurrency", type=int, default=1, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    size = parse_size(args.size)
+    if args.worker:
+        print(json.dumps(_worker(size, args.concurrency, args.jobs, args.with_rmbg, args.coverage)), flush=True)
+        return 0
+
+    cpus = args.cpus or available_cpus()
+    splits = [parse_split(s) for s in args.splits.split(",")] if args.splits else default_splits(cpus)
+    results = []
+    for concurrency, threads in splits:
+        jobs = args.jobs or 2 * max(concurrency, 4)
+        result = run_split(concurrency, threads, cpus, size, jobs, args.with_rmbg, args.coverage)
+        results.append(result)
+        print(
+            f"[Threads] {result['split']}: {result['renders_per_min']:.1f} рендеров/мин, "
+            f"p50 {result['latency_p50_s']:.2f}с, p95 {result['latency_p95_s']:.2f}с "
+            f"({jobs} рендеров за {result['wall_s']:.1f}с)",
+            flush=True
+        )
+
+    best = max(results, key=lambda r: r["renders_per_min"])
+    print(f"[Threads] Лучшая пропускная способность: {best['split']} на {cpus} ядрах", flush=True)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"cpus": cpus, "size": args.size, "with_rmbg": args.with_rmbg, "results": results},
+                      f, indent=2, ensure_ascii=False)
+        print(f"[Threads] Результаты сохранены в {args.output}", flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
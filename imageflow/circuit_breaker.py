@@ -0,0 +1,231 @@
+"""Circuit breaker для внешних сервисов (Seedream/fal).
+
+Состояния:
+- closed - вызовы проходят, в скользящем окне считаются ошибки и медленные вызовы;
+- open - доля ошибок или медленных вызовов превысила порог: вызовы сразу
+  отклоняются CircuitOpenError (пайплайн уходит в fallback без ретраев и ожиданий);
+- half_open - после IMAGEFLOW_BREAKER_OPEN_SECONDS пропускается несколько
+  пробных вызовов: все успешны - closed, любая ошибка - снова open.
+
+Вызов, прерванный не по вине сервиса (отмена ветки хеджирования, дедлайн
+запроса), не учитывается: пробный вызов возвращает слот, breaker остаётся half_open.
+
+Переменные окружения:
+- IMAGEFLOW_BREAKER_WINDOW - окно статистики, секунды (по умолчанию 60)
+- IMAGEFLOW_BREAKER_MIN_CALLS - минимум вызовов в окне для решения (по умолчанию 10)
+- IMAGEFLOW_BREAKER_ERROR_RATE - доля ошибок для размыкания (по умолчанию 0.5)
+- IMAGEFLOW_BREAKER_SLOW_CALL_SECONDS - порог медленного вызова (по умолчанию 15)
+- IMAGEFLOW_BREAKER_SLOW_RATE - доля медленных вызовов для размыкания (по умолчанию 0.8)
+- IMAGEFLOW_BREAKER_OPEN_SECONDS - сколько держать open до пробных вызовов (по умолчанию 30)
+- IMAGEFLOW_BREAKER_HALF_OPEN_CALLS - число пробных вызовов в half_open (по умолчанию 3)
+"""
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+import requests
+
+from .deadline import DeadlineExceeded
+from .hedging import HedgeCancelled
+from .metrics import counter, gauge
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Значения гейджа imageflow_circuit_state
+_STATE_VALUES = {CLOSED: 0, OPEN: 1, HALF_OPEN: 2}
+
+CIRCUIT_STATE = gauge(
+    "imageflow_circuit_state",
+    "Состояние circuit breaker: 0=closed, 1=open, 2=half_open",
+    ["breaker"]
+)
+CIRCUIT_TRANSITIONS_TOTAL = counter(
+    "imageflow_circuit_transitions_total",
+    "Переходы circuit breaker в состояние",
+    ["breaker", "state"]
+)
+CIRCUIT_CALLS_TOTAL = counter(
+    "imageflow_circuit_calls_total",
+    "Вызовы через circuit breaker по результату",
+    ["breaker", "result"]
+)
+
+
+class CircuitOpenError(RuntimeError):
+    """Вызов отклонён: circuit breaker разомкнут."""
+
+
+def is_upstream_failure(error: BaseException) -> bool:
+    """
+    Считать ли ошибку сбоем сервиса.
+
+    Ответы 4xx (кроме 408 и 429) - проблема конкретного запроса (например, 422
+    по content policy), а не недоступность сервиса.
+    """
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        return status >= 500 or status in (408, 429)
+    return isinstance(error, (requests.RequestException, OSError))
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker со скользящим окном по времени.
+
+    Args:
+        name: Имя для метрик и логов
+    """
+
+    def __init__(
+        self,
+        name: str,
+        window: float = 60.0,
+        min_calls: int = 10,
+        error_rate: float = 0.5,
+        slow_call_seconds: float = 15.0,
+        slow_rate: float = 0.8,
+        open_seconds: float = 30.0,
+        half_open_calls: int = 3
+    ):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self._calls = deque()  # (время, ошибка, медленный)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes_started = 0
+        self._probes_succeeded = 0
+        # Номер периода half_open: вернуть слот можно только пробе того же периода
+        self._half_open_round = 0
+        self._lock = threading.Lock()
+        CIRCUIT_STATE.set(_STATE_VALUES[CLOSED], breaker=name)
+
+    @classmethod
+    def from_env(cls, name: str) -> "CircuitBreaker":
+        return cls(
+            name,
+            window=float(os.getenv("IMAGEFLOW_BREAKER_WINDOW", 60)),
+            min_calls=int(os.getenv("IMAGEFLOW_BREAKER_MIN_CALLS", 10)),
+            error_rate=float(os.getenv("IMAGEFLOW_BREAKER_ERROR_RATE", 0.5)),
+            slow_call_seconds=float(os.getenv("IMAGEFLOW_BREAKER_SLOW_CALL_SECONDS", 15)),
+            slow_rate=float(os.getenv("IMAGEFLOW_BREAKER_SLOW_RATE", 0.8)),
+            open_seconds=float(os.getenv("IMAGEFLOW_BREAKER_OPEN_SECONDS", 30)),
+            half_open_calls=int(os.getenv("IMAGEFLOW_BREAKER_HALF_OPEN_CALLS", 3))
+        )
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._maybe_half_open(time.monotonic())
+            return self._state
+
+    def _transition(self, state: str, reason: str = "") -> None:
+        # Вызывается под self._lock
+        if state == self._state:
+            return
+        print(f"[CircuitBreaker] {self.name}: {self._state} -> {state}{f' ({reason})' if reason else ''}", flush=True)
+        self._state = state
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        if state == HALF_OPEN:
+            self._probes_started = 0
+            self._probes_succeeded = 0
+            self._half_open_round += 1
+        if state == CLOSED:
+            self._calls.clear()
+        CIRCUIT_STATE.set(_STATE_VALUES[state], breaker=self.name)
+        CIRCUIT_TRANSITIONS_TOTAL.inc(breaker=self.name, state=state)
+
+    def _maybe_half_open(self, now: float) -> None:
+        if self._state == OPEN and now - self._opened_at >= self.open_seconds:
+            self._transition(HALF_OPEN, f"прошло {self.open_seconds:.0f}с")
+
+    def allow(self) -> Optional[int]:
+        """
+        Разрешить вызов или отклонить его.
+
+        Returns:
+            Номер периода half_open, если вызов пробный (для release_probe), иначе None
+
+        Raises:
+            CircuitOpenError: breaker разомкнут или пробные вызовы half_open уже выданы
+        """
+        with self._lock:
+            self._maybe_half_open(time.monotonic())
+            if self._state == CLOSED:
+                return None
+            if self._state == HALF_OPEN and self._probes_started < self.half_open_calls:
+                self._probes_started += 1
+                return self._half_open_round
+            state = self._state
+            retry_in = max(0.0, self.open_seconds - (time.monotonic() - self._opened_at))
+        CIRCUIT_CALLS_TOTAL.inc(breaker=self.name, result="rejected")
+        raise CircuitOpenError(
+            f"{self.name} недоступен (circuit breaker {state}, повторная проверка через {retry_in:.0f}с)"
+        )
+
+    def record(self, failed: bool, duration: float) -> None:
+        """Учесть результат разрешённого вызова."""
+        slow = duration >= self.slow_call_seconds
+        CIRCUIT_CALLS_TOTAL.inc(breaker=self.name, result="failure" if failed else ("slow" if slow else "success"))
+        now = time.monotonic()
+        with self._lock:
+            if self._state == HALF_OPEN:
+                if failed or slow:
+                    self._transition(OPEN, "пробный вызов неудачен" if failed else "пробный вызов медленный")
+                else:
+                    self._probes_succeeded += 1
+                    if self._probes_succeeded >= self.half_open_calls:
+                        self._transition(CLOSED, "пробные вызовы успешны")
+                return
+            if self._state != CLOSED:
+                return
+
+            self._calls.append((now, failed, slow))
+            while self._calls and now - self._calls[0][0] > self.window:
+                self._calls.popleft()
+            total = len(self._calls)
+            if total < self.min_calls:
+                return
+            failures = sum(1 for _, f, _ in self._calls if f)
+            slow_calls = sum(1 for _, _, s in self._calls if s)
+            if failures / total >= self.error_rate:
+                self._transition(OPEN, f"ошибок {failures}/{total} за {self.window:.0f}с")
+            elif slow_calls / total >= self.slow_rate:
+                self._transition(OPEN, f"медленных вызовов {slow_calls}/{total} за {self.window:.0f}с")
+
+    def release_probe(self, probe: Optional[int]) -> None:
+        """Не учитывать прерванный вызов: пробный вызов того же периода half_open возвращает слот."""
+        CIRCUIT_CALLS_TOTAL.inc(breaker=self.name, result="cancelled")
+        with self._lock:
+            if probe is not None and self._state == HALF_OPEN and probe == self._half_open_round:
+                self._probes_started = max(self._probes_succeeded, self._probes_started - 1)
+
+    @contextmanager
+    def call(self) -> Iterator[None]:
+        """Выполнить вызов под защитой breaker: allow() до, record() после."""
+        probe = self.allow()
+        started = time.monotonic()
+        try:
+            yield
+        except (HedgeCancelled, DeadlineExceeded):
+            # Прерван не сервисом - ни успех, ни сбой
+            self.release_probe(probe)
+            raise
+        except BaseException as e:
+            self.record(is_upstream_failure(e), time.monotonic() - started)
+            raise
+        self.record(False, time.monotonic() - started)
+
+
+SEEDREAM_BREAKER = CircuitBreaker.from_env("seedream")
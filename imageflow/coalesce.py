@@ -0,0 +1,181 @@
+"""Объединение одинаковых одновременных рендеров (single-flight).
+
+При запуске новой игры фронтенды за секунды шлют много одинаковых /render
+для одного image_url и концепции; каждый запускал свой Seedream и полный
+CPU-пайплайн. Теперь первый запрос с данным ключом (нормализованные
+параметры, влияющие на результат) вычисляет ответ, а одновременные дубликаты
+ждут его же результат, включая ошибку (каждый ожидающий получает свою копию
+исключения с исходным в __cause__, чтобы трейсбеки запросов не смешивались). Результат не кэшируется: после
+завершения первого запроса следующий с тем же ключом считает заново.
+
+Ожидающий запрос ограничен своим дедлайном (DeadlineExceeded -> 504) и не
+резервирует память - её держит только вычисляющий запрос. Слот
+планировщика тоже занимает только он: ожидающий с более высоким классом
+приоритета повышает класс его заявки (scheduler.promote). Результат или
+ошибка, на которые повлиял дедлайн вычисляющего запроса (fallback без
+Seedream, DeadlineExceeded и т.п., см. deadline.track_shortfall), не
+отдаются ожидающим с более поздним дедлайном: такие запросы считают заново.
+
+Переменные окружения:
+- IMAGEFLOW_COALESCE - объединять одинаковые запросы (по умолчанию включено, 0 - выключить)
+"""
+import os
+import threading
+from typing import Callable, Dict, Hashable, Optional, Sequence, Tuple, TypeVar
+from urllib.parse import urlsplit, urlunsplit
+
+from . import deadline, scheduler
+from .metrics import counter, gauge
+from .tracing import span
+
+T = TypeVar("T")
+
+COALESCE_TOTAL = counter(
+    "imageflow_coalesce_total",
+    "Запросы /render по роли в объединении: leader вычисляет, coalesced ждёт его результат, "
+    "rerun - результат урезан дедлайном leader и считается заново",
+    ["role"]
+)
+COALESCE_IN_FLIGHT = gauge(
+    "imageflow_coalesce_in_flight",
+    "Уникальные вычисляемые сейчас ключи объединения"
+)
+
+
+def enabled() -> bool:
+    return os.getenv("IMAGEFLOW_COALESCE", "1").lower() not in ("0", "false", "no", "off")
+
+
+def normalize_url(url: str) -> str:
+    """URL для ключа: схема и хост в нижнем регистре, без фрагмента и порта по умолчанию."""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and (scheme, parts.port) not in (("http", 80), ("https", 443)):
+        host = f"{host}:{parts.port}"
+    if parts.username or parts.password:
+        host = f"{parts.username or ''}:{parts.password or ''}@{host}"
+    return urlunsplit((scheme, host, parts.path or "/", parts.query, ""))
+
+
+def request_key(
+    image_url: str,
+    concepts: Sequence[str],
+    sizes: Sequence[Tuple[int, int]],
+    render_at_target: bool,
+    text: Optional[Tuple[str, str]] = None,
+    seed: int = 0
+) -> Tuple:
+    """
+    Ключ объединения: только то, что влияет на байты ответа пайплайна.
+
+    Название игры и провайдер входят в ключ, только если текст накладывается
+    (иначе они меняют лишь имя файла, которое каждый запрос считает сам).
+    """
+    return (normalize_url(image_url), tuple(concepts), tuple(sizes), bool(render_at_target), text, seed)
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters", "deadline", "cut_short", "claim")
+
+    def __init__(self, deadline_at: Optional[float], claim: Optional[scheduler.Claim]):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+        # Дедлайн вычисляющего запроса и повлиял ли он на результат
+        self.deadline = deadline_at
+        self.cut_short = False
+        # Заявка вычисляющего запроса на слот планировщика
+        self.claim = claim
+
+    def shareable_with(self, deadline_at: Optional[float]) -> bool:
+        """Можно ли отдать результат запросу с дедлайном deadline_at (None - без дедлайна)."""
+        if not self.cut_short:
+            return True
+        return deadline_at is not None and self.deadline is not None and deadline_at <= self.deadline
+
+
+def _copy_error(error: BaseException) -> BaseException:
+    """
+    Копия исключения того же типа с теми же args и атрибутами, но без трейсбека.
+
+    Конструктор не вызывается: его сигнатура может не совпадать с args
+    (например, у HTTPException).
+    """
+    fresh = type(error).__new__(type(error), *error.args)
+    fresh.args = error.args
+    fresh.__dict__.update(error.__dict__)
+    return fresh
+
+
+class SingleFlight:
+    """Не больше одного выполнения на ключ одновременно; остальные ждут его результат."""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], T], claim: Optional[scheduler.Claim] = None) -> Tuple[T, bool]:
+        """
+        Выполнить fn или дождаться уже идущего выполнения с тем же ключом.
+
+        claim - заявка запроса на слот планировщика: у вычисляющего запроса её
+        класс повышают ожидающие с более высоким классом.
+
+        Returns:
+            (результат, True если результат получен от другого запроса)
+
+        Raises:
+            Исключение fn (и у ожидавших), DeadlineExceeded - дедлайн ожидающего истёк
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call(deadline.current(), claim)
+                COALESCE_IN_FLIGHT.set(len(self._calls))
+            else:
+                call.waiters += 1
+
+        if not leader:
+            COALESCE_TOTAL.inc(role="coalesced")
+            if claim is not None and call.claim is not None:
+                # Вычисляющий запрос может ещё стоять в очереди с более низким классом
+                scheduler.promote(call.claim, claim.priority)
+            with span("coalesced_wait", waiters=call.waiters):
+                if not call.done.wait(deadline.remaining()):
+                    deadline.DEADLINE_EXCEEDED_TOTAL.inc(stage="coalesced_wait")
+                    raise deadline.DeadlineExceeded("coalesced_wait")
+            if not call.shareable_with(deadline.current()):
+                # Результат урезан более коротким дедлайном - у этого запроса времени больше
+                COALESCE_TOTAL.inc(role="rerun")
+                print(f"[Coalesce] Результат одинакового запроса урезан его дедлайном, считаем заново", flush=True)
+                return self.do(key, fn, claim)
+            if call.error is not None:
+                raise _copy_error(call.error) from call.error
+            return call.result, True
+
+        COALESCE_TOTAL.inc(role="leader")
+        try:
+            with deadline.track_shortfall() as shortfall:
+                try:
+                    call.result = fn()
+                finally:
+                    call.cut_short = shortfall.hit
+        except BaseException as e:
+            call.error = e
+            if isinstance(e, deadline.DeadlineExceeded):
+                call.cut_short = True
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                COALESCE_IN_FLIGHT.set(len(self._calls))
+            call.done.set()
+            if call.waiters:
+                print(f"[Coalesce] Результат отдан ещё {call.waiters} одинаковым запросам", flush=True)
+        return call.result, False
+
+
+RENDERS = SingleFlight()
@@ -4,19 +4,21 @@ from sklearn.cluster import KMeans
 from PIL import Image
 from typing import List, Tuple
 
+from .frame import ImageLike, as_array
+
 
 def extract_main_colors(
-    image: Image.Image,
+    image: ImageLike,
     num_colors: int = 2,
     random_state: int = 42,
     algorithm: str = "elkan",
-    mask: np.ndarray = None
+    mask: ImageLike = None
 ) -> List[Tuple[int, int, int]]:
     """
     Извлечь доминантные цвета из изображения через KMeans.
     
     Args:
-        image: PIL Image
+        image: PIL Image, Frame или numpy array (H, W, 3) - Frame и массив без копии
         num_colors: Количество цветов для извлечения
         random_state: Фиксированный seed для детерминизма
         algorithm: Алгоритм KMeans ("elkan" или "lloyd")
@@ -25,14 +27,11 @@ def extract_main_colors(
     Returns:
         Список RGB tuples (r, g, b) отсортированных по частоте
     """
-    # Конвертируем в RGB если нужно
-    if image.mode != "RGB":
-        image = image.convert("RGB")
-    
-    # Преобразуем изображение в массив пикселей
-    img_array = np.array(image)
+    # Преобразуем изображение в массив пикселей (RGB)
+    img_array = as_array(image, "RGB")
     
     if mask is not None:
+        mask = as_array(mask, "L")
         # Используем маску - берем только нужные пиксели
         mask_bool = mask > 128  # Порог для альфа-маски
         pixels = img_array[mask_bool]
@@ -3,11 +3,13 @@ import numpy as np
 from PIL import Image
 from typing import Tuple, Optional
 
+from .frame import Frame, ImageLike, as_array, as_pil
+
 
 def composite_images(
     background: Image.Image,
     foreground: Image.Image,
-    mask: np.ndarray,
+    mask: ImageLike,
     x_offset: int = 0,
     y_offset: int = 0
 ) -> Image.Image:
@@ -17,7 +19,7 @@ def composite_images(
     Args:
         background: Фоновое изображение (RGB)
         foreground: Переднее изображение (RGBA)
-        mask: Маска (numpy array H x W, значения 0-255)
+        mask: Маска (H x W, значения 0-255): numpy array, Frame или PIL Image
         x_offset: Смещение по X
         y_offset: Смещение по Y
         
@@ -40,7 +42,7 @@ def composite_images(
         foreground = foreground.resize(background.size, Image.Resampling.LANCZOS)
     
     # Конвертируем маску в PIL Image
-    mask_pil = Image.fromarray(mask).convert("L")
+    mask_pil = as_pil(mask, "L")
     if mask_pil.size != background.size:
         mask_pil = mask_pil.resize(background.size, Image.Resampling.LANCZOS)
     
@@ -78,9 +80,9 @@ def apply_gradient_overlay(
         gradient = gradient.resize(base_image.size, Image.Resampling.LANCZOS)
     
     # Создаем копию градиента с заданной непрозрачностью
-    gradient_array = np.array(gradient).astype(float)
-    gradient_array[:, :, 3] = gradient_array[:, :, 3] * opacity  # Уменьшаем альфа-канал
-    gradient_with_opacity = Image.fromarray(gradient_array.astype(np.uint8), mode='RGBA')
+    gradient_array = np.array(as_array(gradient))  # своя копия: альфа меняется на месте
+    gradient_array[:, :, 3] = (gradient_array[:, :, 3] * opacity).astype(np.uint8)  # Уменьшаем альфа-канал
+    gradient_with_opacity = Frame(gradient_array, "RGBA").pil()
     
     # Композиция
     result = Image.alpha_composite(base_image, gradient_with_opacity)
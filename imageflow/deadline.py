@@ -0,0 +1,164 @@
+"""Дедлайн запроса и его распространение по пайплайну.
+
+Дедлайн (абсолютное время, monotonic) хранится в contextvar и виден всем
+слоям: full_pipeline, run_seedream, fetch_image, safe_request и
+retry_on_failure. Таймауты HTTP и число повторов сжимаются под оставшееся
+время, а пайплайн при нехватке времени сразу выбирает дешёвый путь
+(fallback без Seedream).
+
+Источники дедлайна:
+- заголовок X-Request-Timeout (секунды) - не больше серверного лимита;
+- IMAGEFLOW_REQUEST_TIMEOUT - серверный лимит, секунды (по умолчанию 300, 0 - без дедлайна).
+
+Если дедлайн повлиял на результат (операция прервана, повтор или Seedream
+пропущен, таймаут сжат), это отмечается в Shortfall блока track_shortfall:
+такой результат нельзя отдавать запросам с более поздним дедлайном (coalesce).
+"""
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+from .metrics import counter
+
+HEADER = "X-Request-Timeout"
+
+DEADLINE_EXCEEDED_TOTAL = counter(
+    "imageflow_deadline_exceeded_total",
+    "Операции, прерванные из-за истечения дедлайна запроса",
+    ["stage"]
+)
+
+
+class DeadlineExceeded(Exception):
+    """
+    Дедлайн запроса истёк.
+
+    Не наследует TimeoutError (OSError): истечение дедлайна - не сетевая ошибка
+    и не должно учитываться как сбой сервиса в circuit breaker.
+    """
+
+    def __init__(self, stage: str):
+        super().__init__(f"Дедлайн запроса истёк ({stage})")
+        self.stage = stage
+
+
+class Shortfall:
+    """Отметка, что дедлайн повлиял на результат блока track_shortfall."""
+
+    def __init__(self):
+        self.hit = False
+
+
+_deadline: ContextVar[Optional[float]] = ContextVar("imageflow_deadline", default=None)
+# Один объект на блок: копии контекста (ветки хеджирования, пулы потоков) отмечают его же
+_shortfall: ContextVar[Optional[Shortfall]] = ContextVar("imageflow_deadline_shortfall", default=None)
+
+
+def default_timeout() -> Optional[float]:
+    """Серверный лимит времени на запрос (None - без дедлайна)."""
+    seconds = float(os.getenv("IMAGEFLOW_REQUEST_TIMEOUT", 300))
+    return seconds if seconds > 0 else None
+
+
+def parse_timeout(value: Optional[str]) -> Optional[float]:
+    """
+    Время на запрос из заголовка X-Request-Timeout, ограниченное серверным лимитом.
+
+    Raises:
+        ValueError: Значение заголовка не положительное число
+    """
+    limit = default_timeout()
+    if not value:
+        return limit
+    seconds = float(value)
+    if seconds <= 0:
+        raise ValueError(f"{HEADER} должен быть положительным числом секунд")
+    return seconds if limit is None else min(seconds, limit)
+
+
+@contextmanager
+def request_deadline(seconds: Optional[float]) -> Iterator[None]:
+    """Установить дедлайн через seconds секунд на время блока (None - без дедлайна)."""
+    token = _deadline.set(None if seconds is None else time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+@contextmanager
+def reserve(seconds: float) -> Iterator[None]:
+    """
+    Сузить дедлайн на seconds для вложенного блока.
+
+    Оставляет время на то, что выполняется после блока (например, fallback и
+    рендер после Seedream). Без дедлайна ничего не делает.
+    """
+    current = _deadline.get()
+    token = _deadline.set(None if current is None else current - seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+@contextmanager
+def track_shortfall() -> Iterator[Shortfall]:
+    """Отмечать на время блока, повлиял ли дедлайн на результат."""
+    shortfall = Shortfall()
+    token = _shortfall.set(shortfall)
+    try:
+        yield shortfall
+    finally:
+        _shortfall.reset(token)
+
+
+def record_shortfall() -> None:
+    """Дедлайн повлиял на результат текущего блока track_shortfall (вне блока ничего не делает)."""
+    shortfall = _shortfall.get()
+    if shortfall is not None:
+        shortfall.hit = True
+
+
+def current() -> Optional[float]:
+    """Абсолютный дедлайн (time.monotonic) или None."""
+    return _deadline.get()
+
+
+def remaining() -> Optional[float]:
+    """Сколько секунд осталось до дедлайна (None - дедлайна нет)."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def check(stage: str) -> None:
+    """
+    Raises:
+        DeadlineExceeded: Если дедлайн уже истёк
+    """
+    left = remaining()
+    if left is not None and left <= 0:
+        DEADLINE_EXCEEDED_TOTAL.inc(stage=stage)
+        record_shortfall()
+        raise DeadlineExceeded(stage)
+
+
+def timeout(default: float, stage: str = "request") -> float:
+    """Таймаут операции: default, но не дольше оставшегося времени."""
+    check(stage)
+    left = remaining()
+    if left is None or left >= default:
+        return default
+    record_shortfall()
+    return left
+
+
+def can_wait(seconds: float) -> bool:
+    """Хватит ли времени подождать seconds (перед повтором, ожиданием и т.п.)."""
+    left = remaining()
+    if left is None or left > seconds:
+        return True
+    record_shortfall()
+    return False
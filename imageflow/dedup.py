@@ -0,0 +1,491 @@
+"""Дедупликация исходников по перцептивному хешу: повтор арта - готовые Seedream и рендеры.
+
+Один и тот же арт игры приходит с разных CDN, с разными query string и
+после перекодирования, поэтому ключи по URL или байтам почти не совпадают.
+Здесь ключ - 64-битный перцептивный хеш нормализованной миниатюры
+исходника (оттенки серого, 32x32 для pHash / 9x8 для dHash), который
+устойчив к перекодированию, масштабу и лёгкой цветокоррекции. Исходник с
+хешем на расстоянии Хэмминга не больше IMAGEFLOW_DEDUP_MAX_DISTANCE от уже
+известного переиспользует его результат Seedream (без вызова fal) и, если
+совпадают параметры рендера, готовые рендеры (без всего пайплайна).
+
+Индекс - multi-index hashing: хеш делится на (расстояние + 1) полос, и по
+принципу Дирихле близкий хеш совпадает с искомым хотя бы в одной полосе
+целиком. Поиск проверяет только кандидатов из корзин своих полос, поэтому
+остаётся быстрым на сотнях тысяч изображений. Хеши записей дописываются в
+index.bin и загружаются при старте.
+
+Хранилище: <каталог>/<2 символа хеша>/<хеш>/seedream-<seed>.png и
+render-<ключ параметров>.png. Запись на диск - в фоновом потоке, ошибки
+записи не влияют на запрос. Хранятся только рендеры из результата
+Seedream (fallback-рендеры не переиспользуются).
+
+Размер хранилища ограничен числом записей и объёмом на диске: при
+превышении любого предела удаляются давно не использованные записи (LRU,
+время использования - mtime каталога записи, обновляется при попадании),
+пока хранилище не уменьшится до 90% пределов; index.bin при этом
+перезаписывается. При старте размеры записей считываются с диска.
+
+Переменные окружения:
+- IMAGEFLOW_DEDUP - включить (по умолчанию выключено: исходник тогда скачивается до Seedream)
+- IMAGEFLOW_DEDUP_HASH - phash или dhash (по умолчанию phash)
+- IMAGEFLOW_DEDUP_MAX_DISTANCE - максимальное расстояние Хэмминга для совпадения, бит из 64 (по умолчанию 4)
+- IMAGEFLOW_DEDUP_DIR - каталог индекса и результатов (по умолчанию <tmp>/imageflow-dedup)
+- IMAGEFLOW_DEDUP_MAX_ENTRIES - максимум исходников в хранилище (по умолчанию 100000, 0 - без ограничения)
+- IMAGEFLOW_DEDUP_MAX_MB - максимальный объём хранилища на диске, МБ (по умолчанию 10240, 0 - без ограничения)
+"""
+import hashlib
+import io
+import os
+import shutil
+import struct
+import tempfile
+import threading
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from .frame import ImageLike, as_pil
+from .metrics import counter, gauge, record_cache
+
+HASH_BITS = 64
+MB = 1024 * 1024
+
+# Вытеснение уменьшает хранилище до этой доли пределов, чтобы не переписывать индекс на каждой записи
+EVICT_TARGET = 0.9
+
+# Версия рендеров в ключе хранилища: увеличить при изменении результата пайплайна,
+# чтобы старые рендеры перестали совпадать (результаты Seedream от неё не зависят)
+RENDER_VERSION = 1
+
+DEDUP_INDEX_ENTRIES = gauge(
+    "imageflow_dedup_index_entries",
+    "Исходники в индексе перцептивных хешей"
+)
+DEDUP_STORE_BYTES = gauge(
+    "imageflow_dedup_store_bytes",
+    "Объём результатов дедупликации на диске"
+)
+DEDUP_EVICTIONS_TOTAL = counter(
+    "imageflow_dedup_evictions_total",
+    "Записи дедупликации, удалённые при превышении пределов хранилища"
+)
+
+
+def enabled() -> bool:
+    return os.getenv("IMAGEFLOW_DEDUP", "").lower() in ("1", "true", "yes", "on")
+
+
+def max_distance() -> int:
+    return max(0, min(HASH_BITS - 1, int(os.getenv("IMAGEFLOW_DEDUP_MAX_DISTANCE", 4))))
+
+
+def store_dir() -> str:
+    return os.getenv("IMAGEFLOW_DEDUP_DIR") or os.path.join(tempfile.gettempdir(), "imageflow-dedup")
+
+
+def max_entries() -> int:
+    return max(0, int(os.getenv("IMAGEFLOW_DEDUP_MAX_ENTRIES", 100000)))
+
+
+def max_bytes() -> int:
+    return max(0, int(float(os.getenv("IMAGEFLOW_DEDUP_MAX_MB", 10240)) * MB))
+
+
+# ============================================================================
+# Хеши
+# ============================================================================
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), "big")
+
+
+def phash(image: ImageLike) -> int:
+    """pHash: знаки низкочастотных коэффициентов DCT миниатюры 32x32 относительно их медианы."""
+    thumbnail = as_pil(image).convert("L").resize((32, 32), Image.Resampling.LANCZOS)
+    dct = cv2.dct(np.asarray(thumbnail, dtype=np.float32))[:8, :8]
+    return _bits_to_int(dct > np.median(dct))
+
+
+def dhash(image: ImageLike) -> int:
+    """dHash: знаки горизонтальных разностей миниатюры 9x8."""
+    thumbnail = np.asarray(as_pil(image).convert("L").resize((9, 8), Image.Resampling.LANCZOS), dtype=np.int16)
+    return _bits_to_int(thumbnail[:, 1:] > thumbnail[:, :-1])
+
+
+HASHES = {"phash": phash, "dhash": dhash}
+
+
+def image_hash(image: ImageLike) -> int:
+    return HASHES.get(os.getenv("IMAGEFLOW_DEDUP_HASH", "phash").lower(), phash)(image)
+
+
+# ============================================================================
+# Индекс
+# ============================================================================
+
+class HashIndex:
+    """
+    Поиск ближайшего 64-битного хеша по расстоянию Хэмминга (multi-index hashing).
+
+    Args:
+        max_distance: Наибольшее расстояние, на котором хеши считаются совпадающими
+    """
+
+    def __init__(self, max_distance: int):
+        self.max_distance = max_distance
+        count = max_distance + 1
+        # Полосы (сдвиг, маска): 64 бита делятся на count почти равных частей
+        widths = [HASH_BITS // count + (1 if i < HASH_BITS % count else 0) for i in range(count)]
+        shifts = [sum(widths[:i]) for i in range(count)]
+        self._bands = [(shift, (1 << width) - 1) for shift, width in zip(shifts, widths)]
+        self._hashes = array("Q")
+        self._positions: Dict[int, int] = {}
+        self._buckets: List[Dict[int, array]] = [{} for _ in self._bands]
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def __contains__(self, value: int) -> bool:
+        return value in self._positions
+
+    def add(self, value: int) -> bool:
+        """Добавить хеш; False, если он уже есть."""
+        with self._lock:
+            if value in self._positions:
+                return False
+            position = len(self._hashes)
+            self._hashes.append(value)
+            self._positions[value] = position
+            for buckets, (shift, mask) in zip(self._buckets, self._bands):
+                buckets.setdefault((value >> shift) & mask, array("I")).append(position)
+            return True
+
+    def remove(self, value: int) -> bool:
+        """Удалить хеш; False, если его нет. Последний хеш переносится на освободившуюся позицию."""
+        with self._lock:
+            position = self._positions.pop(value, None)
+            if position is None:
+                return False
+            for buckets, (shift, mask) in zip(self._buckets, self._bands):
+                key = (value >> shift) & mask
+                bucket = buckets[key]
+                bucket.remove(position)
+                if not bucket:
+                    del buckets[key]
+            last = len(self._hashes) - 1
+            if position != last:
+                moved = self._hashes[last]
+                self._hashes[position] = moved
+                self._positions[moved] = position
+                for buckets, (shift, mask) in zip(self._buckets, self._bands):
+                    bucket = buckets[(moved >> shift) & mask]
+                    bucket[bucket.index(last)] = position
+            self._hashes.pop()
+            return True
+
+    def nearest(self, value: int) -> Optional[Tuple[int, int]]:
+        """Ближайший хеш в пределах max_distance: (хеш, расстояние) или None."""
+        with self._lock:
+            if value in self._positions:
+                return value, 0
+            candidates = set()
+            for buckets, (shift, mask) in zip(self._buckets, self._bands):
+                bucket = buckets.get((value >> shift) & mask)
+                if bucket is not None:
+                    candidates.update(bucket)
+            best = None
+            for position in candidates:
+                other = self._hashes[position]
+                distance = (value ^ other).bit_count()
+                if distance <= self.max_distance and (best is None or distance < best[1]):
+                    best = (other, distance)
+            return best
+
+
+# ============================================================================
+# Хранилище результатов
+# ============================================================================
+
+def _render_name(concept: str, size: Tuple[int, int], render_size: Tuple[int, int], text: Optional[Tuple[str, str]]) -> str:
+    key = repr((RENDER_VERSION, concept, tuple(size), tuple(render_size), text)).encode("utf-8")
+    return "render-" + hashlib.sha1(key).hexdigest()[:20] + ".png"
+
+
+class Store:
+    """
+    Индекс хешей и результаты Seedream/рендеров на диске.
+
+    Args:
+        max_entries: Предел числа записей (0 - без ограничения)
+        max_bytes: Предел объёма на диске (0 - без ограничения)
+    """
+
+    def __init__(self, directory: str, max_distance: int, max_entries: int = 0, max_bytes: int = 0):
+        self.directory = directory
+        self.index = HashIndex(max_distance)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # Запись -> байт на диске, от давно не использованных к недавним
+        self._entries: "OrderedDict[int, int]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="imageflow-dedup")
+        self._load()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    @property
+    def nbytes(self) -> int:
+        with self._lock:
+            return self._bytes
+
+    def _index_path(self) -> str:
+        return os.path.join(self.directory, "index.bin")
+
+    def entry_dir(self, entry: int) -> str:
+        name = f"{entry:016x}"
+        return os.path.join(self.directory, name[:2], name)
+
+    def _load(self) -> None:
+        try:
+            with open(self._index_path(), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = b""
+        except OSError as e:
+            print(f"[Dedup] Индекс не прочитан: {e}", flush=True)
+            data = b""
+        values = [value for (value,) in struct.iter_unpack(">Q", data[:len(data) - len(data) % 8])]
+        entries = []
+        for value in dict.fromkeys(values):
+            usage = self._scan_entry(value)
+            if usage is not None:
+                entries.append((usage[0], value, usage[1]))
+        # Порядок LRU - по времени последнего использования записи
+        for _, value, nbytes in sorted(entries):
+            self.index.add(value)
+            self._entries[value] = nbytes
+            self._bytes += nbytes
+        if len(self._entries) != len(values):
+            # Записи без каталога (удалены вручную) и повторы убираются из индекса
+            self._rewrite_index()
+        self._evict()
+        self._update_gauges()
+        if self._entries:
+            print(f"[Dedup] Загружен индекс: {len(self._entries)} исходников, {self._bytes // MB} МБ", flush=True)
+
+    def _scan_entry(self, entry: int) -> Optional[Tuple[float, int]]:
+        """(время последнего использования, байт на диске) записи или None, если её каталога нет."""
+        directory = self.entry_dir(entry)
+        try:
+            used = os.stat(directory).st_mtime
+            nbytes = sum(item.stat().st_size for item in os.scandir(directory) if item.is_file())
+        except OSError:
+            return None
+        return used, nbytes
+
+    def _update_gauges(self) -> None:
+        DEDUP_INDEX_ENTRIES.set(len(self.index))
+        DEDUP_STORE_BYTES.set(self._bytes)
+
+    def _rewrite_index(self) -> None:
+        path = self._index_path()
+        with self._lock:
+            data = b"".join(struct.pack(">Q", entry) for entry in self._entries)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            print(f"[Dedup] Индекс не перезаписан: {e}", flush=True)
+
+    def _over_limit(self, entries: int, nbytes: int, share: float = 1.0) -> bool:
+        return bool(
+            (self.max_entries and entries > self.max_entries * share)
+            or (self.max_bytes and nbytes > self.max_bytes * share)
+        )
+
+    def _evict(self, keep: Optional[int] = None) -> None:
+        """Удалить давно не использованные записи до EVICT_TARGET пределов (keep не удаляется)."""
+        with self._lock:
+            if not self._over_limit(len(self._entries), self._bytes):
+                return
+            evicted = []
+            for entry in list(self._entries):
+                if not self._over_limit(len(self._entries), self._bytes, EVICT_TARGET):
+                    break
+                if entry == keep:
+                    continue
+                self._bytes -= self._entries.pop(entry)
+                evicted.append(entry)
+        if not evicted:
+            return
+        for entry in evicted:
+            self.index.remove(entry)
+            shutil.rmtree(self.entry_dir(entry), ignore_errors=True)
+        DEDUP_EVICTIONS_TOTAL.inc(len(evicted))
+        self._rewrite_index()
+        self._update_gauges()
+        print(f"[Dedup] Вытеснено {len(evicted)} давно не использованных исходников "
+              f"(осталось {len(self._entries)}, {self._bytes // MB} МБ)", flush=True)
+
+    def touch(self, entry: int) -> None:
+        """Отметить использование записи (порядок LRU и mtime каталога для следующего старта)."""
+        with self._lock:
+            if entry not in self._entries:
+                return
+            self._entries.move_to_end(entry)
+        try:
+            os.utime(self.entry_dir(entry))
+        except OSError:
+            pass
+
+    def read(self, entry: int, name: str) -> Optional[Image.Image]:
+        path = os.path.join(self.entry_dir(entry), name)
+        try:
+            with Image.open(path) as image:
+                image.load()
+            self.touch(entry)
+            return image
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            print(f"[Dedup] Не удалось прочитать {path}: {e}", flush=True)
+            return None
+
+    def write(self, entry: int, files: Dict[str, Image.Image], register: bool = False) -> None:
+        """Записать изображения записи в фоне; register - добавить хеш в индекс после записи."""
+        self._writer.submit(self._write, entry, files, register)
+
+    def _write(self, entry: int, files: Dict[str, Image.Image], register: bool) -> None:
+        directory = self.entry_dir(entry)
+        with self._lock:
+            known = entry in self._entries
+        if not known and not register:
+            # Запись вытеснена, пока запрос рендерил - не создаём каталог вне индекса
+            return
+        added = 0
+        try:
+            os.makedirs(directory, exist_ok=True)
+            for name, image in files.items():
+                path = os.path.join(directory, name)
+                try:
+                    added -= os.path.getsize(path)
+                except OSError:
+                    pass
+                image.save(path + ".tmp", format="PNG", compress_level=1)
+                os.replace(path + ".tmp", path)
+                added += os.path.getsize(path)
+        except OSError as e:
+            print(f"[Dedup] Ошибка записи {directory}: {e}", flush=True)
+            if not known:
+                shutil.rmtree(directory, ignore_errors=True)
+                return
+        with self._lock:
+            self._entries[entry] = self._entries.get(entry, 0) + added
+            self._entries.move_to_end(entry)
+            self._bytes += added
+        try:
+            if self.index.add(entry):
+                with open(self._index_path(), "ab") as f:
+                    f.write(struct.pack(">Q", entry))
+        except OSError as e:
+            print(f"[Dedup] Ошибка записи индекса: {e}", flush=True)
+        self._update_gauges()
+        self._evict(keep=entry)
+
+    def flush(self) -> None:
+        """Дождаться фоновых записей (бенчмарки, тесты)."""
+        self._writer.submit(lambda: None).result()
+
+
+_store: Optional[Store] = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> Store:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = Store(store_dir(), max_distance(), max_entries(), max_bytes())
+    return _store
+
+
+class Match:
+    """
+    Результат поиска исходника в индексе и запись его результатов.
+
+    entry - хеш совпавшей записи (или None): её результаты переиспользуются,
+    новые результаты пишутся в неё же; без совпадения запись создаётся под
+    хешем исходника при первом результате Seedream.
+    """
+
+    def __init__(self, store: Store, source_hash: int, entry: Optional[int], distance: Optional[int]):
+        self.store = store
+        self.source_hash = source_hash
+        self.entry = entry
+        self.distance = distance
+
+    def seedream_image(self, seed: int) -> Optional[Image.Image]:
+        image = self.store.read(self.entry, f"seedream-{seed}.png") if self.entry is not None else None
+        record_cache("dedup_seedream", image is not None)
+        return image
+
+    def renders(
+        self,
+        concepts: Sequence[str],
+        sizes: Sequence[Tuple[int, int]],
+        render_size: Tuple[int, int],
+        text: Optional[Tuple[str, str]]
+    ) -> Optional[Dict[str, Dict[Tuple[int, int], Image.Image]]]:
+        """Готовые рендеры всех запрошенных концепций и размеров или None."""
+        results: Dict[str, Dict[Tuple[int, int], Image.Image]] = {}
+        for concept in concepts:
+            for size in sizes:
+                image = None
+                if self.entry is not None:
+                    image = self.store.read(self.entry, _render_name(concept, size, render_size, text))
+                if image is None:
+                    record_cache("dedup_render", False)
+                    return None
+                results.setdefault(concept, {})[size] = image
+        record_cache("dedup_render", True)
+        return results
+
+    def store_seedream(self, seed: int, image: Image.Image) -> None:
+        if self.entry is None:
+            self.entry = self.source_hash
+        self.store.write(self.entry, {f"seedream-{seed}.png": image.copy()}, register=True)
+
+    def store_renders(
+        self,
+        renders: Dict[str, Dict[Tuple[int, int], Image.Image]],
+        render_size: Tuple[int, int],
+        text: Optional[Tuple[str, str]]
+    ) -> None:
+        if self.entry is None:
+            return
+        self.store.write(self.entry, {
+            _render_name(concept, size, render_size, text): image.copy()
+            for concept, images in renders.items() for size, image in images.items()
+        })
+
+
+def lookup(image: ImageLike) -> Match:
+    """Хеш исходника и ближайшая известная запись в пределах IMAGEFLOW_DEDUP_MAX_DISTANCE."""
+    store = get_store()
+    source_hash = image_hash(image)
+    found = store.index.nearest(source_hash)
+    entry, distance = found if found is not None else (None, None)
+    return Match(store, source_hash, entry, distance)
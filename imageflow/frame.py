@@ -0,0 +1,135 @@
+"""Кадр пайплайна: один непрерывный буфер и его представления.
+
+Frame владеет одним C-непрерывным массивом uint8 (H, W) или (H, W, C) и
+режимом ("L", "RGB", "RGBA"). NumPy-представление - сам буфер, без копии.
+PIL-представление для "L" и "RGBA" создаётся через Image.frombuffer поверх
+того же буфера (только чтение: изменение через PIL делает копию). Pillow
+хранит RGB по 4 байта на пиксель, поэтому PIL-изображение RGB-кадра -
+единственное место, где нужна копия.
+
+Функции модулей (masks, inpaint, colors, compose, gradient) принимают
+Frame, массив или PIL Image через as_array/as_pil, и стадии пайплайна
+передают друг другу кадры без np.array/Image.fromarray на каждой границе.
+"""
+from typing import Optional, Tuple, Union
+
+import numpy as np
+from PIL import Image
+
+# Режим -> число каналов
+CHANNELS = {"L": 1, "RGB": 3, "RGBA": 4}
+
+# Режимы, в которых Pillow может работать прямо поверх внешнего буфера
+_SHARED_MODES = ("L", "RGBA")
+
+
+class Frame:
+    """
+    Кадр: непрерывный буфер uint8 и режим.
+
+    Args:
+        array: (H, W) для "L", (H, W, 3) для "RGB", (H, W, 4) для "RGBA";
+            копируется, только если не uint8 или не C-непрерывный
+        mode: Режим; по умолчанию определяется по числу каналов
+    """
+
+    __slots__ = ("_array", "mode", "_pil")
+
+    def __init__(self, array: np.ndarray, mode: Optional[str] = None):
+        if array.dtype != np.uint8:
+            array = array.astype(np.uint8)
+        array = np.ascontiguousarray(array)
+        channels = 1 if array.ndim == 2 else array.shape[2]
+        if mode is None:
+            mode = next((m for m, c in CHANNELS.items() if c == channels), None)
+        if mode not in CHANNELS or CHANNELS[mode] != channels or array.ndim not in (2, 3):
+            raise ValueError(f"Массив {array.shape} не соответствует режиму {mode}")
+        self._array = array
+        self.mode = mode
+        self._pil: Optional[Image.Image] = None
+
+    @classmethod
+    def from_pil(cls, image: Image.Image, mode: Optional[str] = None) -> "Frame":
+        """Кадр из PIL Image (одна копия; конвертация режима - только если он другой)."""
+        mode = mode or (image.mode if image.mode in CHANNELS else "RGB")
+        if image.mode != mode:
+            image = image.convert(mode)
+        return cls(np.asarray(image), mode)
+
+    @classmethod
+    def empty(cls, size: Tuple[int, int], mode: str = "RGB") -> "Frame":
+        """Нулевой кадр размера (ширина, высота)."""
+        width, height = size
+        shape = (height, width) if mode == "L" else (height, width, CHANNELS[mode])
+        return cls(np.zeros(shape, dtype=np.uint8), mode)
+
+    @property
+    def array(self) -> np.ndarray:
+        """Буфер кадра (без копии)."""
+        return self._array
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        """(ширина, высота), как у PIL."""
+        return self._array.shape[1], self._array.shape[0]
+
+    @property
+    def width(self) -> int:
+        return self._array.shape[1]
+
+    @property
+    def height(self) -> int:
+        return self._array.shape[0]
+
+    @property
+    def nbytes(self) -> int:
+        return self._array.nbytes
+
+    def pil(self) -> Image.Image:
+        """
+        PIL-представление кадра.
+
+        Для "L" и "RGBA" - поверх того же буфера (кэшируется, только чтение);
+        для "RGB" - новое изображение (копия). Изменение представления (paste,
+        putalpha) отвязывает его от буфера копией - тогда создаётся новое.
+        """
+        if self.mode not in _SHARED_MODES:
+            return Image.fromarray(self._array, self.mode)
+        if self._pil is None or not self._pil.readonly:
+            self._pil = Image.frombuffer(self.mode, self.size, self._array, "raw", self.mode, 0, 1)
+        return self._pil
+
+    def __repr__(self) -> str:
+        return f"Frame({self.mode}, {self.width}x{self.height})"
+
+
+ImageLike = Union[Frame, np.ndarray, Image.Image]
+
+
+def as_array(image: ImageLike, mode: Optional[str] = None) -> np.ndarray:
+    """
+    NumPy-представление: Frame и массив - без копии, PIL Image - одна копия.
+
+    Args:
+        mode: Нужный режим для PIL Image (конвертируется при несовпадении)
+    """
+    if isinstance(image, Frame):
+        if mode is None or image.mode == mode:
+            return image.array
+        image = image.pil()
+    if isinstance(image, np.ndarray):
+        return image
+    if mode is not None and image.mode != mode:
+        image = image.convert(mode)
+    return np.asarray(image)
+
+
+def as_pil(image: ImageLike, mode: Optional[str] = None) -> Image.Image:
+    """PIL-представление: PIL Image - как есть, Frame - см. Frame.pil, массив - через Frame."""
+    if isinstance(image, np.ndarray):
+        image = Frame(image)
+    if isinstance(image, Frame):
+        image = image.pil()
+    if mode is not None and image.mode != mode:
+        image = image.convert(mode)
+    return image
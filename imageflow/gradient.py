@@ -2,6 +2,7 @@
 import numpy as np
 from PIL import Image
 from typing import Tuple
+from .frame import Frame
 from .utils import srgb_to_linear, linear_to_srgb, hex_to_rgb
 
 
@@ -27,55 +28,63 @@ def create_gradient_background(
     Returns:
         PIL Image (RGB) с градиентом
     """
+    return create_gradient_frame(width, height, start_color, end_color, direction, interpolation).pil()
+
+
+def create_gradient_frame(
+    width: int,
+    height: int,
+    start_color: str,
+    end_color: str,
+    direction: str = "vertical",
+    interpolation: str = "linear_rgb",
+    mode: str = "RGB"
+) -> Frame:
+    """
+    Создать градиентный фон кадром - без PIL-копии, сразу нужного режима.
+    
+    Args:
+        mode: "RGB" или "RGBA" (альфа = 255, её можно заменить прямо в frame.array)
+        
+    Остальные аргументы - как у create_gradient_background.
+    """
     # Конвертируем hex в RGB
     start_rgb = hex_to_rgb(start_color)
     end_rgb = hex_to_rgb(end_color)
     
-    # Создаём массив для градиента
-    gradient = np.zeros((height, width, 3), dtype=np.float32)
-    
     if direction == "vertical":
-        # Вертикальный градиент
-        for y in range(height):
-            t = y / (height - 1) if height > 1 else 0
-            
-            if interpolation == "linear_rgb":
-                # Конвертируем в linear RGB
-                start_linear = srgb_to_linear(np.array(start_rgb))
-                end_linear = srgb_to_linear(np.array(end_rgb))
-                
-                # Интерполяция в linear пространстве
-                color_linear = start_linear * (1 - t) + end_linear * t
-                
-                # Конвертируем обратно в sRGB
-                color_srgb = linear_to_srgb(color_linear)
-                gradient[y, :] = color_srgb
-            else:
-                # Простая интерполяция в sRGB
-                color = np.array(start_rgb) * (1 - t) + np.array(end_rgb) * t
-                gradient[y, :] = color
-    
+        # Вертикальный градиент: цвет зависит только от строки
+        steps = height
     elif direction == "horizontal":
-        # Горизонтальный градиент
-        for x in range(width):
-            t = x / (width - 1) if width > 1 else 0
-            
-            if interpolation == "linear_rgb":
-                start_linear = srgb_to_linear(np.array(start_rgb))
-                end_linear = srgb_to_linear(np.array(end_rgb))
-                color_linear = start_linear * (1 - t) + end_linear * t
-                color_srgb = linear_to_srgb(color_linear)
-                gradient[:, x] = color_srgb
-            else:
-                color = np.array(start_rgb) * (1 - t) + np.array(end_rgb) * t
-                gradient[:, x] = color
-    
+        # Горизонтальный градиент: цвет зависит только от столбца
+        steps = width
     else:
         raise ValueError(f"Unknown direction: {direction}")
     
-    # Конвертируем в uint8 и создаём PIL Image
-    gradient_uint8 = gradient.astype(np.uint8)
-    return Image.fromarray(gradient_uint8, "RGB")
+    # Цвета всех строк (столбцов) одним вектором t, а не по одному на итерацию
+    t = (np.arange(steps) / (steps - 1) if steps > 1 else np.zeros(steps))[:, None]
+    if interpolation == "linear_rgb":
+        # Интерполяция в linear пространстве и обратно в sRGB
+        start_linear = srgb_to_linear(np.array(start_rgb))
+        end_linear = srgb_to_linear(np.array(end_rgb))
+        colors = linear_to_srgb(start_linear * (1 - t) + end_linear * t)
+    else:
+        # Простая интерполяция в sRGB (float32 -> uint8 отбрасыванием дробной части)
+        colors = (np.array(start_rgb) * (1 - t) + np.array(end_rgb) * t).astype(np.float32).astype(np.uint8)
+    
+    # Разворачиваем цвета на весь кадр (RGBA - сразу с непрозрачной альфой, без convert)
+    channels = 4 if mode == "RGBA" else 3
+    if channels == 4:
+        colors = np.concatenate([colors, np.full((steps, 1), 255, dtype=np.uint8)], axis=1)
+    frame = np.empty((height, width, channels), dtype=np.uint8)
+    if channels == 4:
+        # Пиксель RGBA - одно слово uint32: заполнение словами в десятки раз быстрее побайтового
+        colors = colors.view(np.uint32).reshape(steps)
+        target = frame.view(np.uint32).reshape(height, width)
+    else:
+        target = frame
+    target[:] = colors[:, None] if direction == "vertical" else colors[None]
+    return Frame(frame, mode)
 
 
 
@@ -0,0 +1,260 @@
+"""Хеджирование Seedream: параллельный запуск fallback-рендера.
+
+Если Seedream не завершился за перцентиль своей исторической задержки,
+параллельно запускается рендер из оригинального изображения (fallback).
+Решение и окно ожидания prefer_seedream отсчитываются по завершению самого
+Seedream (ветка вызывает mark_ready), а не всей ветки с рендером: Seedream,
+успевший до порога, не запускает второй рендер.
+Какой результат вернуть, решает политика:
+- prefer_seedream - после готовности fallback ждём Seedream ещё
+  IMAGEFLOW_HEDGE_GRACE секунд (если успел - дожидаемся его рендера), затем отдаём fallback;
+- first - отдаём первый готовый результат.
+Проигравшая ветка отменяется: опрос Seedream и стадии пайплайна проверяют
+флаг отмены своей ветки (contextvar) и прерываются HedgeCancelled - на
+границах стадий, между попытками HTTP и в потоке загрузки. run_hedged ждёт
+остановки проигравшей ветки не дольше IMAGEFLOW_HEDGE_JOIN_TIMEOUT: отправленный
+HTTP-запрос или длинная стадия (инпейнтинг) не прерываются, и такая ветка
+отсоединяется - её резервация памяти уже освобождена, новые резервации она
+получить не может (admission.Reservation.grow) и завершается на ближайшей проверке.
+
+Переменные окружения:
+- IMAGEFLOW_HEDGE - включить хеджирование (по умолчанию выключено)
+- IMAGEFLOW_HEDGE_PERCENTILE - перцентиль задержки Seedream для старта fallback (по умолчанию 90)
+- IMAGEFLOW_HEDGE_MIN_DELAY - нижняя граница задержки старта, секунды (по умолчанию 10)
+- IMAGEFLOW_HEDGE_DEFAULT_DELAY - задержка, пока истории мало, секунды (по умолчанию 60)
+- IMAGEFLOW_HEDGE_POLICY - prefer_seedream или first (по умолчанию prefer_seedream)
+- IMAGEFLOW_HEDGE_GRACE - сколько ждать Seedream после готовности fallback, секунды (по умолчанию 10)
+- IMAGEFLOW_HEDGE_JOIN_TIMEOUT - сколько ждать остановки отменённой ветки, секунды (по умолчанию 5)
+"""
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Callable, Optional, Tuple, TypeVar
+
+from .metrics import counter, gauge
+
+T = TypeVar("T")
+
+POLICIES = ("prefer_seedream", "first")
+
+# Сколько последних успешных Seedream учитывать и сколько нужно для перцентиля
+HISTORY_SIZE = 200
+MIN_HISTORY = 20
+
+HEDGE_TOTAL = counter(
+    "imageflow_hedge_total",
+    "Исходы хеджированного выполнения (Seedream vs fallback)",
+    ["result"]
+)
+HEDGE_DELAY_SECONDS = gauge(
+    "imageflow_hedge_delay_seconds",
+    "Текущая задержка запуска fallback при хеджировании"
+)
+
+
+class HedgeCancelled(Exception):
+    """Ветка хеджирования отменена: результат другой ветки уже выбран."""
+
+
+class LatencyHistory:
+    """Скользящее окно длительностей успешных вызовов."""
+
+    def __init__(self, size: int = HISTORY_SIZE):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._samples)
+
+    def percentile(self, p: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, max(0, int(round(p / 100.0 * (len(samples) - 1)))))
+        return samples[index]
+
+
+SEEDREAM_LATENCY = LatencyHistory()
+
+
+def enabled() -> bool:
+    return os.getenv("IMAGEFLOW_HEDGE", "").lower() in ("1", "true", "yes", "on")
+
+
+def hedge_delay(history: LatencyHistory = SEEDREAM_LATENCY) -> float:
+    """Через сколько секунд после старта Seedream запускать fallback."""
+    min_delay = float(os.getenv("IMAGEFLOW_HEDGE_MIN_DELAY", 10))
+    if len(history) < MIN_HISTORY:
+        delay = float(os.getenv("IMAGEFLOW_HEDGE_DEFAULT_DELAY", 60))
+    else:
+        delay = history.percentile(float(os.getenv("IMAGEFLOW_HEDGE_PERCENTILE", 90)))
+    delay = max(min_delay, delay)
+    HEDGE_DELAY_SECONDS.set(delay)
+    return delay
+
+
+_cancel_event: ContextVar[Optional[threading.Event]] = ContextVar("imageflow_hedge_cancel", default=None)
+_ready_event: ContextVar[Optional[threading.Event]] = ContextVar("imageflow_hedge_ready", default=None)
+
+
+def mark_ready() -> None:
+    """Хеджируемая часть ветки (Seedream) завершена, дальше - её обработка (вне хеджирования ничего не делает)."""
+    event = _ready_event.get()
+    if event is not None:
+        event.set()
+
+
+def check_cancelled() -> None:
+    """Прервать текущую ветку, если она отменена (вне хеджирования ничего не делает)."""
+    event = _cancel_event.get()
+    if event is not None and event.is_set():
+        raise HedgeCancelled("Ветка отменена: выбран результат другой ветки")
+
+
+def sleep(seconds: float) -> None:
+    """time.sleep, который прерывается отменой ветки."""
+    event = _cancel_event.get()
+    if event is None:
+        time.sleep(seconds)
+        return
+    if event.wait(seconds):
+        raise HedgeCancelled("Ветка отменена во время ожидания")
+
+
+class _Branch:
+    """Ветка хеджирования в отдельном потоке со своей копией контекста и флагом отмены."""
+
+    def __init__(self, name: str, fn: Callable[[], T], done: threading.Event):
+        self.name = name
+        self.cancel_event = threading.Event()
+        # ready - хеджируемая часть завершена (mark_ready или конец ветки)
+        self.ready = threading.Event()
+        self.finished = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self._fn = fn
+        self._done = done
+        # Копия контекста: трасса, резервация памяти и т.п. переходят в поток
+        context = contextvars.copy_context()
+        context.run(_cancel_event.set, self.cancel_event)
+        context.run(_ready_event.set, self.ready)
+        self._thread = threading.Thread(
+            target=context.run, args=(self._run,), name=f"imageflow-hedge-{name}", daemon=True
+        )
+
+    def start(self) -> "_Branch":
+        self._thread.start()
+        return self
+
+    def _run(self) -> None:
+        try:
+            self.result = self._fn()
+        except BaseException as e:  # noqa: B902 - ошибка передаётся вызывающему потоку
+            self.error = e
+        finally:
+            self.ready.set()
+            self.finished.set()
+            self._done.set()
+
+    @property
+    def succeeded(self) -> bool:
+        return self.finished.is_set() and self.error is None
+
+    def cancel(self) -> None:
+        self.cancel_event.set()
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """Дождаться завершения ветки; False, если не успела за timeout."""
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+
+def run_hedged(
+    primary: Callable[[], T],
+    secondary: Callable[[], T],
+    delay: float,
+    policy: Optional[str] = None,
+    grace: Optional[float] = None
+) -> Tuple[T, str]:
+    """
+    Выполнить primary с хеджированием через secondary.
+
+    secondary стартует, если хеджируемая часть primary (до mark_ready) не
+    завершилась за delay секунд, или сразу после ошибки primary (обычный fallback).
+
+    Returns:
+        (результат, "primary" | "secondary")
+
+    Raises:
+        Ошибку secondary, если обе ветки не удались
+    """
+    policy = policy or os.getenv("IMAGEFLOW_HEDGE_POLICY", "prefer_seedream")
+    if policy not in POLICIES:
+        raise ValueError(f"Неизвестная политика хеджирования: {policy} (допустимо: {', '.join(POLICIES)})")
+    grace = float(os.getenv("IMAGEFLOW_HEDGE_GRACE", 10)) if grace is None else grace
+
+    done = threading.Event()
+    first = _Branch("primary", primary, done).start()
+    if first.ready.wait(delay):
+        # Seedream успел - secondary не нужен, дожидаемся обработки результата
+        first.finished.wait()
+    if first.succeeded:
+        HEDGE_TOTAL.inc(result="not_needed")
+        return first.result, "primary"
+
+    if first.finished.is_set():
+        # primary упал до порога - обычный fallback в текущем потоке
+        HEDGE_TOTAL.inc(result="primary_failed")
+        return secondary(), "secondary"
+
+    print(f"[Hedge] Seedream не завершился за {delay:.1f}с, запускаем fallback параллельно (политика {policy})", flush=True)
+    HEDGE_TOTAL.inc(result="started")
+    second = _Branch("secondary", secondary, done).start()
+    try:
+        while True:
+            # Состояние веток проверяется после clear - сигнал завершения не теряется
+            done.wait()
+            done.clear()
+            if first.succeeded:
+                second.cancel()
+                HEDGE_TOTAL.inc(result="primary_won")
+                return first.result, "primary"
+            if second.succeeded:
+                if policy == "prefer_seedream" and not first.finished.is_set():
+                    print(f"[Hedge] Fallback готов, ждём Seedream ещё до {grace:.1f}с", flush=True)
+                    if first.ready.wait(grace):
+                        first.finished.wait()
+                    if first.succeeded:
+                        HEDGE_TOTAL.inc(result="primary_won")
+                        return first.result, "primary"
+                first.cancel()
+                HEDGE_TOTAL.inc(result="secondary_won")
+                return second.result, "secondary"
+            if first.finished.is_set() and second.finished.is_set():
+                HEDGE_TOTAL.inc(result="both_failed")
+                raise second.error
+            if first.finished.is_set() and first.error is not None and not second.finished.is_set():
+                print(f"[Hedge] Seedream не удался ({type(first.error).__name__}), ждём fallback", flush=True)
+    finally:
+        # Проигравшая ветка работает в копии контекста запроса (резервация памяти,
+        # слот планировщика): ждём её остановки, но не дольше join_timeout -
+        # ответ победителя не должен ждать медленную ветку
+        join_timeout = float(os.getenv("IMAGEFLOW_HEDGE_JOIN_TIMEOUT", 5))
+        for branch in (first, second):
+            if not branch.finished.is_set():
+                branch.cancel()
+                started = time.monotonic()
+                if branch.join(join_timeout):
+                    print(f"[Hedge] Ветка {branch.name} остановлена за {time.monotonic() - started:.1f}с после отмены", flush=True)
+                else:
+                    HEDGE_TOTAL.inc(result="detached")
+                    print(f"[Hedge] Ветка {branch.name} не остановилась за {join_timeout:.1f}с, отсоединяем", flush=True)
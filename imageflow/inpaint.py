@@ -3,10 +3,12 @@ import numpy as np
 import cv2
 from PIL import Image
 
+from .frame import ImageLike, as_array
+
 
 def inpaint_image(
-    image: np.ndarray,
-    mask: np.ndarray,
+    image: ImageLike,
+    mask: ImageLike,
     method: int = cv2.INPAINT_TELEA,
     inpaint_radius: int = 64,
     blur_after: int = 5
@@ -15,8 +17,8 @@ def inpaint_image(
     Выполнить инпейнтинг по маске.
     
     Args:
-        image: numpy array (H, W, 3) RGB изображение
-        mask: numpy array (H, W) маска для инпейнтинга (белое = закрасить)
+        image: (H, W, 3) RGB изображение: numpy array или Frame (без копии)
+        mask: (H, W) маска для инпейнтинга (белое = закрасить): numpy array или Frame
         method: Метод инпейнтинга (cv2.INPAINT_TELEA или cv2.INPAINT_NS)
         inpaint_radius: Радиус инпейнтинга
         blur_after: Размер размытия после инпейнтинга (0 = без размытия)
@@ -26,6 +28,8 @@ def inpaint_image(
     """
     import sys
     
+    image = as_array(image, "RGB")
+    mask = as_array(mask, "L")
     print(f"[inpaint_image] Начало инпейнтинга: image shape={image.shape}, mask shape={mask.shape}, radius={inpaint_radius}", flush=True)
     sys.stdout.flush()
     
@@ -131,8 +135,8 @@ def inpaint_image(
 
 
 def inpaint_pil_image(
-    pil_image: Image.Image,
-    mask: np.ndarray,
+    pil_image: ImageLike,
+    mask: ImageLike,
     method: int = cv2.INPAINT_TELEA,
     inpaint_radius: int = 64,
     blur_after: int = 5
@@ -141,8 +145,8 @@ def inpaint_pil_image(
     Инпейнтинг для PIL Image.
     
     Args:
-        pil_image: PIL Image (RGB)
-        mask: numpy array (H, W) маска
+        pil_image: PIL Image (RGB) или Frame
+        mask: (H, W) маска: numpy array или Frame
         method: Метод инпейнтинга
         inpaint_radius: Радиус инпейнтинга
         blur_after: Размер размытия после инпейнтинга
@@ -152,11 +156,11 @@ def inpaint_pil_image(
     """
     import sys
     
-    print(f"[inpaint_pil_image] Начало: PIL image size={pil_image.size}, mask shape={mask.shape}", flush=True)
+    print(f"[inpaint_pil_image] Начало: PIL image size={pil_image.size}", flush=True)
     sys.stdout.flush()
     
     # Конвертируем PIL в numpy
-    img_array = np.array(pil_image.convert("RGB"))
+    img_array = as_array(pil_image, "RGB")
     print(f"[inpaint_pil_image] Конвертировано в numpy: shape={img_array.shape}", flush=True)
     sys.stdout.flush()
     
@@ -0,0 +1,4 @@
+"""Нагрузочное тестирование /render с локальными fake fal и источником изображений.
+
+Запуск: python -m imageflow.loadtest --help
+"""
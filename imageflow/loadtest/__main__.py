@@ -0,0 +1,199 @@
+"""CLI нагрузочного теста /render.
+
+Поднимает локальные fake fal и источник изображений, при необходимости
+запускает сам сервис (imageflow/run.py) с FAL_QUEUE_URL на заглушку и
+подаёт нагрузку.
+
+Примеры:
+    # Запустить сервис и прогнать 4 параллельных клиента 2 минуты
+    python -m imageflow.loadtest --spawn --concurrency 4 --duration 120
+
+    # Открытый цикл 0.5 запроса/с, 10% задач с 422, лимит uvicorn 6 соединений
+    python -m imageflow.loadtest --spawn --rate 0.5 --unprocessable-rate 0.1 --limit-concurrency 6
+
+    # Уже запущенный сервис (он должен смотреть на FAL_QUEUE_URL, напечатанный скриптом)
+    python -m imageflow.loadtest --target http://127.0.0.1:8000 --service-pid 12345 --fal-port 9100
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from typing import List, Optional
+
+import requests
+
+from .driver import RssSampler, payload_cycle, run_load, summarize
+from .servers import FakeFalQueue, ImageOrigin
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_healthy(target: str, process: subprocess.Popen, timeout: float = 120.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Сервис завершился с кодом {process.returncode} до готовности")
+        try:
+            if requests.get(f"{target}/health", timeout=2).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"Сервис не ответил на /health за {timeout} секунд")
+
+
+def _spawn_service(port: int, fal_url: str, limit_concurrency: Optional[int]) -> subprocess.Popen:
+    run_py = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "run.py")
+    env = dict(os.environ)
+    env.update({
+        "PORT": str(port),
+        "FAL_QUEUE_URL": fal_url,
+        "FAL_API_KEY": env.get("FAL_API_KEY", "loadtest"),
+    })
+    if limit_concurrency is not None:
+        env["LIMIT_CONCURRENCY"] = str(limit_concurrency)
+    return subprocess.Popen(
+        [sys.executable, run_py],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест ImageFlow /render с локальными заглушками")
+    target_group = parser.add_mutually_exclusive_group(required=True)
+    target_group.add_argument("--spawn", action="store_true", help="Запустить сервис (imageflow/run.py) локально")
+    target_group.add_argument("--target", help="URL уже запущенного сервиса")
+    parser.add_argument("--service-pid", type=int, help="PID сервиса для замера RSS (при --target)")
+    parser.add_argument("--limit-concurrency", type=int, help="LIMIT_CONCURRENCY для запускаемого сервиса")
+
+    parser.add_argument("--concurrency", type=int, default=4, help="Параллельных клиентов (или лимит in-flight при --rate)")
+    parser.add_argument("--rate", type=float, help="Интенсивность открытого цикла, запросов/с")
+    parser.add_argument("--duration", type=float, default=60.0, help="Длительность подачи нагрузки, секунды")
+    parser.add_argument("--requests", type=int, help="Максимум запросов")
+    parser.add_argument("--timeout", type=float, default=600.0, help="Таймаут клиента на запрос, секунды")
+    parser.add_argument("--concept", default="v1", choices=["v1", "v2"])
+    parser.add_argument("--image-sizes", default="1024x1024,2000x1500", help="Размеры исходников WxH через запятую")
+    parser.add_argument("--image-format", default="jpg", choices=["jpg", "png"])
+    parser.add_argument("--unique-urls", action="store_true", help="Делать URL уникальными (обход кэшей по URL)")
+
+    parser.add_argument("--fal-port", type=int, default=0, help="Порт fake fal (0 = любой свободный)")
+    parser.add_argument("--queue-delay", type=float, default=2.0, help="Среднее время в очереди fal, секунды")
+    parser.add_argument("--run-delay", type=float, default=5.0, help="Время выполнения задачи fal, секунды")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Доля задач со статусом FAILED")
+    parser.add_argument("--unprocessable-rate", type=float, default=0.0, help="Доля результатов с HTTP 422")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля HTTP 500 от API fal")
+    parser.add_argument("--result-size", type=int, default=2048, help="Сторона результата Seedream для пресетов image_size (явный размер из запроса важнее)")
+    parser.add_argument("--seed", type=int, help="Seed для случайных задержек и ошибок")
+
+    parser.add_argument("--rss-interval", type=float, default=1.0, help="Интервал замера RSS, секунды")
+    parser.add_argument("--output", help="Сохранить отчёт в JSON")
+    args = parser.parse_args(argv)
+
+    origin = ImageOrigin().start()
+    fal = FakeFalQueue(
+        origin,
+        port=args.fal_port,
+        queue_delay=args.queue_delay,
+        run_delay=args.run_delay,
+        failure_rate=args.failure_rate,
+        unprocessable_rate=args.unprocessable_rate,
+        error_rate=args.error_rate,
+        result_size=args.result_size,
+        seed=args.seed
+    ).start()
+    print(f"[LoadTest] Fake fal: {fal.base_url} (FAL_QUEUE_URL), источник изображений: {origin.base_url}", flush=True)
+
+    process = None
+    pid = args.service_pid
+    target = args.target
+    if args.spawn:
+        port = _free_port()
+        target = f"http://127.0.0.1:{port}"
+        process = _spawn_service(port, fal.base_url, args.limit_concurrency)
+        pid = process.pid
+        print(f"[LoadTest] Сервис запущен (pid={pid}), ожидание /health на {target}...", flush=True)
+    target = target.rstrip("/")
+
+    sampler = None
+    try:
+        if process is not None:
+            _wait_healthy(target, process)
+
+        sizes = [tuple(int(v) for v in s.lower().split("x")) for s in args.image_sizes.split(",")]
+        urls = [origin.image_url(w, h, args.image_format) for w, h in sizes]
+        for w, h in sizes:
+            origin.image_bytes(w, h, args.image_format)  # прогреваем кэш источника
+
+        if pid:
+            sampler = RssSampler(pid, interval=args.rss_interval).start()
+
+        mode = f"открытый цикл {args.rate} запр/с" if args.rate else "закрытый цикл"
+        print(f"[LoadTest] Нагрузка: {mode}, concurrency={args.concurrency}, duration={args.duration}с", flush=True)
+        started = time.perf_counter()
+        records = run_load(
+            target,
+            payload_cycle(urls, args.concept, make_unique=args.unique_urls),
+            concurrency=args.concurrency,
+            rate=args.rate,
+            duration=args.duration,
+            max_requests=args.requests,
+            timeout=args.timeout,
+            seed=args.seed
+        )
+        wall = time.perf_counter() - started
+    finally:
+        if sampler is not None:
+            sampler.stop()
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        fal.stop()
+        origin.stop()
+
+    report = summarize(records, wall)
+    report["config"] = {k: v for k, v in vars(args).items() if k != "output"}
+    report["fake_fal"] = fal.stats
+    rss = [s["rss_mb"] for s in sampler.samples] if sampler is not None else []
+    report["rss_mb"] = {
+        "min": min(rss) if rss else None,
+        "max": max(rss) if rss else None,
+        "samples": sampler.samples if sampler is not None else [],
+    }
+
+    latency = report["latency_seconds"]
+    print(
+        f"[LoadTest] Запросов: {report['requests']}, успешных: {report['succeeded']}, "
+        f"throughput: {report['throughput_rps']} запр/с",
+        flush=True
+    )
+    print(
+        f"[LoadTest] Задержка (с): p50={latency['p50']} p90={latency['p90']} p95={latency['p95']} "
+        f"p99={latency['p99']} max={latency['max']}",
+        flush=True
+    )
+    print(f"[LoadTest] Классы ответов: {report['error_classes']}", flush=True)
+    print(f"[LoadTest] Fake fal: {fal.stats}", flush=True)
+    if rss:
+        print(f"[LoadTest] RSS сервиса: {min(rss):.0f}-{max(rss):.0f} МБ ({len(rss)} замеров)", flush=True)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"[LoadTest] Отчёт сохранён в {args.output}", flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
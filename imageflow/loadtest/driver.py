@@ -0,0 +1,212 @@
+"""Генерация нагрузки на /render и сбор статистики."""
+import itertools
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional
+
+import requests
+
+
+def _error_class(status: Optional[int], error: Optional[BaseException]) -> str:
+    if error is not None:
+        return type(error).__name__
+    if status == 200:
+        return "ok"
+    return f"http_{status}"
+
+
+class RssSampler:
+    """Периодически читает RSS процесса сервиса из /proc/<pid>/status."""
+
+    def __init__(self, pid: int, interval: float = 1.0):
+        self.pid = pid
+        self.interval = interval
+        self.samples: List[Dict[str, float]] = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+        self._start = time.perf_counter()
+
+    def _read_rss_mb(self) -> Optional[float]:
+        try:
+            with open(f"/proc/{self.pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) / 1024
+        except OSError:
+            return None
+        return None
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            rss = self._read_rss_mb()
+            if rss is not None:
+                self.samples.append({"t": round(time.perf_counter() - self._start, 2), "rss_mb": round(rss, 1)})
+            self._stop.wait(self.interval)
+
+    def start(self) -> "RssSampler":
+        self._start = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+def run_load(
+    target: str,
+    payloads: Iterator[Dict],
+    concurrency: int = 4,
+    rate: Optional[float] = None,
+    duration: float = 60.0,
+    max_requests: Optional[int] = None,
+    timeout: float = 600.0,
+    seed: Optional[int] = None
+) -> List[Dict]:
+    """
+    Подать нагрузку на POST {target}/render.
+    
+    Два режима:
+    - закрытый цикл (rate=None): `concurrency` воркеров шлют запросы друг за другом;
+    - открытый цикл (rate задан): запросы приходят пуассоновским потоком с интенсивностью
+      `rate` запросов/с, не более `concurrency` одновременно на стороне клиента.
+      Запросы, которые не удалось отправить из-за лимита, учитываются как "client_saturated".
+    
+    Returns:
+        Список записей {start, latency, status, error_class, bytes}
+    """
+    records: List[Dict] = []
+    lock = threading.Lock()
+    session_local = threading.local()
+    payload_lock = threading.Lock()
+    started = time.perf_counter()
+    deadline = started + duration
+    counter = itertools.count()
+
+    def next_payload() -> Optional[Dict]:
+        with payload_lock:
+            if max_requests is not None and next(counter) >= max_requests:
+                return None
+            return next(payloads)
+
+    def send(payload: Dict) -> None:
+        session = getattr(session_local, "session", None)
+        if session is None:
+            session = session_local.session = requests.Session()
+        t0 = time.perf_counter()
+        status, error, size = None, None, 0
+        try:
+            response = session.post(f"{target}/render", json=payload, timeout=timeout)
+            status, size = response.status_code, len(response.content)
+        except requests.RequestException as e:
+            error = e
+        record = {
+            "start": round(t0 - started, 3),
+            "latency": time.perf_counter() - t0,
+            "status": status,
+            "error_class": _error_class(status, error),
+            "bytes": size,
+        }
+        with lock:
+            records.append(record)
+
+    if rate is None:
+        def worker():
+            while time.perf_counter() < deadline:
+                payload = next_payload()
+                if payload is None:
+                    return
+                send(payload)
+
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return records
+
+    rng = random.Random(seed)
+    slots = threading.BoundedSemaphore(concurrency)
+
+    def send_and_release(payload: Dict) -> None:
+        try:
+            send(payload)
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        next_arrival = time.perf_counter()
+        while True:
+            next_arrival += rng.expovariate(rate)
+            if next_arrival >= deadline:
+                break
+            time.sleep(max(0.0, next_arrival - time.perf_counter()))
+            payload = next_payload()
+            if payload is None:
+                break
+            if not slots.acquire(blocking=False):
+                with lock:
+                    records.append({
+                        "start": round(time.perf_counter() - started, 3),
+                        "latency": 0.0,
+                        "status": None,
+                        "error_class": "client_saturated",
+                        "bytes": 0,
+                    })
+                continue
+            pool.submit(send_and_release, payload)
+    return records
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100 * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+def summarize(records: List[Dict], wall_seconds: float) -> Dict:
+    """Сводка: пропускная способность, перцентили задержки успешных запросов, классы ошибок."""
+    ok = sorted(r["latency"] for r in records if r["error_class"] == "ok")
+    classes: Dict[str, int] = {}
+    for r in records:
+        classes[r["error_class"]] = classes.get(r["error_class"], 0) + 1
+
+    timeline: Dict[int, Dict[str, int]] = {}
+    for r in records:
+        second = int(r["start"] + r["latency"])
+        bucket = timeline.setdefault(second, {"ok": 0, "error": 0})
+        bucket["ok" if r["error_class"] == "ok" else "error"] += 1
+
+    return {
+        "requests": len(records),
+        "succeeded": len(ok),
+        "wall_seconds": round(wall_seconds, 2),
+        "throughput_rps": round(len(ok) / wall_seconds, 3) if wall_seconds > 0 else 0.0,
+        "latency_seconds": {
+            "p50": round(_percentile(ok, 50), 3),
+            "p90": round(_percentile(ok, 90), 3),
+            "p95": round(_percentile(ok, 95), 3),
+            "p99": round(_percentile(ok, 99), 3),
+            "max": round(ok[-1], 3) if ok else 0.0,
+            "mean": round(statistics.fmean(ok), 3) if ok else 0.0,
+        },
+        "error_classes": classes,
+        "completions_per_second": [{"t": t, **timeline[t]} for t in sorted(timeline)],
+    }
+
+
+def payload_cycle(image_urls: List[str], concept: str = "v1", make_unique: bool = False) -> Iterator[Dict]:
+    """Бесконечный поток тел запросов /render по списку URL."""
+    for i, url in enumerate(itertools.cycle(image_urls)):
+        if make_unique:
+            url = f"{url}?n={i}"
+        yield {
+            "image_url": url,
+            "game_title": f"Load Test {i}",
+            "provider": "Fake Provider",
+            "concept": concept,
+        }
@@ -0,0 +1,248 @@
+"""Локальные заглушки внешних сервисов: очередь fal (Seedream) и источник изображений."""
+import io
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+from ..benchmarks.synthetic import make_image
+
+SEEDREAM_PATH = "/fal-ai/bytedance/seedream/v4/edit"
+
+_IMAGE_PATH_RE = re.compile(r"^/images/(\d+)x(\d+)\.(jpg|png)$")
+
+
+class _QuietHandler(BaseHTTPRequestHandler):
+    """Базовый обработчик без логирования каждого запроса в stderr."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: bytes, content_type: str) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, payload: Dict) -> None:
+        self._send(status, json.dumps(payload).encode("utf-8"), "application/json")
+
+
+# ============================================================================
+# Источник изображений
+# ============================================================================
+
+class ImageOrigin:
+    """
+    Отдаёт синтетические изображения по /images/<W>x<H>.jpg|png.
+    
+    Закодированные байты кэшируются, чтобы генерация не влияла на замеры.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self._cache: Dict[Tuple[int, int, str], bytes] = {}
+        self._lock = threading.Lock()
+        origin = self
+
+        class Handler(_QuietHandler):
+            def do_GET(self):
+                match = _IMAGE_PATH_RE.match(self.path.split("?")[0])
+                if not match:
+                    self._send(404, b"not found", "text/plain")
+                    return
+                width, height, ext = int(match.group(1)), int(match.group(2)), match.group(3)
+                body = origin.image_bytes(width, height, ext)
+                self._send(200, body, "image/jpeg" if ext == "jpg" else "image/png")
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def image_url(self, width: int, height: int, ext: str = "jpg") -> str:
+        return f"{self.base_url}/images/{width}x{height}.{ext}"
+
+    def image_bytes(self, width: int, height: int, ext: str) -> bytes:
+        key = (width, height, ext)
+        with self._lock:
+            body = self._cache.get(key)
+        if body is None:
+            buf = io.BytesIO()
+            image = make_image(width, height, seed=width * 31 + height)
+            if ext == "jpg":
+                image.save(buf, format="JPEG", quality=90)
+            else:
+                image.save(buf, format="PNG")
+            body = buf.getvalue()
+            with self._lock:
+                self._cache[key] = body
+        return body
+
+    def start(self) -> "ImageOrigin":
+        threading.Thread(target=self.server.serve_forever, name="fake-origin", daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# ============================================================================
+# Очередь fal
+# ============================================================================
+
+class FakeFalQueue:
+    """
+    Эмуляция queue API fal для Seedream: submit -> status (IN_QUEUE/IN_PROGRESS/COMPLETED/FAILED) -> result.
+    
+    Args:
+        origin: Источник изображений, на который указывают результаты
+        queue_delay: Среднее время в очереди (секунды, экспоненциальное распределение)
+        run_delay: Время выполнения после выхода из очереди (секунды)
+        failure_rate: Доля задач, завершающихся статусом FAILED
+        unprocessable_rate: Доля задач, у которых результат отдаётся с 422
+        error_rate: Доля HTTP 500 на любой запрос (сбои самого API)
+        result_size: Размер результирующего изображения для пресетов (square_hd = 2048);
+            явный image_size {"width", "height"} из запроса имеет приоритет
+    """
+
+    def __init__(
+        self,
+        origin: ImageOrigin,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        queue_delay: float = 2.0,
+        run_delay: float = 5.0,
+        failure_rate: float = 0.0,
+        unprocessable_rate: float = 0.0,
+        error_rate: float = 0.0,
+        result_size: int = 2048,
+        seed: Optional[int] = None
+    ):
+        self.origin = origin
+        self.queue_delay = queue_delay
+        self.run_delay = run_delay
+        self.failure_rate = failure_rate
+        self.unprocessable_rate = unprocessable_rate
+        self.error_rate = error_rate
+        self.result_size = result_size
+        self._rng = random.Random(seed)
+        self._jobs: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self.stats = {"submitted": 0, "status_polls": 0, "results": 0, "failed": 0, "unprocessable": 0, "errors": 0}
+        fal = self
+
+        class Handler(_QuietHandler):
+            def _maybe_error(self) -> bool:
+                if fal._roll(fal.error_rate):
+                    fal._count("errors")
+                    self._send_json(500, {"detail": "fake internal error"})
+                    return True
+                return False
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length)
+                if self.path != SEEDREAM_PATH:
+                    self._send_json(404, {"detail": "not found"})
+                    return
+                if self._maybe_error():
+                    return
+                try:
+                    image_size = json.loads(body or b"{}").get("image_size")
+                except ValueError:
+                    image_size = None
+                self._send_json(200, fal.submit(image_size))
+
+            def do_GET(self):
+                if self._maybe_error():
+                    return
+                match = re.match(r"^/requests/([0-9a-f]+)(/status)?$", self.path.split("?")[0])
+                if not match:
+                    self._send_json(404, {"detail": "not found"})
+                    return
+                job_id, is_status = match.group(1), bool(match.group(2))
+                status, payload = fal.status(job_id) if is_status else fal.result(job_id)
+                self._send_json(status, payload)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _roll(self, probability: float) -> bool:
+        with self._lock:
+            return self._rng.random() < probability
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self.stats[key] += 1
+
+    def submit(self, image_size=None) -> Dict:
+        job_id = uuid.uuid4().hex
+        if isinstance(image_size, dict):
+            result_size = (int(image_size.get("width", self.result_size)), int(image_size.get("height", self.result_size)))
+        else:
+            result_size = (self.result_size, self.result_size)
+        with self._lock:
+            queued = self._rng.expovariate(1 / self.queue_delay) if self.queue_delay > 0 else 0.0
+            job = {
+                "created": time.time(),
+                "queued": queued,
+                "failed": self._rng.random() < self.failure_rate,
+                "unprocessable": self._rng.random() < self.unprocessable_rate,
+                "result_size": result_size,
+            }
+            self._jobs[job_id] = job
+            self.stats["submitted"] += 1
+        base = f"{self.base_url}/requests/{job_id}"
+        return {"request_id": job_id, "status_url": f"{base}/status", "response_url": base}
+
+    def status(self, job_id: str) -> Tuple[int, Dict]:
+        self._count("status_polls")
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return 404, {"detail": "unknown request"}
+        elapsed = time.time() - job["created"]
+        if elapsed < job["queued"]:
+            return 200, {"status": "IN_QUEUE"}
+        if elapsed < job["queued"] + self.run_delay:
+            return 200, {"status": "IN_PROGRESS"}
+        if job["failed"]:
+            self._count("failed")
+            return 200, {"status": "FAILED", "error": "fake failure"}
+        return 200, {"status": "COMPLETED", "response_url": f"{self.base_url}/requests/{job_id}"}
+
+    def result(self, job_id: str) -> Tuple[int, Dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return 404, {"detail": "unknown request"}
+        if job["unprocessable"]:
+            self._count("unprocessable")
+            return 422, {"detail": [{"msg": "fake content policy violation"}]}
+        self._count("results")
+        url = self.origin.image_url(*job["result_size"], "png")
+        return 200, {"images": [{"url": url}]}
+
+    def start(self) -> "FakeFalQueue":
+        threading.Thread(target=self.server.serve_forever, name="fake-fal", daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
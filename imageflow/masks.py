@@ -2,29 +2,31 @@
 import numpy as np
 import cv2
 
+from .frame import ImageLike, as_array
 
-def grow_mask(mask: np.ndarray, grow_pixels: int = 7) -> np.ndarray:
+
+def grow_mask(mask: ImageLike, grow_pixels: int = 7) -> np.ndarray:
     """
     Расширить маску (дилатация).
     
     Args:
-        mask: numpy array (H, W) с значениями 0-255
+        mask: Маска (H, W) с значениями 0-255: numpy array или Frame
         grow_pixels: Количество пикселей для расширения
         
     Returns:
         Расширенная маска (H, W, 0-255)
     """
     kernel = np.ones((grow_pixels * 2 + 1, grow_pixels * 2 + 1), np.uint8)
-    dilated = cv2.dilate(mask, kernel, iterations=1)
+    dilated = cv2.dilate(as_array(mask, "L"), kernel, iterations=1)
     return dilated
 
 
-def blur_mask(mask: np.ndarray, blur_size: int = 5) -> np.ndarray:
+def blur_mask(mask: ImageLike, blur_size: int = 5) -> np.ndarray:
     """
     Размыть маску (Gaussian blur).
     
     Args:
-        mask: numpy array (H, W) с значениями 0-255
+        mask: Маска (H, W) с значениями 0-255: numpy array или Frame
         blur_size: Размер ядра размытия (должен быть нечётным)
         
     Returns:
@@ -33,16 +35,16 @@ def blur_mask(mask: np.ndarray, blur_size: int = 5) -> np.ndarray:
     if blur_size % 2 == 0:
         blur_size += 1
     
-    blurred = cv2.GaussianBlur(mask, (blur_size, blur_size), 0)
+    blurred = cv2.GaussianBlur(as_array(mask, "L"), (blur_size, blur_size), 0)
     return blurred
 
 
-def grow_mask_and_blur(mask: np.ndarray, grow_pixels: int = 7, blur_size: int = 0) -> np.ndarray:
+def grow_mask_and_blur(mask: ImageLike, grow_pixels: int = 7, blur_size: int = 0) -> np.ndarray:
     """
     Комбинированная операция: расширение + размытие маски.
     
     Args:
-        mask: numpy array (H, W) с значениями 0-255
+        mask: Маска (H, W) с значениями 0-255: numpy array или Frame
         grow_pixels: Количество пикселей для расширения
         blur_size: Размер ядра размытия
         
@@ -54,16 +56,16 @@ def grow_mask_and_blur(mask: np.ndarray, grow_pixels: int = 7, blur_size: int =
     return blurred
 
 
-def invert_mask(mask: np.ndarray) -> np.ndarray:
+def invert_mask(mask: ImageLike) -> np.ndarray:
     """
     Инвертировать маску (белое -> чёрное, чёрное -> белое).
     
     Args:
-        mask: numpy array (H, W) с значениями 0-255
+        mask: Маска (H, W) с значениями 0-255: numpy array или Frame
         
     Returns:
         Инвертированная маска (H, W, 0-255)
     """
-    return 255 - mask
+    return 255 - as_array(mask, "L")
 
 
@@ -0,0 +1,116 @@
+"""Выходные размеры: разбор, пирамида resize и параллельное кодирование.
+
+Пайплайн рендерит 1024x1280 один раз; все запрошенные размеры строятся
+пирамидой - каждый из ближайшего большего уже готового (LANCZOS), а не
+отдельным прогоном пайплайна или ресайзом на стороне клиента.
+
+Переменные окружения:
+- IMAGEFLOW_ENCODE_WORKERS - потоков для параллельного кодирования PNG (по умолчанию min(4, CPU))
+"""
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Hashable, Iterable, List, Tuple
+
+from PIL import Image
+
+from .tracing import span
+from .utils import pil_to_bytes
+
+# Размер рендера и размер ответа по умолчанию
+RENDER_SIZE = (1024, 1280)
+OUTPUT_SIZE = (512, 640)
+
+MAX_OUTPUT_SIZES = 8
+
+# Допустимое отклонение пропорций от 4:5 (округление сторон)
+_ASPECT_TOLERANCE = 0.01
+
+
+def parse_size(value: str) -> Tuple[int, int]:
+    """
+    Разобрать размер "WxH".
+
+    Raises:
+        ValueError: Некорректный формат
+    """
+    parts = value.lower().strip().split("x")
+    if len(parts) != 2 or not all(part.strip().isdigit() for part in parts):
+        raise ValueError(f"Размер должен быть в формате WxH, получено: {value!r}")
+    return int(parts[0]), int(parts[1])
+
+
+def validate_sizes(values: Iterable[str]) -> List[Tuple[int, int]]:
+    """
+    Разобрать и проверить список выходных размеров (порядок сохраняется, повторы убираются).
+
+    Raises:
+        ValueError: Формат, больше RENDER_SIZE, пропорции не 4:5 или слишком много размеров
+    """
+    sizes = list(dict.fromkeys(parse_size(value) for value in values))
+    if not sizes:
+        raise ValueError("Список размеров пуст")
+    if len(sizes) > MAX_OUTPUT_SIZES:
+        raise ValueError(f"Не больше {MAX_OUTPUT_SIZES} размеров за запрос")
+    render_aspect = RENDER_SIZE[0] / RENDER_SIZE[1]
+    for width, height in sizes:
+        if not (0 < width <= RENDER_SIZE[0] and 0 < height <= RENDER_SIZE[1]):
+            raise ValueError(
+                f"Размер {width}x{height} вне диапазона 1x1..{RENDER_SIZE[0]}x{RENDER_SIZE[1]}"
+            )
+        if abs(width / height - render_aspect) > _ASPECT_TOLERANCE * render_aspect:
+            raise ValueError(f"Размер {width}x{height}: пропорции должны быть 4:5, как у рендера")
+    return sizes
+
+
+def build_pyramid(image: Image.Image, sizes: Iterable[Tuple[int, int]]) -> Dict[Tuple[int, int], Image.Image]:
+    """
+    Построить все размеры из одного рендера.
+
+    Размеры обрабатываются от большего к меньшему, каждый уменьшается из
+    ближайшего большего готового уровня (или из исходника) - LANCZOS по
+    меньшему изображению дешевле, а качество при уменьшении не ниже 2x
+    практически не отличается от прямого resize.
+
+    Returns:
+        {(ширина, высота): изображение} в порядке sizes
+    """
+    sizes = list(sizes)
+    levels = {image.size: image}
+    for size in sorted(set(sizes), key=lambda s: s[0] * s[1], reverse=True):
+        if size in levels:
+            continue
+        source = min(
+            (level for level in levels.values() if level.size[0] >= size[0] and level.size[1] >= size[1]),
+            key=lambda level: level.size[0] * level.size[1]
+        )
+        levels[size] = source.resize(size, Image.Resampling.LANCZOS)
+    return {size: levels[size] for size in sizes}
+
+
+def _encode_workers() -> int:
+    return max(1, int(os.getenv("IMAGEFLOW_ENCODE_WORKERS", min(4, os.cpu_count() or 1))))
+
+
+def encode_parallel(images: Dict[Hashable, Image.Image], format: str = "PNG") -> Dict[Hashable, bytes]:
+    """
+    Закодировать изображения параллельно (Pillow отпускает GIL в кодировщике).
+
+    Returns:
+        {ключ: байты} в порядке images
+    """
+    def encode(key: Hashable, image: Image.Image) -> bytes:
+        with span("encode_png", size=f"{image.size[0]}x{image.size[1]}"):
+            return pil_to_bytes(image, format=format)
+
+    if len(images) == 1:
+        key, image = next(iter(images.items()))
+        return {key: encode(key, image)}
+
+    with ThreadPoolExecutor(max_workers=min(_encode_workers(), len(images)), thread_name_prefix="imageflow-encode") as pool:
+        # Копия контекста на задачу: span'ы попадают в трассу запроса
+        futures = {
+            key: pool.submit(contextvars.copy_context().run, encode, key, image)
+            for key, image in images.items()
+        }
+        return {key: future.result() for key, future in futures.items()}
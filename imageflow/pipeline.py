@@ -1,90 +1,135 @@
 """Основной пайплайн обработки изображений."""
+import os
+import threading
 import time
+from contextlib import contextmanager
 import requests
 import cv2
 import numpy as np
-from PIL import Image
+from PIL import Image, ImageColor
+from typing import Dict, Optional, Sequence, Tuple
 from .seedream_api import run_seedream
 from .rmbg import remove_background
 from .masks import grow_mask_and_blur, invert_mask
 from .inpaint import inpaint_pil_image
 from .colors import extract_main_colors, colors_to_hex
 from .colors_simple import extract_corner_colors
-from .gradient import create_gradient_background
+from .gradient import create_gradient_frame
+from .frame import Frame
 from .compose import composite_images
-# Текст убран по запросу
-# from .textdraw import add_watermark, add_centered_text, add_centered_multiline_text
-# from .utils import split_game_title
+from .metrics import STAGE_SECONDS, FALLBACK_TOTAL, record_cache
+from .tracing import span
+from .admission import AdmissionRejected, PIPELINE_WORKING_SET_BYTES, reserve
+from .source import SourceImage, start_transfer_log
+from .outputs import OUTPUT_SIZE, RENDER_SIZE, build_pyramid
+from . import hedging
+from . import profiler
+from . import scheduler
+from . import thread_budget
+from . import dedup
+from .hedging import HedgeCancelled
+from .circuit_breaker import CircuitOpenError
+from . import deadline
+from .deadline import DeadlineExceeded
+from .textdraw import apply_sprites, centered_multiline_text_sprite, centered_text_sprite
+from .utils import split_game_title
 
 
-def full_pipeline(
+@contextmanager
+def _stage(name: str):
+    """Замерить стадию пайплайна: гистограмма imageflow_stage_duration_seconds и span трассы."""
+    # Отменённая ветка хеджирования и запрос с истёкшим дедлайном прерываются на границе стадий
+    hedging.check_cancelled()
+    deadline.check(name)
+    # Поток стадии попадает в сэмплы профиля запроса (ветки хеджирования - в своих потоках)
+    profiler.track_thread()
+    # OpenMP (KMeans) ограничивается в каждом потоке отдельно
+    thread_budget.apply_to_thread()
+    start = time.perf_counter()
+    with span(name), STAGE_SECONDS.time(stage=name):
+        yield
+    # Длительность стадии - сигнал адаптивного лимита планировщика
+    scheduler.observe_stage(name, time.perf_counter() - start)
+
+
+def _fallback_reason(error: Exception) -> str:
+    """Классифицировать причину перехода на fallback для метрик."""
+    if isinstance(error, CircuitOpenError):
+        return "circuit_open"
+    if isinstance(error, DeadlineExceeded):
+        return "deadline"
+    message = str(error).lower()
+    if "422" in message:
+        return "unprocessable"
+    if "timeout" in message:
+        return "timeout"
+    return "error"
+
+
+# {концепция: {(ширина, высота): изображение}}
+Renders = Dict[str, Dict[Tuple[int, int], Image.Image]]
+
+
+# Seedream сразу отдаёт результат рабочего размера: пресет square_hd (2048x2048)
+# передавался и декодировался в 4 раза больше пикселей, чем нужно пайплайну
+SEEDREAM_IMAGE_SIZE = {"width": 1024, "height": 1024}
+
+# Время, которое Seedream оставляет до дедлайна запроса на fallback и рендер,
+# и минимальный бюджет, при котором Seedream вообще имеет смысл запускать
+DEADLINE_RENDER_RESERVE = float(os.getenv("IMAGEFLOW_DEADLINE_RENDER_RESERVE", 30))
+DEADLINE_MIN_SEEDREAM = float(os.getenv("IMAGEFLOW_DEADLINE_MIN_SEEDREAM", 20))
+
+# Рендер сразу в наибольшем запрошенном размере вместо 1024x1280 (см. _render_size)
+RENDER_AT_TARGET = os.getenv("IMAGEFLOW_RENDER_AT_TARGET", "").lower() in ("1", "true", "yes", "on")
+
+# Текст (название игры и провайдер) поверх рендера - по умолчанию выключен
+TEXT_OVERLAY = os.getenv("IMAGEFLOW_TEXT_OVERLAY", "").lower() in ("1", "true", "yes", "on")
+
+# Текстовые оверлеи на холсте 1024x1280: шрифт, центр нижней строки названия,
+# центр строки провайдера и ширина контейнера текста
+TEXT_FONT = "blackrumbleregular.ttf"
+TITLE_BOTTOM_Y = 1000
+PROVIDER_Y = 1190
+TEXT_MAX_WIDTH = 920
+
+
+def _clean_with_seedream(
     image_url: str,
-    game_title: str,
-    provider: str,
     fal_api_key: str,
-    seed: int = 2069714305,
-    concept: str = "v1"  # Концепция обработки: "v1" (с блюром фона) или "v2" (без блюра фона)
+    seed: int,
+    match: Optional[dedup.Match] = None
 ) -> Image.Image:
     """
-    Полный пайплайн обработки изображения по ComfyUI workflow.
+    Очистка исходника через Seedream; длительность успешных вызовов идёт в историю хеджирования.
     
-    Args:
-        image_url: URL исходного изображения
-        game_title: Название игры (верхний текст)
-        provider: Провайдер (нижний текст)
-        fal_api_key: FAL API ключ для Seedream
-        seed: Фиксированный seed для Seedream
-        concept: Концепция обработки ("v1" = с блюром фона, "v2" = без блюра фона)
-        
-    Returns:
-        Финальное обработанное изображение (PIL Image)
+    С match результат сохраняется для повторов этого арта (см. dedup).
     """
-    print("[Pipeline] Начало обработки...", flush=True)
-    print(f"[Pipeline] Концепция обработки: {concept} (v1=с блюром фона, v2=без блюра фона)", flush=True)
-    start_time = time.time()
-    
-    # Шаг 0: Загрузка изображения (для Seedream)
-    print("[Pipeline] Шаг 0: Загрузка исходного изображения...", flush=True)
-    import sys
-    sys.stdout.flush()
-    
-    from .utils import fetch_image
-    try:
-        original_image = fetch_image(image_url)
-        print(f"[Pipeline] Оригинальное изображение загружено: {original_image.size} {original_image.mode}", flush=True)
-    except Exception as e:
-        print(f"[Pipeline] ОШИБКА загрузки изображения: {type(e).__name__}: {e}", flush=True)
-        sys.stdout.flush()
-        raise
-    
-    if original_image.mode != "RGB":
-        original_image = original_image.convert("RGB")
-    
-    # Для Seedream: НЕ увеличиваем изображение заранее
-    # Seedream сам обрабатывает размеры, увеличение снижает качество
-    # Отправляем оригинальное изображение как есть
-    print(f"[Pipeline] Исходное изображение подготовлено для Seedream: {original_image.size} (оригинальный размер без увеличения)", flush=True)
-    
-    # Шаг 1: Seedream очистка (с fallback на оригинальное изображение)
-    print("[Pipeline] Шаг 1: Seedream очистка...", flush=True)
     seedream_start = time.time()
     # Минимальный промпт: пытаемся избежать content policy violations
     # Используем максимально нейтральный и технический язык
     seedream_prompt = "Remove text and logos from image"
     
+    # Seedream должен закончить раньше дедлайна запроса - с запасом на fallback и рендер
+    with deadline.reserve(DEADLINE_RENDER_RESERVE), _stage("seedream"):
+        cleaned_image = run_seedream(
+            image_url, seedream_prompt, fal_api_key, SEEDREAM_IMAGE_SIZE, seed,
+            result_size=(1024, 1024)
+        )
+    seedream_seconds = time.time() - seedream_start
+    hedging.SEEDREAM_LATENCY.record(seedream_seconds)
+    print(f"[Pipeline] Seedream завершён за {seedream_seconds:.2f}с", flush=True)
+    print(f"[Pipeline] Seedream результат: {cleaned_image.size} {cleaned_image.mode}", flush=True)
+    if match is not None:
+        match.store_seedream(seed, cleaned_image)
+    return cleaned_image
+
+
+def _load_fallback_image(source: SourceImage) -> Image.Image:
+    """Fallback без Seedream: оригинальное изображение, cover-crop до 1024x1024."""
+    print(f"[Pipeline] Fallback: загружаем оригинальное изображение напрямую...", flush=True)
     try:
-        cleaned_image = run_seedream(image_url, seedream_prompt, fal_api_key, "square_hd", seed)
-        print(f"[Pipeline] Seedream завершён за {time.time() - seedream_start:.2f}с", flush=True)
-        print(f"[Pipeline] Seedream результат: {cleaned_image.size} {cleaned_image.mode}", flush=True)
-    except Exception as e:
-        print(f"[Pipeline] ВНИМАНИЕ: Seedream не удался ({type(e).__name__}: {e}), используем оригинальное изображение", flush=True)
-        print(f"[Pipeline] Fallback: загружаем оригинальное изображение напрямую...", flush=True)
-        # Fallback: используем оригинальное изображение без Seedream
-        from .utils import fetch_image
-        try:
-            cleaned_image = fetch_image(image_url)
-            if cleaned_image.mode != "RGB":
-                cleaned_image = cleaned_image.convert("RGB")
+        with _stage("fallback_load"):
+            cleaned_image = source.image(target_size=(1024, 1024))
             
             # Resize до 1024x1024 с заполнением всего квадрата (без белых полей)
             # Масштабируем изображение так, чтобы оно заполнило весь квадрат
@@ -103,27 +148,187 @@ def full_pipeline(
                 right = left + target_size[0]
                 bottom = top + target_size[1]
                 cleaned_image = cleaned_image.crop((left, top, right, bottom))
-                
+            
             print(f"[Pipeline] Fallback: оригинальное изображение загружено и масштабировано: {cleaned_image.size} {cleaned_image.mode}", flush=True)
-        except Exception as fallback_error:
-            print(f"[Pipeline] ОШИБКА: Fallback тоже не удался: {type(fallback_error).__name__}: {fallback_error}", flush=True)
-            raise RuntimeError(f"Не удалось загрузить изображение: {fallback_error}") from fallback_error
+    except (AdmissionRejected, HedgeCancelled, DeadlineExceeded):
+        raise
+    except Exception as fallback_error:
+        print(f"[Pipeline] ОШИБКА: Fallback тоже не удался: {type(fallback_error).__name__}: {fallback_error}", flush=True)
+        raise RuntimeError(f"Не удалось загрузить изображение: {fallback_error}") from fallback_error
+    return cleaned_image
+
+
+def _dedup_lookup(source: SourceImage) -> Optional[dedup.Match]:
+    """Перцептивный хеш исходника и поиск повтора в индексе; ошибки не мешают обычному пути."""
+    try:
+        with _stage("dedup_lookup"):
+            # Тот же рабочий размер, что у fallback: при переходе на fallback исходник уже загружен
+            match = dedup.lookup(source.image(target_size=(1024, 1024)))
+    except (AdmissionRejected, HedgeCancelled, DeadlineExceeded):
+        raise
+    except Exception as e:
+        print(f"[Pipeline] Дедупликация пропущена: {type(e).__name__}: {e}", flush=True)
+        return None
+    if match.entry is not None:
+        print(f"[Pipeline] Исходник совпал с известным {match.entry:016x} (расстояние {match.distance})", flush=True)
+    return match
+
+
+def _hedged_render(
+    image_url: str,
+    fal_api_key: str,
+    seed: int,
+    concepts: Sequence[str],
+    sizes: Sequence[Tuple[int, int]],
+    source: SourceImage,
+    render_size: Tuple[int, int],
+    text: Optional[Tuple[str, str]] = None,
+    match: Optional[dedup.Match] = None
+) -> Renders:
+    """Seedream-рендер с параллельным fallback-рендером, если Seedream медленнее перцентиля истории."""
+    seedream_failed = []
+    
+    def seedream_branch() -> Renders:
+        try:
+            cleaned_image = _clean_with_seedream(image_url, fal_api_key, seed, match)
+        except (AdmissionRejected, HedgeCancelled):
+            raise
+        except Exception as e:
+            print(f"[Pipeline] ВНИМАНИЕ: Seedream не удался ({type(e).__name__}: {e}), используем оригинальное изображение", flush=True)
+            FALLBACK_TOTAL.inc(reason=_fallback_reason(e))
+            seedream_failed.append(e)
+            raise
+        # Порог хеджирования и окно prefer_seedream - по Seedream, рендер уже не гонка
+        hedging.mark_ready()
+        results = _render(cleaned_image, concepts, sizes, render_size, text)
+        if match is not None:
+            match.store_renders(results, render_size, text)
+        return results
+    
+    def fallback_branch() -> Renders:
+        return _render(_load_fallback_image(source), concepts, sizes, render_size, text)
+    
+    results, winner = hedging.run_hedged(seedream_branch, fallback_branch, hedging.hedge_delay())
+    if winner == "secondary" and not seedream_failed:
+        # Seedream ещё работал - результат выбран хеджированием
+        FALLBACK_TOTAL.inc(reason="hedge")
+    print(f"[Pipeline] Результат хеджирования: {'Seedream' if winner == 'primary' else 'fallback'}", flush=True)
+    return results
+
+
+# Зона перехода маски градиента по Y на холсте 1024x1280
+GRADIENT_TRANSITION = (360, 960)  # Поднято выше (было 460), расширена зона перехода (было 860)
+
+_gradient_masks = {}
+_gradient_masks_lock = threading.Lock()
+
+
+def _scale_px(value: int, scale: float) -> int:
+    """Пиксельный параметр 1024x1280 (рост маски, радиус, строка) в масштабе рендера."""
+    return int(value * scale + 0.5)
+
+
+def _scale_kernel(size: int, scale: float) -> int:
+    """
+    Нечётное ядро размытия в масштабе рендера.
     
-    # Ресайз очищенного изображения до 1024x1024 (nearest-exact как в ComfyUI)
-    if cleaned_image.size != (1024, 1024):
-        cleaned_image = cleaned_image.resize((1024, 1024), Image.Resampling.NEAREST)
-        print(f"[Pipeline] Resized to: {cleaned_image.size}", flush=True)
+    Масштабируется радиус ядра: при sigma=0 OpenCV выводит sigma из размера
+    ядра, и так она остаётся пропорциональной масштабу (55 -> 27 при 0.5).
+    """
+    return 2 * int(size // 2 * scale) + 1
+
+
+def _gradient_mask(size: Tuple[int, int] = RENDER_SIZE) -> Frame:
+    """Расплывчатая маска градиента (0 = база, 255 = градиент), кэшируется по размеру холста."""
+    key = size
+    gradient_mask = _gradient_masks.get(key)
+    record_cache("gradient_mask", gradient_mask is not None)
+    if gradient_mask is not None:
+        return gradient_mask
+    
+    with _gradient_masks_lock:
+        gradient_mask = _gradient_masks.get(key)
+        if gradient_mask is None:
+            # маска: 0 = показываем базу (фон+персонаж), 255 = показываем градиент
+            width, height = size
+            scale = width / RENDER_SIZE[0]
+            mask = np.zeros((height, width), dtype=np.uint8)
+            transition_start, transition_end = (_scale_px(y, scale) for y in GRADIENT_TRANSITION)
+            
+            for y in range(height):
+                if y < transition_start:
+                    mask[y, :] = 0
+                elif y > transition_end:
+                    mask[y, :] = 255
+                else:
+                    t = (y - transition_start) / (transition_end - transition_start)
+                    mask[y, :] = int(t * 255)
+            
+            # СИЛЬНО размягчаем именно маску для максимально плавной границы
+            from .masks import blur_mask
+            mask = blur_mask(mask, blur_size=_scale_kernel(300, scale))  # Увеличено с 220 до 300 для более плавного перехода
+            gradient_mask = Frame(mask, "L")
+            _gradient_masks[key] = gradient_mask
+    return gradient_mask
+
+
+def _render(
+    cleaned_image: Image.Image,
+    concepts: Sequence[str],
+    sizes: Sequence[Tuple[int, int]],
+    render_size: Tuple[int, int] = RENDER_SIZE,
+    text: Optional[Tuple[str, str]] = None
+) -> Renders:
+    """
+    Стадии после очистки для одной или нескольких концепций.
     
-    # Конвертируем в RGB (Images to RGB в ComfyUI)
-    if cleaned_image.mode != "RGB":
-        cleaned_image = cleaned_image.convert("RGB")
-        print(f"[Pipeline] Converted to RGB: {cleaned_image.mode}", flush=True)
+    Общие стадии (rmbg, маска, инпейнтинг) выполняются один раз, на каждую
+    концепцию - только её фон, цвета, композиция, текст и пирамида выходных размеров.
+    """
+    layers = _prepare_layers(cleaned_image, render_size)
+    return {concept: _render_concept(layers, concept, sizes, text) for concept in concepts}
+
+
+def _render_size(sizes: Sequence[Tuple[int, int]], render_at_target: Optional[bool] = None) -> Tuple[int, int]:
+    """
+    Размер холста рендера.
+    
+    По умолчанию 1024x1280 с уменьшением до выходных размеров в конце. В режиме
+    render_at_target (IMAGEFLOW_RENDER_AT_TARGET) холст - наибольшие запрошенные
+    ширина и высота: стадии после rmbg работают с в 4 раза меньшим числом пикселей
+    для 512x640. Пропорции размеров совпадают с 4:5 лишь с точностью до
+    округления, поэтому наибольший по площади размер может быть меньше другого
+    по одной из сторон - холст берётся по каждой стороне отдельно.
+    """
+    if render_at_target is None:
+        render_at_target = RENDER_AT_TARGET
+    if not render_at_target:
+        return RENDER_SIZE
+    return max(width for width, _ in sizes), max(height for _, height in sizes)
+
+
+def _prepare_layers(cleaned_image: Image.Image, render_size: Tuple[int, int] = RENDER_SIZE) -> Dict[str, object]:
+    """Общие для всех концепций стадии: входное изображение, персонаж, маски."""
+    with _stage("prepare_input"):
+        # Ресайз очищенного изображения до 1024x1024 (nearest-exact как в ComfyUI)
+        if cleaned_image.size != (1024, 1024):
+            cleaned_image = cleaned_image.resize((1024, 1024), Image.Resampling.NEAREST)
+            print(f"[Pipeline] Resized to: {cleaned_image.size}", flush=True)
+    
+        # Конвертируем в RGB (Images to RGB в ComfyUI)
+        if cleaned_image.mode != "RGB":
+            cleaned_image = cleaned_image.convert("RGB")
+            print(f"[Pipeline] Converted to RGB: {cleaned_image.mode}", flush=True)
+    
+    # Резервируем рабочий набор стадий после Seedream (ожидание в очереди, если память занята)
+    reserve(PIPELINE_WORKING_SET_BYTES, "pipeline")
     
     # Шаг 2: Удаление фона (RMBG)
     print("[Pipeline] Шаг 2: Удаление фона...", flush=True)
     rmbg_start = time.time()
     try:
-        foreground_rgba, alpha_mask = remove_background(cleaned_image, model="u2net")
+        with _stage("rmbg"):
+            foreground_rgba, alpha_mask = remove_background(cleaned_image, model="u2net")
         print(f"[Pipeline] Удаление фона завершено за {time.time() - rmbg_start:.2f}с", flush=True)
     except Exception as e:
         import traceback
@@ -131,30 +336,90 @@ def full_pipeline(
         print(traceback.format_exc(), flush=True)
         raise
     
+    return _build_layers(cleaned_image, foreground_rgba, alpha_mask, render_size)
+
+
+def _build_layers(
+    cleaned_image: Image.Image,
+    foreground_rgba: Image.Image,
+    alpha_mask: np.ndarray,
+    render_size: Tuple[int, int] = RENDER_SIZE
+) -> Dict[str, object]:
+    """
+    Слои концепций из результата rmbg 1024x1024: маска фона и инпейнтинг в масштабе рендера.
+    
+    rmbg всегда работает на полном разрешении: альфа персонажа уменьшается
+    усреднением по площади, и край остаётся таким же сглаженным, как после
+    уменьшения готового рендера 1024x1280. Маска фона (grow + blur) нужна
+    только для размытия и выбора пикселей цветов - её дешевле строить сразу
+    в масштабе рендера.
+    """
+    side = render_size[0]
+    scale = side / RENDER_SIZE[0]
+    if side != cleaned_image.size[0]:
+        print(f"[Pipeline] Рендер в выходном размере {render_size[0]}x{render_size[1]} (масштаб {scale:.3f})", flush=True)
+        with _stage("downscale_layers"):
+            cleaned_image = cleaned_image.resize((side, side), Image.Resampling.LANCZOS)
+            foreground_rgba = foreground_rgba.resize((side, side), Image.Resampling.LANCZOS)
+            alpha_mask = cv2.resize(alpha_mask, (side, side), interpolation=cv2.INTER_AREA)
+    
     # ВАЖНО: Сохраняем оригинальное изображение ДО инпейнтинга для v1
-    # Это нужно, чтобы сохранить оригинальный фон для blur
-    original_image_before_inpaint = cleaned_image.copy()
+    # Это нужно, чтобы сохранить оригинальный фон для blur. Кадр - единственная
+    # копия: инпейнтинг, фон и цвета читают его буфер напрямую
+    original_image_before_inpaint = Frame.from_pil(cleaned_image, "RGB")
     print(f"[Pipeline] Сохранено оригинальное изображение для blur фона (concept=v1)", flush=True)
     
     # Шаг 3: Инверсия маски и обработка (grow + blur)
     print("[Pipeline] Шаг 3: Обработка маски...", flush=True)
     mask_start = time.time()
-    inverted_mask = invert_mask(alpha_mask)
-    processed_mask = grow_mask_and_blur(inverted_mask, grow_pixels=7, blur_size=5)
+    with _stage("mask"):
+        inverted_mask = invert_mask(alpha_mask)
+        processed_mask = grow_mask_and_blur(
+            inverted_mask, grow_pixels=_scale_px(7, scale), blur_size=_scale_kernel(5, scale)
+        )
     print(f"[Pipeline] Обработка маски завершена за {time.time() - mask_start:.2f}с", flush=True)
     
     # Шаг 4: Инпейнтинг БЕЗ blur (blur применим только к фону!)
     print("[Pipeline] Шаг 4: Инпейнтинг...", flush=True)
     inpaint_start = time.time()
-    inpainted_image = inpaint_pil_image(
-        cleaned_image.convert("RGB"),
-        processed_mask,
-        method=cv2.INPAINT_TELEA,
-        inpaint_radius=64,
-        blur_after=0  # НЕ блюрим здесь - блюрим только фон позже!
-    )
+    with _stage("inpaint"):
+        inpainted_image = inpaint_pil_image(
+            original_image_before_inpaint,
+            processed_mask,
+            method=cv2.INPAINT_TELEA,
+            inpaint_radius=_scale_px(64, scale),
+            blur_after=0  # НЕ блюрим здесь - блюрим только фон позже!
+        )
     print(f"[Pipeline] Инпейнтинг завершён за {time.time() - inpaint_start:.2f}с")
     
+    return {
+        "image": original_image_before_inpaint,
+        "foreground": foreground_rgba,
+        "alpha": alpha_mask,
+        "mask": processed_mask,
+        "size": render_size,
+        "scale": scale,
+    }
+
+
+def _render_concept(
+    layers: Dict[str, object],
+    concept: str,
+    sizes: Sequence[Tuple[int, int]],
+    text: Optional[Tuple[str, str]] = None
+) -> Dict[Tuple[int, int], Image.Image]:
+    """
+    Стадии концепции: фон (шаг 4.5), цвета, canvas, персонаж, градиент,
+    текст (если передан text = (название игры, провайдер)) и выходные размеры (по умолчанию 512x640).
+    """
+    original_image_before_inpaint = layers["image"]
+    foreground_rgba = layers["foreground"]
+    alpha_mask = layers["alpha"]
+    processed_mask = layers["mask"]
+    # Холст рендера: 1024x1280 или выходной размер в режиме render_at_target
+    width, height = layers["size"]
+    scale = layers["scale"]
+    
     # ========================================================================
     # РАЗДЕЛЕНИЕ НА ДВЕ ВЕТКИ: ФОН И ПЕРСОНАЖ
     # ========================================================================
@@ -162,45 +427,48 @@ def full_pipeline(
     # ВЕТКА ФОНА: inpainted_image → masked blur → извлечение цветов → градиент → маска-переход → background_with_gradient
     
     # Шаг 4.5: фон после инпейнта + masked blur по маске фона (только для v1)
-    if concept == "v1":
-        print("[Pipeline] Шаг 4.5: Masked blur фона (concept=v1, processed_mask: белое=фон)...", flush=True)
-        colors_start = time.time()
+    with _stage("background"):
+        if concept == "v1":
+            print("[Pipeline] Шаг 4.5: Masked blur фона (concept=v1, processed_mask: белое=фон)...", flush=True)
+            colors_start = time.time()
         
-        # === ПРАВИЛЬНАЯ ЛОГИКА: используем ОРИГИНАЛЬНОЕ изображение для blur фона ===
-        # Инпейнтинг закрашивает фон, поэтому мы используем оригинальное изображение ДО инпейнтинга
-        # для получения правильного размытого фона
-        bg_arr = np.array(original_image_before_inpaint)  # ОРИГИНАЛЬНОЕ изображение, не инпейнтированное!
-        m = np.array(processed_mask).astype(np.float32) / 255.0  # 1=фон (processed_mask из grow+blur)
+            # === ПРАВИЛЬНАЯ ЛОГИКА: используем ОРИГИНАЛЬНОЕ изображение для blur фона ===
+            # Инпейнтинг закрашивает фон, поэтому мы используем оригинальное изображение ДО инпейнтинга
+            # для получения правильного размытого фона
+            bg_arr = original_image_before_inpaint.array  # ОРИГИНАЛЬНОЕ изображение, не инпейнтированное!
+            m = processed_mask.astype(np.float32) / 255.0  # 1=фон (processed_mask из grow+blur)
         
-        # Создаем размытую версию оригинального изображения
-        # Увеличенный blur: было (11, 11), стало (33, 33) - в 3 раза больше
-        bg_blurred = cv2.GaussianBlur(bg_arr, (55, 55), 0)  # сильный blur фона
+            # Создаем размытую версию оригинального изображения
+            # Увеличенный blur: было (11, 11), стало (33, 33) - в 3 раза больше
+            blur_size = _scale_kernel(55, scale)
+            bg_blurred = cv2.GaussianBlur(bg_arr, (blur_size, blur_size), 0)  # сильный blur фона
         
-        # Смешиваем: где маска фона (m=1) - используем размытое оригинальное, где персонаж (m=0) - оригинальное четкое
-        # Это сохраняет оригинальный фон, но размывает его
-        bg_only = (bg_arr * (1 - m[..., None]) + bg_blurred * m[..., None]).astype(np.uint8)
+            # Смешиваем: где маска фона (m=1) - используем размытое оригинальное, где персонаж (m=0) - оригинальное четкое
+            # Это сохраняет оригинальный фон, но размывает его
+            bg_only = (bg_arr * (1 - m[..., None]) + bg_blurred * m[..., None]).astype(np.uint8)
         
-        bg_image = Image.fromarray(bg_only, "RGB")
-        print(f"[Pipeline] Masked blur фона применен (concept=v1, используется оригинальный фон)", flush=True)
-    else:
-        # v2: используем оригинальный фон БЕЗ блюра
-        print("[Pipeline] Шаг 4.5: Используем оригинальный фон без blur (concept=v2)...", flush=True)
-        colors_start = time.time()
-        # ВАЖНО: используем оригинальное изображение, не инпейнтированное!
-        # Инпейнтинг закрашивает фон, поэтому для v2 берем оригинал
-        bg_image = original_image_before_inpaint  # ОРИГИНАЛЬНОЕ изображение без blur
-        print(f"[Pipeline] Оригинальный фон используется без blur (concept=v2)", flush=True)
+            bg_image = Frame(bg_only, "RGB")
+            print(f"[Pipeline] Masked blur фона применен (concept=v1, используется оригинальный фон)", flush=True)
+        else:
+            # v2: используем оригинальный фон БЕЗ блюра
+            print("[Pipeline] Шаг 4.5: Используем оригинальный фон без blur (concept=v2)...", flush=True)
+            colors_start = time.time()
+            # ВАЖНО: используем оригинальное изображение, не инпейнтированное!
+            # Инпейнтинг закрашивает фон, поэтому для v2 берем оригинал
+            bg_image = original_image_before_inpaint  # ОРИГИНАЛЬНОЕ изображение без blur
+            print(f"[Pipeline] Оригинальный фон используется без blur (concept=v2)", flush=True)
     
     # === извлекаем цвета ТОЛЬКО из фона ===
     print("[Pipeline] Шаг 5: Извлечение цветов строго из фона...", flush=True)
-    dominant_colors = extract_main_colors(
-        bg_image,
-        num_colors=2,
-        random_state=42,
-        algorithm="elkan",
-        mask=processed_mask  # белое=фон
-    )
-    color_hexes = colors_to_hex(dominant_colors)
+    with _stage("colors"):
+        dominant_colors = extract_main_colors(
+            bg_image,
+            num_colors=2,
+            random_state=42,
+            algorithm="elkan",
+            mask=processed_mask  # белое=фон
+        )
+        color_hexes = colors_to_hex(dominant_colors)
     print(f"[Pipeline] Доминантные цвета из фона: {color_hexes}, за {time.time() - colors_start:.2f}с")
     
     # Используем ТОЛЬКО первый (самый доминантный) цвет для градиента
@@ -208,93 +476,243 @@ def full_pipeline(
     dominant_color = color_hexes[0]
     print(f"[Pipeline] Используем один доминантный цвет для градиента: {dominant_color}", flush=True)
     
-    # Шаг 6: Canvas 1024x1280: фон + нижняя панель
+    # Шаг 6: Canvas 1024x1280: фон + нижняя панель, сразу RGBA для композиции
     print("[Pipeline] Шаг 6: Создание canvas с фоном и панелью...", flush=True)
-    color_panel = Image.new("RGB", (1024, 256), color_hexes[0])
-    bg_with_panel = Image.new("RGB", (1024, 1280))
-    bg_with_panel.paste(bg_image, (0, 0))
-    bg_with_panel.paste(color_panel, (0, 1024))
+    with _stage("canvas"):
+        canvas = np.empty((height, width, 4), dtype=np.uint8)
+        cv2.cvtColor(bg_image.array, cv2.COLOR_RGB2RGBA, dst=canvas[:width])
+        panel_color = np.array(ImageColor.getrgb(color_hexes[0]) + (255,), dtype=np.uint8)
+        canvas[width:].view(np.uint32)[:] = panel_color.view(np.uint32)
+        bg_with_panel = Frame(canvas, "RGBA")
     print(f"[Pipeline] Canvas создан: {bg_with_panel.size}", flush=True)
     
     # Шаг 7: Foreground (персонаж) кладём НА ФОН до градиента
     print("[Pipeline] Шаг 7: Композиция персонажа на фон...", flush=True)
     compose_start = time.time()
-    fg_rgba = foreground_rgba
-    if fg_rgba.size != (1024, 1024):
-        fg_rgba = fg_rgba.resize((1024, 1024), Image.Resampling.LANCZOS)
-    
-    alpha_a = alpha_mask
-    if alpha_a.shape[:2] != (1024, 1024):
-        # Конвертируем в PIL для resize
-        alpha_pil = Image.fromarray(alpha_a, mode="L")
-        alpha_pil = alpha_pil.resize((1024, 1024), Image.Resampling.BILINEAR)
-        alpha_a = np.array(alpha_pil)
-    
-    base_rgba = bg_with_panel.convert("RGBA")
-    base_rgba.paste(fg_rgba, (0, 0), Image.fromarray(alpha_a, mode="L"))  # персонаж уже подложен
+    with _stage("compose"):
+        fg_rgba = foreground_rgba
+        if fg_rgba.size != (width, width):
+            fg_rgba = fg_rgba.resize((width, width), Image.Resampling.LANCZOS)
+    
+        alpha_a = alpha_mask
+        if alpha_a.shape[:2] != (width, width):
+            # Конвертируем в PIL для resize
+            alpha_pil = Frame(alpha_a, "L").pil()
+            alpha_pil = alpha_pil.resize((width, width), Image.Resampling.BILINEAR)
+            alpha_a = np.asarray(alpha_pil)
+    
+        # Представление холста только для чтения: paste делает ровно одну копию
+        base_rgba = bg_with_panel.pil()
+        base_rgba.paste(fg_rgba, (0, 0), Frame(alpha_a, "L").pil())  # персонаж уже подложен
     print(f"[Pipeline] Персонаж наложен на фон за {time.time() - compose_start:.2f}с")
     
     # Шаг 8: Создание градиентов - используем только один цвет
     print("[Pipeline] Шаг 8: Создание градиентов...", flush=True)
     gradient_start = time.time()
-    # Градиент: весь 1024x1280 с одним цветом (без перехода)
-    full_gradient = create_gradient_background(
-        1024, 1280,
-        dominant_color, dominant_color,  # Одинаковый цвет везде!
-        direction="vertical",
-        interpolation="linear_rgb"
-    )
+    # Градиент: весь холст с одним цветом (без перехода)
+    with _stage("gradient"):
+        full_gradient = create_gradient_frame(
+            width, height,
+            dominant_color, dominant_color,  # Одинаковый цвет везде!
+            direction="vertical",
+            interpolation="linear_rgb",
+            mode="RGBA"  # сразу RGBA: альфа заменяется маской без putalpha
+        )
     print(f"[Pipeline] Градиент создан за {time.time() - gradient_start:.2f}с, размер: {full_gradient.size}")
     
     # Шаг 9: Расплывчатый градиент сверху на всё изображение
     print("[Pipeline] Шаг 9: Создание расплывчатой маски градиента...", flush=True)
     # маска: 0 = показываем базу (фон+персонаж), 255 = показываем градиент
-    mask = np.zeros((1280, 1024), dtype=np.uint8)
-    transition_start = 360  # Поднято выше (было 460)
-    transition_end = 960    # Расширена зона перехода (было 860)
-    
-    for y in range(1280):
-        if y < transition_start:
-            mask[y, :] = 0
-        elif y > transition_end:
-            mask[y, :] = 255
-        else:
-            t = (y - transition_start) / (transition_end - transition_start)
-            mask[y, :] = int(t * 255)
-    
-    # СИЛЬНО размягчаем именно маску для максимально плавной границы
-    from .masks import blur_mask
-    mask = blur_mask(mask, blur_size=300)  # Увеличено с 220 до 300 для более плавного перехода
-    gradient_mask = Image.fromarray(mask, "L")
-    print(f"[Pipeline] Расплывчатая маска создана: Y 0-{transition_start}=база, {transition_start}-{transition_end}=переход, {transition_end}-1280=градиент", flush=True)
+    with _stage("gradient_mask"):
+        # Маска не зависит от изображения и концепции - считается один раз на процесс
+        gradient_mask = _gradient_mask((width, height))
+    transition_start, transition_end = (_scale_px(y, scale) for y in GRADIENT_TRANSITION)
+    print(f"[Pipeline] Расплывчатая маска создана: Y 0-{transition_start}=база, {transition_start}-{transition_end}=переход, {transition_end}-{height}=градиент", flush=True)
     
     # Шаг 10: Наложение расплывчатого градиента (вуаль поверх базы)
     print("[Pipeline] Шаг 10: Наложение расплывчатого градиента...", flush=True)
     gradient_start = time.time()
     # слегка размываем сам градиент (не фон)
-    grad_rgba = full_gradient.convert("RGBA")
-    grad_array = np.array(grad_rgba)
-    grad_blurred = cv2.GaussianBlur(grad_array, (31, 31), 0)
-    grad_rgba = Image.fromarray(grad_blurred.astype(np.uint8), "RGBA")
-    
-    # вуаль поверх базы
-    grad_rgba.putalpha(gradient_mask)
-    result_with_gradient = Image.alpha_composite(base_rgba, grad_rgba).convert("RGB")
+    with _stage("gradient_overlay"):
+        grad_blur_size = _scale_kernel(31, scale)
+        grad_blurred = cv2.GaussianBlur(full_gradient.array, (grad_blur_size, grad_blur_size), 0)
+    
+        # вуаль поверх базы: альфа - маска перехода, PIL-представление без копии
+        grad_blurred[..., 3] = gradient_mask.array
+        grad_rgba = Frame(grad_blurred, "RGBA").pil()
+        result_with_gradient = Image.alpha_composite(base_rgba, grad_rgba).convert("RGB")
     print(f"[Pipeline] Расплывчатый градиент наложен за {time.time() - gradient_start:.2f}с")
     
     result = result_with_gradient
     
-    # Шаг 12: Resize до 512x640
-    print("[Pipeline] Шаг 12: Resize до 512x640...", flush=True)
+    # Шаг 11: Текстовые оверлеи - спрайты из кэша, одна вставка по маске на текст
+    if text is not None:
+        print("[Pipeline] Шаг 11: Текстовые оверлеи...", flush=True)
+        with _stage("text"):
+            result = _apply_text(result, text[0], text[1], scale)
+    
+    # Шаг 12: Resize до выходных размеров (по умолчанию 512x640) - пирамидой из одного рендера
+    size_names = ", ".join(f"{w}x{h}" for w, h in sizes)
+    print(f"[Pipeline] Шаг 12: Resize до {size_names}...", flush=True)
     resize_start = time.time()
-    result_resized = result.resize((512, 640), Image.Resampling.LANCZOS)
-    print(f"[Pipeline] Resize завершен за {time.time() - resize_start:.2f}с, размер: {result_resized.size}")
+    with _stage("resize_output"):
+        outputs = build_pyramid(result, sizes)
+    print(f"[Pipeline] Resize завершен за {time.time() - resize_start:.2f}с, размеры: {size_names}")
+    
+    return outputs
+
+
+def _apply_text(image: Image.Image, game_title: str, provider: str, scale: float = 1.0) -> Image.Image:
+    """Название игры (до 230px, переносится по словам) и провайдер (до 180px, opacity 0.7) поверх рендера."""
+    container_width = _scale_px(TEXT_MAX_WIDTH, scale)
+    center_x = image.width // 2
+    placements = []
+    
+    title_sprite = centered_multiline_text_sprite(
+        split_game_title(game_title), container_width,
+        font_size=_scale_px(230, scale), color="#FFFFFF", font_name=TEXT_FONT, opacity=1.0,
+        min_font_size=_scale_px(30, scale)
+    )
+    if title_sprite is not None:
+        placements.append((title_sprite, (center_x, _scale_px(TITLE_BOTTOM_Y, scale))))
+    
+    provider_sprite = centered_text_sprite(
+        provider, container_width,
+        font_size=_scale_px(180, scale), color="#FFFFFF", font_name=TEXT_FONT, opacity=0.7, auto_fit=True
+    )
+    if provider_sprite is not None:
+        placements.append((provider_sprite, (center_x, _scale_px(PROVIDER_Y, scale))))
+    
+    # Кадр создан этой концепцией - текст накладывается без копии
+    return apply_sprites(image, placements, in_place=True)
+
+
+def full_pipeline(
+    image_url: str,
+    game_title: str,
+    provider: str,
+    fal_api_key: str,
+    seed: int = 2069714305,
+    concept: str = "v1",  # Концепция обработки: "v1" (с блюром фона) или "v2" (без блюра фона)
+    text_overlay: Optional[bool] = None
+) -> Image.Image:
+    """
+    Полный пайплайн обработки изображения по ComfyUI workflow.
     
-    # Текст убран по запросу - возвращаем изображение без текста
-    result = result_resized
+    Args:
+        image_url: URL исходного изображения
+        game_title: Название игры (верхний текст)
+        provider: Провайдер (нижний текст)
+        fal_api_key: FAL API ключ для Seedream
+        seed: Фиксированный seed для Seedream
+        concept: Концепция обработки ("v1" = с блюром фона, "v2" = без блюра фона)
+        text_overlay: Наложить название игры и провайдера (None - по IMAGEFLOW_TEXT_OVERLAY)
+        
+    Returns:
+        Финальное обработанное изображение (PIL Image)
+    """
+    return render_variants(
+        image_url, game_title, provider, fal_api_key, seed, concepts=(concept,), text_overlay=text_overlay
+    )[concept][OUTPUT_SIZE]
+
+
+@profiler.profiled
+def render_variants(
+    image_url: str,
+    game_title: str,
+    provider: str,
+    fal_api_key: str,
+    seed: int = 2069714305,
+    concepts: Sequence[str] = ("v1",),
+    sizes: Sequence[Tuple[int, int]] = (OUTPUT_SIZE,),
+    render_at_target: Optional[bool] = None,
+    text_overlay: Optional[bool] = None,
+    image_data: Optional[bytes] = None
+) -> Renders:
+    """
+    Пайплайн для нескольких концепций и выходных размеров за один проход.
+    
+    Загрузка, Seedream, rmbg, маска и инпейнтинг выполняются один раз; на каждую
+    концепцию - только её фон (шаг 4.5), цвета, композиция и пирамида размеров.
+    
+    Args:
+        concepts: Концепции в порядке результата ("v1", "v2")
+        sizes: Выходные размеры (ширина, высота), не больше 1024x1280 (см. outputs.validate_sizes)
+        render_at_target: Рендерить сразу в наибольшем из sizes, а не в 1024x1280
+            (None - по IMAGEFLOW_RENDER_AT_TARGET)
+        text_overlay: Наложить название игры и провайдера (None - по IMAGEFLOW_TEXT_OVERLAY)
+        image_data: Байты исходника, загруженного в запрос: fallback декодирует их без скачивания,
+            image_url тогда - data URI или короткая ссылка для Seedream (см. uploads)
+        Остальные - как у full_pipeline
+    
+    Запросы дольше IMAGEFLOW_PROFILE_THRESHOLD сохраняют профиль (см. profiler).
+        
+    Returns:
+        {концепция: {(ширина, высота): финальное изображение}}
+    """
+    print("[Pipeline] Начало обработки...", flush=True)
+    print(f"[Pipeline] Концепции обработки: {', '.join(concepts)} (v1=с блюром фона, v2=без блюра фона)", flush=True)
+    start_time = time.time()
+    render_size = _render_size(sizes, render_at_target)
+    # Замеры стадий для адаптивного лимита сравниваются с запросами того же размера холста
+    scheduler.set_shape(render_size)
+    if text_overlay is None:
+        text_overlay = TEXT_OVERLAY
+    text = (game_title, provider) if text_overlay else None
+    
+    # Шаг 0: исходник не скачиваем заранее - Seedream получает URL и загружает его сам.
+    # Пиксели нужны только fallback, SourceImage загрузит их не более одного раза
+    # (загруженный в запрос исходник - декодирует из байт запроса). С дедупликацией
+    # исходник загружается сразу - для перцептивного хеша.
+    source = SourceImage(image_url, data=image_data)
+    transfers = start_transfer_log()
+    
+    # Шаг 0.5: повтор уже обработанного арта (другой URL, перекодирование) -
+    # готовые рендеры или результат Seedream по перцептивному хешу исходника
+    match = _dedup_lookup(source) if dedup.enabled() else None
+    if match is not None:
+        cached_renders = match.renders(concepts, sizes, render_size, text)
+        if cached_renders is not None:
+            print(f"[Pipeline] Рендеры взяты из дедупликации, пайплайн пропущен", flush=True)
+            STAGE_SECONDS.observe(time.time() - start_time, stage="total")
+            return cached_renders
+    cached_clean = match.seedream_image(seed) if match is not None else None
+    
+    # Шаг 1: Seedream очистка (с fallback на оригинальное изображение)
+    print("[Pipeline] Шаг 1: Seedream очистка...", flush=True)
+    if cached_clean is not None:
+        print(f"[Pipeline] Результат Seedream взят из дедупликации, Seedream пропущен", flush=True)
+        results = _render(cached_clean, concepts, sizes, render_size, text)
+        match.store_renders(results, render_size, text)
+    elif not deadline.can_wait(DEADLINE_RENDER_RESERVE + DEADLINE_MIN_SEEDREAM):
+        # До дедлайна мало времени - сразу дешёвый путь без Seedream
+        print(f"[Pipeline] До дедлайна {deadline.remaining():.1f}с, Seedream пропускаем: используем оригинальное изображение", flush=True)
+        FALLBACK_TOTAL.inc(reason="deadline")
+        results = _render(_load_fallback_image(source), concepts, sizes, render_size, text)
+    elif hedging.enabled():
+        results = _hedged_render(image_url, fal_api_key, seed, concepts, sizes, source, render_size, text, match)
+    else:
+        seedream_ok = False
+        try:
+            cleaned_image = _clean_with_seedream(image_url, fal_api_key, seed, match)
+            seedream_ok = True
+        except AdmissionRejected:
+            # Нет памяти даже на результат Seedream - fallback не поможет
+            raise
+        except Exception as e:
+            print(f"[Pipeline] ВНИМАНИЕ: Seedream не удался ({type(e).__name__}: {e}), используем оригинальное изображение", flush=True)
+            FALLBACK_TOTAL.inc(reason=_fallback_reason(e))
+            cleaned_image = _load_fallback_image(source)
+        
+        # Текст - опциональная стадия (text_overlay / IMAGEFLOW_TEXT_OVERLAY)
+        results = _render(cleaned_image, concepts, sizes, render_size, text)
+        if match is not None and seedream_ok:
+            match.store_renders(results, render_size, text)
     
     total_time = time.time() - start_time
+    STAGE_SECONDS.observe(total_time, stage="total")
     print(f"[Pipeline] Обработка завершена за {total_time:.2f}с", flush=True)
+    print(f"[Pipeline] Загружено за запрос: {transfers.total} байт ({transfers})", flush=True)
     
-    return result
+    return results
 
@@ -0,0 +1,337 @@
+"""Профили медленных запросов: что происходило внутри стадий.
+
+Тайминги стадий (span'ы, Server-Timing) показывают, какая стадия медленная,
+но не что внутри неё (KMeans, инпейнтинг, ожидание Seedream). Профайлер
+оборачивает render_variants (и через него full_pipeline) и сохраняет профиль
+с разбивкой по стадиям только для запросов дольше порога - в ограниченное
+кольцо файлов на диске. Список и загрузка - через /admin/profiles.
+
+Режимы:
+- sample (по умолчанию) - дешёвый, всегда включён: один общий поток раз в
+  интервал снимает стеки потоков активных запросов (sys._current_frames).
+  Потоки запроса регистрируются на границах стадий, поэтому ветки
+  хеджирования тоже попадают в профиль. Профиль - свёрнутые стеки
+  (формат flamegraph.pl / speedscope) с числом сэмплов, т.е. wall time.
+- cprofile - детерминированный cProfile потока запроса (дороже, для
+  расследований); сохраняется .prof для pstats/snakeviz и топ функций.
+- off - выключено.
+
+Переменные окружения:
+- IMAGEFLOW_PROFILE_MODE - sample, cprofile или off (по умолчанию sample)
+- IMAGEFLOW_PROFILE_THRESHOLD - порог длительности запроса, секунды (по умолчанию 20)
+- IMAGEFLOW_PROFILE_INTERVAL_MS - интервал сэмплирования, мс (по умолчанию 20)
+- IMAGEFLOW_PROFILE_DIR - каталог профилей (по умолчанию <tmp>/imageflow-profiles)
+- IMAGEFLOW_PROFILE_KEEP - сколько последних профилей хранить (по умолчанию 50)
+"""
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, TypeVar
+
+from .metrics import counter
+from .tracing import current_trace
+
+T = TypeVar("T")
+
+MODES = ("sample", "cprofile", "off")
+
+# Глубина стека в сэмпле и число функций в текстовом топе cProfile
+MAX_STACK_DEPTH = 128
+PSTATS_TOP = 60
+
+# Идентификатор профиля: <UTC время>-<trace_id>; только такие имена отдаются наружу
+_PROFILE_ID_RE = re.compile(r"^\d{8}T\d{6}-[0-9a-f]{8,32}$")
+
+PROFILES_SAVED_TOTAL = counter(
+    "imageflow_profiles_saved_total",
+    "Сохранённые профили медленных запросов",
+    ["mode"]
+)
+
+_current_session: ContextVar[Optional["Session"]] = ContextVar("imageflow_profile_session", default=None)
+
+
+def mode() -> str:
+    value = os.getenv("IMAGEFLOW_PROFILE_MODE", "sample").lower()
+    return value if value in MODES else "sample"
+
+
+def threshold() -> float:
+    return float(os.getenv("IMAGEFLOW_PROFILE_THRESHOLD", 20))
+
+
+def interval() -> float:
+    return max(1.0, float(os.getenv("IMAGEFLOW_PROFILE_INTERVAL_MS", 20))) / 1000.0
+
+
+def profile_dir() -> str:
+    return os.getenv("IMAGEFLOW_PROFILE_DIR") or os.path.join(tempfile.gettempdir(), "imageflow-profiles")
+
+
+def keep() -> int:
+    return max(1, int(os.getenv("IMAGEFLOW_PROFILE_KEEP", 50)))
+
+
+class Session:
+    """Профилирование одного запроса: потоки запроса и накопленные стеки."""
+
+    def __init__(self, mode: str):
+        self.mode = mode
+        self.started_at = time.time()
+        self.threads = {threading.get_ident()}
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.profile: Optional[cProfile.Profile] = None
+
+
+# ============================================================================
+# Сэмплер
+# ============================================================================
+
+class _Sampler:
+    """Один фоновый поток на процесс; спит, пока нет активных сессий."""
+
+    def __init__(self):
+        self._sessions: List[Session] = []
+        self._lock = threading.Lock()
+        self._active = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # Подписи функций по code object: строка собирается один раз
+        self._labels: Dict[object, str] = {}
+
+    def add(self, session: Session) -> None:
+        with self._lock:
+            self._sessions.append(session)
+            self._active.set()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="imageflow-profiler", daemon=True)
+                self._thread.start()
+
+    def remove(self, session: Session) -> None:
+        with self._lock:
+            if session in self._sessions:
+                self._sessions.remove(session)
+            if not self._sessions:
+                self._active.clear()
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            if len(self._labels) < 100_000:
+                self._labels[code] = label
+        return label
+
+    def _stack(self, frame) -> str:
+        labels = []
+        while frame is not None and len(labels) < MAX_STACK_DEPTH:
+            labels.append(self._label(frame.f_code))
+            frame = frame.f_back
+        return ";".join(reversed(labels))
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while True:
+            self._active.wait()
+            time.sleep(interval())
+            with self._lock:
+                sessions = list(self._sessions)
+            if not sessions:
+                continue
+            frames = sys._current_frames()
+            for session in sessions:
+                session.samples += 1
+                for ident in list(session.threads):
+                    frame = frames.get(ident)
+                    if frame is not None and ident != own:
+                        session.stacks[self._stack(frame)] += 1
+            del frames
+
+
+_sampler = _Sampler()
+
+
+def track_thread() -> None:
+    """
+    Отметить текущий поток как поток активного запроса.
+
+    Вызывается на границах стадий пайплайна: ветки хеджирования работают в
+    своих потоках с копией контекста запроса и так попадают в его профиль.
+    """
+    session = _current_session.get()
+    if session is not None and session.mode == "sample":
+        session.threads.add(threading.get_ident())
+
+
+# ============================================================================
+# Обёртка запроса
+# ============================================================================
+
+def profiled(func: Callable[..., T]) -> Callable[..., T]:
+    """Профилировать вызов func; профиль сохраняется, если вызов дольше порога."""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs) -> T:
+        current_mode = mode()
+        if current_mode == "off" or _current_session.get() is not None:
+            return func(*args, **kwargs)
+
+        session = Session(current_mode)
+        token = _current_session.set(session)
+        if current_mode == "cprofile":
+            try:
+                session.profile = cProfile.Profile()
+                session.profile.enable()
+            except ValueError as e:
+                # В потоке уже работает другой профайлер - остаёмся на сэмплировании
+                print(f"[Profiler] cProfile недоступен ({e}), используем sample", flush=True)
+                session.profile = None
+                session.mode = "sample"
+        if session.profile is None:
+            _sampler.add(session)
+        start = time.perf_counter()
+        error = None
+        try:
+            return func(*args, **kwargs)
+        except BaseException as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            if session.profile is not None:
+                session.profile.disable()
+            else:
+                _sampler.remove(session)
+            _current_session.reset(token)
+            if duration >= threshold():
+                _save(session, func.__name__, duration, error)
+
+    return wrapper
+
+
+def _stage_breakdown() -> List[Dict]:
+    """Стадии из трассы запроса: суммарная длительность и число вызовов."""
+    trace = current_trace()
+    if trace is None:
+        return []
+    totals: Dict[str, List[float]] = {}
+    for s in list(trace.spans):
+        entry = totals.setdefault(s.name, [0.0, 0])
+        entry[0] += s.duration_ms
+        entry[1] += 1
+    return [
+        {"stage": name, "ms": round(ms, 1), "count": count}
+        for name, (ms, count) in sorted(totals.items(), key=lambda item: -item[1][0])
+    ]
+
+
+def _save(session: Session, name: str, duration: float, error: Optional[str]) -> None:
+    """Записать профиль в кольцо; ошибки записи не влияют на запрос."""
+    trace = current_trace()
+    trace_id = trace.trace_id if trace is not None else os.urandom(8).hex()
+    profile_id = time.strftime("%Y%m%dT%H%M%S", time.gmtime(session.started_at)) + "-" + trace_id
+    record = {
+        "id": profile_id,
+        "trace_id": trace.trace_id if trace is not None else None,
+        "function": name,
+        "mode": session.mode,
+        "started_at": session.started_at,
+        "duration_s": round(duration, 3),
+        "threshold_s": threshold(),
+        "error": error,
+        "stages": _stage_breakdown(),
+    }
+    if session.profile is not None:
+        text = io.StringIO()
+        pstats.Stats(session.profile, stream=text).sort_stats("cumulative").print_stats(PSTATS_TOP)
+        record["pstats"] = text.getvalue()
+    else:
+        record["interval_ms"] = interval() * 1000
+        record["samples"] = session.samples
+        record["stacks"] = dict(session.stacks.most_common())
+
+    directory = profile_dir()
+    try:
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, profile_id + ".json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+        if session.profile is not None:
+            session.profile.dump_stats(os.path.join(directory, profile_id + ".prof"))
+        _trim(directory)
+    except OSError as e:
+        print(f"[Profiler] Ошибка записи профиля: {e}", flush=True)
+        return
+    PROFILES_SAVED_TOTAL.inc(mode=session.mode)
+    print(f"[Profiler] Запрос {duration:.1f}с дольше порога {threshold():.0f}с, профиль сохранён: {profile_id}", flush=True)
+
+
+def _trim(directory: str) -> None:
+    """Оставить только последние keep() профилей (имена упорядочены по времени)."""
+    ids = sorted(name[:-5] for name in os.listdir(directory) if name.endswith(".json"))
+    for profile_id in ids[:-keep()]:
+        for extension in (".json", ".prof"):
+            try:
+                os.remove(os.path.join(directory, profile_id + extension))
+            except FileNotFoundError:
+                pass
+
+
+# ============================================================================
+# Чтение для /admin/profiles
+# ============================================================================
+
+def list_profiles() -> List[Dict]:
+    """Сохранённые профили, новые первыми: id, длительность, режим, самая долгая стадия."""
+    directory = profile_dir()
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(directory), reverse=True):
+        if not name.endswith(".json") or not _PROFILE_ID_RE.match(name[:-5]):
+            continue
+        try:
+            with open(os.path.join(directory, name), encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            continue
+        profiles.append({
+            "id": record["id"],
+            "trace_id": record.get("trace_id"),
+            "mode": record.get("mode"),
+            "started_at": record.get("started_at"),
+            "duration_s": record.get("duration_s"),
+            "error": record.get("error"),
+            "slowest_stage": (record.get("stages") or [{}])[0].get("stage"),
+            "has_pstats": os.path.exists(os.path.join(directory, record["id"] + ".prof")),
+        })
+    return profiles
+
+
+def profile_path(profile_id: str, extension: str = ".json") -> Optional[str]:
+    """Путь к файлу профиля или None, если id некорректен или файла нет."""
+    if not _PROFILE_ID_RE.match(profile_id) or extension not in (".json", ".prof"):
+        return None
+    path = os.path.join(profile_dir(), profile_id + extension)
+    return path if os.path.isfile(path) else None
+
+
+def collapsed_stacks(profile_id: str) -> Optional[str]:
+    """Сэмплы профиля в свёрнутом формате "a;b;c N" (flamegraph.pl, speedscope)."""
+    path = profile_path(profile_id)
+    if path is None:
+        return None
+    with open(path, encoding="utf-8") as f:
+        record = json.load(f)
+    return "".join(f"{stack} {count}\n" for stack, count in record.get("stacks", {}).items())
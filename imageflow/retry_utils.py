@@ -1,8 +1,8 @@
 """Утилиты для повторных попыток и обработки ошибок."""
-import time
 import functools
 from typing import Callable, TypeVar, Any
 import requests
+from . import deadline, hedging
 
 T = TypeVar('T')
 
@@ -23,6 +23,9 @@ def retry_on_failure(
         backoff: Множитель для увеличения задержки
         exceptions: Кортеж исключений, при которых делать retry
         log_errors: Логировать ошибки
+        
+    Повтор не делается, если до дедлайна запроса не хватает времени на задержку.
+    В отменённой ветке хеджирования повторы и ожидание между ними прерываются HedgeCancelled.
     """
     def decorator(func: Callable[..., T]) -> Callable[..., T]:
         @functools.wraps(func)
@@ -31,14 +34,22 @@ def retry_on_failure(
             current_delay = delay
             
             for attempt in range(max_retries):
+                hedging.check_cancelled()
+                deadline.check(func.__name__)
                 try:
                     return func(*args, **kwargs)
+                except deadline.DeadlineExceeded:
+                    raise
                 except exceptions as e:
                     last_exception = e
+                    if attempt < max_retries - 1 and not deadline.can_wait(current_delay):
+                        if log_errors:
+                            print(f"[Retry] {type(e).__name__}: {e}; до дедлайна запроса не хватает времени на повтор", flush=True)
+                        break
                     if attempt < max_retries - 1:
                         if log_errors:
                             print(f"[Retry] Попытка {attempt + 1}/{max_retries} неудачна: {type(e).__name__}: {e}", flush=True)
-                        time.sleep(current_delay)
+                        hedging.sleep(current_delay)
                         current_delay *= backoff
                     else:
                         if log_errors:
@@ -59,11 +70,16 @@ def safe_request(
     """
     Безопасный HTTP запрос с retry логикой.
     
+    Таймаут каждой попытки не больше оставшегося до дедлайна запроса времени,
+    повторы прекращаются, если на задержку перед ними времени не хватает.
+    Отменённая ветка хеджирования не начинает новую попытку и не ждёт перед ней
+    (HedgeCancelled); уже отправленная попытка дожидается своего таймаута.
+    
     Args:
         method: HTTP метод (GET, POST, etc.)
         url: URL для запроса
         max_retries: Максимальное количество попыток
-        timeout: Таймаут запроса
+        timeout: Таймаут запроса (сжимается под дедлайн запроса)
         **kwargs: Дополнительные параметры для requests
         
     Returns:
@@ -71,20 +87,33 @@ def safe_request(
         
     Raises:
         requests.RequestException: При ошибках HTTP запросов
+        deadline.DeadlineExceeded: Если дедлайн запроса истёк до очередной попытки или
+            попытка упала по таймауту, сжатому под дедлайн
+        hedging.HedgeCancelled: Если ветка хеджирования отменена
     """
     last_exception = None
     delay = 1.0
     
     for attempt in range(max_retries):
+        hedging.check_cancelled()
+        attempt_timeout = deadline.timeout(timeout, stage="http")
         try:
-            response = requests.request(method, url, timeout=timeout, **kwargs)
+            response = requests.request(method, url, timeout=attempt_timeout, **kwargs)
             response.raise_for_status()
             return response
         except (requests.RequestException, requests.Timeout) as e:
+            if isinstance(e, requests.Timeout) and attempt_timeout < timeout:
+                # Таймаут был сжат дедлайном запроса: истёк дедлайн, а не время ответа
+                # сервиса - не сбой для circuit breaker
+                deadline.DEADLINE_EXCEEDED_TOTAL.inc(stage="http")
+                raise deadline.DeadlineExceeded("http") from e
             last_exception = e
+            if attempt < max_retries - 1 and not deadline.can_wait(delay):
+                print(f"[SafeRequest] {type(e).__name__}: {e}; до дедлайна запроса не хватает времени на повтор", flush=True)
+                break
             if attempt < max_retries - 1:
                 print(f"[SafeRequest] Попытка {attempt + 1}/{max_retries} неудачна: {type(e).__name__}: {e}", flush=True)
-                time.sleep(delay)
+                hedging.sleep(delay)
                 delay *= 2
             else:
                 print(f"[SafeRequest] Все {max_retries} попыток исчерпаны: {type(e).__name__}: {e}", flush=True)
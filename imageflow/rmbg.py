@@ -1,8 +1,33 @@
 """Удаление фона через rembg."""
 import io
+import threading
 import numpy as np
 from PIL import Image
 from rembg import remove
+from .metrics import record_cache
+from .thread_budget import ort_session_options
+
+# Сессии rembg (ONNX модели) по имени модели: загрузка u2net занимает секунды,
+# поэтому держим по одной сессии на процесс
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(model: str = "u2net"):
+    """Получить (и при первом обращении создать) сессию rembg для модели."""
+    session = _sessions.get(model)
+    record_cache("rembg_session", session is not None)
+    if session is not None:
+        return session
+    
+    from rembg import new_session
+    with _sessions_lock:
+        session = _sessions.get(model)
+        if session is None:
+            # Потоки ONNX Runtime - по общему бюджету потоков, а не по числу ядер
+            session = new_session(model, sess_opts=ort_session_options())
+            _sessions[model] = session
+    return session
 
 
 def remove_background(image: Image.Image, model: str = "u2net") -> tuple[Image.Image, np.ndarray]:
@@ -23,8 +48,7 @@ def remove_background(image: Image.Image, model: str = "u2net") -> tuple[Image.I
         image = image.convert("RGB")
     
     # Удаляем фон - rembg принимает PIL Image напрямую
-    from rembg import new_session
-    session = new_session(model)
+    session = get_session(model)
     foreground = remove(image, session=session)
     
     # Конвертируем в RGBA если нужно
@@ -32,7 +56,7 @@ def remove_background(image: Image.Image, model: str = "u2net") -> tuple[Image.I
         foreground = foreground.convert("RGBA")
     
     # Извлекаем альфа-канал как маску
-    mask = np.array(foreground.split()[3])  # Альфа канал
+    mask = np.asarray(foreground.getchannel("A"))  # Альфа канал (без разбиения на все каналы)
     
     return foreground, mask
 
@@ -50,6 +74,6 @@ def extract_alpha_mask(image: Image.Image) -> np.ndarray:
     if image.mode != "RGBA":
         raise ValueError("Image must have alpha channel (RGBA mode)")
     
-    alpha = np.array(image.split()[3])
+    alpha = np.asarray(image.getchannel("A"))
     return alpha
 
@@ -30,8 +30,9 @@ if __name__ == "__main__":
         reload=False,
         timeout_keep_alive=600,  # Увеличено время keep-alive (10 минут)
         timeout_graceful_shutdown=60,  # Время на graceful shutdown
-        limit_concurrency=10,  # Максимальное количество одновременных соединений
-        limit_max_requests=1000  # Максимальное количество запросов перед перезапуском
+        # Жёсткий предел соединений; нагрузкой управляет планировщик (imageflow/scheduler.py) с ответом 429
+        limit_concurrency=int(os.getenv("LIMIT_CONCURRENCY", 100)),  # Максимальное количество одновременных соединений
+        limit_max_requests=int(os.getenv("LIMIT_MAX_REQUESTS", 1000))  # Максимальное количество запросов перед перезапуском
     )
 
 
@@ -0,0 +1,487 @@
+"""Планировщик рендеров: классы приоритета, честная очередь клиентов, адаптивный лимит.
+
+Единственным ограничением нагрузки был limit_concurrency uvicorn: лишние
+соединения отклонялись без разбора, превью из редактора и массовое
+обновление каталога считались одинаково. Теперь перед пайплайном стоит
+планировщик:
+- классы приоритета (заголовок X-Priority): interactive > default > batch,
+  более высокий класс всегда обслуживается первым; заявку в очереди можно
+  повысить (promote) - так объединённый дубликат с более высоким классом
+  поднимает вычисляющий запрос (см. coalesce);
+- внутри класса - круговая очередь по клиентам (X-Client-Id или IP):
+  клиент с сотней запросов не задерживает клиента с одним;
+- лимит одновременных рендеров подбирается AIMD: сигнал - замедление
+  CPU-стадий запроса относительно их недавнего минимума (медиана по
+  стадиям, так что тяжёлый инпейнтинг одного изображения не выглядит как
+  перегрузка). Каждое выполнение стадии - отдельный замер (стадии концепций
+  и веток хеджирования не суммируются), минимум ведётся отдельно для
+  каждого размера холста рендера (render_at_target обрабатывает в разы
+  меньше пикселей). Ожидание Seedream и загрузки в сигнал не входят, поэтому
+  пока запросы в основном ждут сеть, лимит растёт и CPU остаётся занят;
+  при конкуренции за CPU стадии замедляются и лимит сокращается;
+- слот занят весь рендер, включая ожидание Seedream (до нескольких минут),
+  поэтому лимит рассчитан на ожидание сети, а не на число ядер: не меньше
+  IO_CONCURRENCY_FLOOR одновременных рендеров даже на 1-2 CPU, иначе
+  маленький контейнер обслуживал бы 1-2 запроса, а остальные получали 429;
+- перегрузка - ответ 429 с Retry-After по глубине очереди и среднему
+  времени занятия слота: при полной очереди класса, когда ожидаемое
+  ожидание вместе с рендером не укладывается в дедлайн запроса, и после
+  IMAGEFLOW_SCHEDULER_MAX_WAIT.
+
+Переменные окружения:
+- IMAGEFLOW_SCHEDULER - включить планировщик (по умолчанию включён, 0 - выключить)
+- IMAGEFLOW_SCHEDULER_INITIAL_LIMIT - начальный лимит (по умолчанию нижняя граница или число CPU, что больше;
+  CPU - по affinity и квоте cgroup, как у бюджета потоков)
+- IMAGEFLOW_SCHEDULER_MIN_LIMIT, IMAGEFLOW_SCHEDULER_MAX_LIMIT - границы лимита
+  (по умолчанию 10 и 4 x CPU, но не меньше 2 x нижняя граница)
+- IMAGEFLOW_SCHEDULER_TOLERANCE - допустимое замедление стадий до сокращения лимита (по умолчанию 1.5)
+- IMAGEFLOW_SCHEDULER_BACKOFF - множитель сокращения лимита (по умолчанию 0.9)
+- IMAGEFLOW_SCHEDULER_MAX_QUEUE - максимум ожидающих в каждом классе (по умолчанию 16)
+- IMAGEFLOW_SCHEDULER_MAX_WAIT - максимум ожидания в очереди, секунды (по умолчанию 60)
+"""
+import math
+import os
+import statistics
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Deque, Dict, Hashable, Iterator, List, Optional, Tuple
+
+from . import deadline
+from .metrics import counter, gauge, histogram
+from .thread_budget import available_cpus
+
+# Классы в порядке убывания приоритета
+PRIORITIES = ("interactive", "default", "batch")
+DEFAULT_PRIORITY = "default"
+
+PRIORITY_HEADER = "X-Priority"
+CLIENT_HEADER = "X-Client-Id"
+
+# Стадии, время которых - ожидание сети, а не CPU: в сигнал AIMD не входят
+EXTERNAL_STAGES = frozenset({"seedream", "fallback_load", "dedup_lookup"})
+
+# Стадии короче этого (по недавнему минимуму) слишком шумные для сигнала
+MIN_SIGNAL_STAGE_SECONDS = 0.005
+
+# Окно недавних длительностей стадии для её базового (минимального) значения
+BASELINE_WINDOW = 100
+
+# Сколько пар (стадия, размер холста) помнить: размеры render_at_target произвольны
+MAX_BASELINES = 512
+
+# Нижняя граница лимита по умолчанию: слоты большую часть рендера ждут Seedream, а не CPU
+IO_CONCURRENCY_FLOOR = 10
+
+# Начальная оценка времени занятия слота (для Retry-After, пока нет замеров)
+INITIAL_SERVICE_SECONDS = 30.0
+
+SCHEDULER_LIMIT = gauge(
+    "imageflow_scheduler_limit",
+    "Текущий адаптивный лимит одновременных рендеров"
+)
+SCHEDULER_IN_FLIGHT = gauge(
+    "imageflow_scheduler_in_flight",
+    "Рендеры, занимающие слот планировщика"
+)
+SCHEDULER_QUEUE_DEPTH = gauge(
+    "imageflow_scheduler_queue_depth",
+    "Запросы в очереди планировщика",
+    ["priority"]
+)
+SCHEDULER_TOTAL = counter(
+    "imageflow_scheduler_total",
+    "Решения планировщика",
+    ["priority", "result"]
+)
+SCHEDULER_WAIT_SECONDS = histogram(
+    "imageflow_scheduler_wait_seconds",
+    "Ожидание слота в очереди планировщика",
+    ["priority"]
+)
+
+
+class SchedulerRejected(Exception):
+    """Запрос не поставлен в работу: перегрузка (429 с оценкой Retry-After)."""
+
+    def __init__(self, message: str, retry_after: int, status_code: int = 429):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def enabled() -> bool:
+    return os.getenv("IMAGEFLOW_SCHEDULER", "1").lower() not in ("0", "false", "no", "off")
+
+
+def parse_priority(value: Optional[str]) -> str:
+    """
+    Класс приоритета из заголовка X-Priority.
+
+    Raises:
+        ValueError: Неизвестный класс
+    """
+    if not value:
+        return DEFAULT_PRIORITY
+    priority = value.strip().lower()
+    if priority not in PRIORITIES:
+        raise ValueError(f"{PRIORITY_HEADER} должен быть одним из {', '.join(PRIORITIES)}")
+    return priority
+
+
+class AIMDLimit:
+    """
+    Лимит одновременности: +1/лимит на каждый нормальный замер при полной
+    загрузке (около +1 за «поколение» запросов), x backoff при замедлении.
+    """
+
+    def __init__(self, initial: float, min_limit: int, max_limit: int, tolerance: float, backoff: float):
+        self.min_limit = min_limit
+        self.max_limit = max(min_limit, max_limit)
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self._limit = float(min(max(initial, min_limit), self.max_limit))
+
+    @property
+    def value(self) -> int:
+        return int(self._limit)
+
+    def update(self, slowdown: float, saturated: bool) -> int:
+        if slowdown > self.tolerance:
+            self._limit = max(float(self.min_limit), self._limit * self.backoff)
+        elif saturated:
+            self._limit = min(float(self.max_limit), self._limit + 1.0 / self._limit)
+        return self.value
+
+
+class Ticket:
+    """
+    Слот одного рендера: длительности CPU-стадий для сигнала AIMD.
+
+    stages - все замеры каждой стадии (по одному на выполнение: концепции и
+    ветки хеджирования дают отдельные замеры), shape - размер холста рендера.
+    """
+
+    def __init__(self, priority: str):
+        self.priority = priority
+        self.shape: Optional[Hashable] = None
+        self.stages: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.stages.setdefault(stage, []).append(seconds)
+
+
+class Claim:
+    """
+    Заявка запроса на слот: класс приоритета и клиент.
+
+    Класс можно повысить (promote), пока заявка не получила слот.
+    """
+
+    def __init__(self, priority: str = DEFAULT_PRIORITY, client: str = ""):
+        self.priority = priority
+        self.client = client
+        self._waiter: Optional["_Waiter"] = None
+
+
+class _Waiter:
+    __slots__ = ("priority", "client", "granted")
+
+    def __init__(self, priority: str, client: str):
+        self.priority = priority
+        self.client = client
+        self.granted = False
+
+
+class Scheduler:
+    """Слоты рендера с приоритетной очередью, круговой по клиентам внутри класса."""
+
+    def __init__(
+        self,
+        limit: AIMDLimit,
+        max_queue: int = 16,
+        max_wait: float = 60.0
+    ):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._in_flight = 0
+        self._queues: Dict[str, "OrderedDict[str, Deque[_Waiter]]"] = {p: OrderedDict() for p in PRIORITIES}
+        self._depth = {p: 0 for p in PRIORITIES}
+        self._baselines: "OrderedDict[Tuple[str, Optional[Hashable]], Deque[float]]" = OrderedDict()
+        self._service_seconds = INITIAL_SERVICE_SECONDS
+        self._limit_listeners: List[Callable[[int], None]] = []
+        self._cond = threading.Condition()
+        SCHEDULER_LIMIT.set(limit.value)
+        SCHEDULER_IN_FLIGHT.set(0)
+
+    @property
+    def in_flight(self) -> int:
+        with self._cond:
+            return self._in_flight
+
+    def add_limit_listener(self, listener: Callable[[int], None]) -> None:
+        """Вызывать listener(новый лимит) при каждом изменении лимита (вне блокировки планировщика)."""
+        with self._cond:
+            self._limit_listeners.append(listener)
+
+    def queue_depth(self, priority: Optional[str] = None) -> int:
+        with self._cond:
+            return self._depth[priority] if priority else sum(self._depth.values())
+
+    # ------------------------------------------------------------------
+    # Очередь
+    # ------------------------------------------------------------------
+
+    def _ahead(self, priority: str) -> int:
+        """Сколько ожидающих будет обслужено раньше нового запроса класса priority."""
+        return sum(self._depth[p] for p in PRIORITIES[:PRIORITIES.index(priority) + 1])
+
+    def _retry_after(self, ahead: int) -> int:
+        """Оценка времени до свободного слота: очередь впереди x среднее время слота / лимит."""
+        return max(1, math.ceil((ahead + 1) * self._service_seconds / max(1, self.limit.value)))
+
+    def _dispatch(self) -> None:
+        """Выдать свободные слоты: старший класс первым, внутри класса - по кругу клиентов."""
+        granted = False
+        while self._in_flight < self.limit.value:
+            priority = next((p for p in PRIORITIES if self._depth[p]), None)
+            if priority is None:
+                break
+            clients = self._queues[priority]
+            client, waiters = next(iter(clients.items()))
+            waiter = waiters.popleft()
+            if waiters:
+                clients.move_to_end(client)
+            else:
+                del clients[client]
+            self._depth[priority] -= 1
+            SCHEDULER_QUEUE_DEPTH.set(self._depth[priority], priority=priority)
+            waiter.granted = True
+            self._in_flight += 1
+            granted = True
+        if granted:
+            SCHEDULER_IN_FLIGHT.set(self._in_flight)
+            self._cond.notify_all()
+
+    def _remove(self, waiter: _Waiter) -> None:
+        clients = self._queues[waiter.priority]
+        waiters = clients.get(waiter.client)
+        if waiters is not None and waiter in waiters:
+            waiters.remove(waiter)
+            if not waiters:
+                del clients[waiter.client]
+            self._depth[waiter.priority] -= 1
+            SCHEDULER_QUEUE_DEPTH.set(self._depth[waiter.priority], priority=waiter.priority)
+
+    def promote(self, claim: Claim, priority: str) -> bool:
+        """
+        Повысить класс заявки до priority (понижение не делается).
+
+        Заявка в очереди переходит в конец очереди своего клиента в новом классе.
+
+        Returns:
+            True, если класс повышен
+        """
+        with self._cond:
+            if PRIORITIES.index(priority) >= PRIORITIES.index(claim.priority):
+                return False
+            print(f"[Scheduler] Класс заявки клиента {claim.client}: {claim.priority} -> {priority}", flush=True)
+            claim.priority = priority
+            waiter = claim._waiter
+            if waiter is not None and not waiter.granted:
+                self._remove(waiter)
+                waiter.priority = priority
+                self._enqueue(waiter)
+            return True
+
+    def _enqueue(self, waiter: _Waiter) -> None:
+        self._queues[waiter.priority].setdefault(waiter.client, deque()).append(waiter)
+        self._depth[waiter.priority] += 1
+        SCHEDULER_QUEUE_DEPTH.set(self._depth[waiter.priority], priority=waiter.priority)
+
+    def acquire(self, claim: Claim) -> Ticket:
+        """
+        Занять слот рендера, при необходимости дождавшись очереди.
+
+        Raises:
+            SchedulerRejected: 429 - очередь класса полна, ожидание дольше дедлайна или MAX_WAIT
+            DeadlineExceeded: Дедлайн запроса истёк в очереди
+        """
+        wait_start = time.monotonic()
+        left = deadline.remaining()
+        with self._cond:
+            priority, client = claim.priority, claim.client
+            if self._in_flight < self.limit.value and not self._ahead(priority):
+                self._in_flight += 1
+                SCHEDULER_IN_FLIGHT.set(self._in_flight)
+                SCHEDULER_TOTAL.inc(priority=priority, result="admitted")
+                return Ticket(priority)
+
+            ahead = self._ahead(priority)
+            retry_after = self._retry_after(ahead)
+            if self._depth[priority] >= self.max_queue:
+                SCHEDULER_TOTAL.inc(priority=priority, result="rejected_queue_full")
+                raise SchedulerRejected(
+                    f"Очередь {priority} заполнена ({self._depth[priority]}), слотов {self._in_flight}/{self.limit.value}",
+                    retry_after=retry_after
+                )
+            if left is not None and retry_after + self._service_seconds > left:
+                # Ожидание слота и сам рендер не уложатся в дедлайн - не держим соединение зря
+                SCHEDULER_TOTAL.inc(priority=priority, result="rejected_deadline")
+                deadline.record_shortfall()
+                raise SchedulerRejected(
+                    f"Ожидаемое ожидание в очереди ~{retry_after}с больше оставшегося времени запроса {left:.0f}с",
+                    retry_after=retry_after
+                )
+
+            waiter = _Waiter(priority, client)
+            self._enqueue(waiter)
+            claim._waiter = waiter
+            print(f"[Scheduler] В очереди {priority} (клиент {client}): впереди {ahead}, "
+                  f"слотов {self._in_flight}/{self.limit.value}", flush=True)
+
+            max_wait = self.max_wait if left is None else min(self.max_wait, left)
+            wait_until = wait_start + max_wait
+            try:
+                while not waiter.granted:
+                    remaining = wait_until - time.monotonic()
+                    if remaining <= 0:
+                        self._remove(waiter)
+                        if left is not None and max_wait >= left:
+                            deadline.check("scheduler_queue")
+                        SCHEDULER_TOTAL.inc(priority=waiter.priority, result="rejected_timeout")
+                        raise SchedulerRejected(
+                            f"Слот не освободился за {max_wait:.0f}с",
+                            retry_after=self._retry_after(self._ahead(waiter.priority))
+                        )
+                    self._cond.wait(remaining)
+            finally:
+                claim._waiter = None
+            # Класс мог быть повышен, пока заявка ждала
+            priority = waiter.priority
+
+        SCHEDULER_TOTAL.inc(priority=priority, result="queued")
+        SCHEDULER_WAIT_SECONDS.observe(time.monotonic() - wait_start, priority=priority)
+        return Ticket(priority)
+
+    def release(self, ticket: Ticket, held_seconds: float) -> None:
+        """Освободить слот; замер стадий и время слота обновляют лимит и оценку Retry-After."""
+        changed = None
+        with self._cond:
+            saturated = self._in_flight >= self.limit.value or any(self._depth.values())
+            self._in_flight -= 1
+            self._service_seconds += 0.2 * (held_seconds - self._service_seconds)
+            slowdown = self._slowdown(ticket)
+            if slowdown is not None:
+                before = self.limit.value
+                after = self.limit.update(slowdown, saturated)
+                if after != before:
+                    print(f"[Scheduler] Лимит {before} -> {after} (замедление стадий x{slowdown:.2f})", flush=True)
+                    changed = after
+                SCHEDULER_LIMIT.set(after)
+            SCHEDULER_IN_FLIGHT.set(self._in_flight)
+            self._dispatch()
+            listeners = list(self._limit_listeners)
+        if changed is not None:
+            for listener in listeners:
+                listener(changed)
+
+    def _slowdown(self, ticket: Ticket) -> Optional[float]:
+        """Медиана по замерам CPU-стадий: длительность / недавний минимум этой стадии на том же холсте."""
+        with ticket._lock:
+            stages = {stage: list(samples) for stage, samples in ticket.stages.items()}
+        ratios: List[float] = []
+        for stage, samples in stages.items():
+            if stage in EXTERNAL_STAGES:
+                continue
+            key = (stage, ticket.shape)
+            history = self._baselines.get(key)
+            if history is None:
+                history = self._baselines[key] = deque(maxlen=BASELINE_WINDOW)
+                if len(self._baselines) > MAX_BASELINES:
+                    self._baselines.popitem(last=False)
+            else:
+                self._baselines.move_to_end(key)
+            baseline = min(history) if history else None
+            history.extend(samples)
+            if baseline is not None and baseline >= MIN_SIGNAL_STAGE_SECONDS:
+                ratios.extend(seconds / baseline for seconds in samples)
+        return statistics.median(ratios) if ratios else None
+
+    @contextmanager
+    def slot(self, claim: Claim) -> Iterator[Ticket]:
+        ticket = self.acquire(claim)
+        token = _current_ticket.set(ticket)
+        start = time.monotonic()
+        try:
+            yield ticket
+        finally:
+            _current_ticket.reset(token)
+            self.release(ticket, time.monotonic() - start)
+
+
+_scheduler: Optional[Scheduler] = None
+_scheduler_lock = threading.Lock()
+_current_ticket: ContextVar[Optional[Ticket]] = ContextVar("imageflow_scheduler_ticket", default=None)
+
+
+def get_scheduler() -> Scheduler:
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                cpus = available_cpus()
+                min_limit = max(1, int(os.getenv("IMAGEFLOW_SCHEDULER_MIN_LIMIT", IO_CONCURRENCY_FLOOR)))
+                _scheduler = Scheduler(
+                    AIMDLimit(
+                        initial=float(os.getenv("IMAGEFLOW_SCHEDULER_INITIAL_LIMIT", max(min_limit, cpus))),
+                        min_limit=min_limit,
+                        max_limit=int(os.getenv("IMAGEFLOW_SCHEDULER_MAX_LIMIT", max(4 * cpus, 2 * min_limit))),
+                        tolerance=float(os.getenv("IMAGEFLOW_SCHEDULER_TOLERANCE", 1.5)),
+                        backoff=float(os.getenv("IMAGEFLOW_SCHEDULER_BACKOFF", 0.9))
+                    ),
+                    max_queue=int(os.getenv("IMAGEFLOW_SCHEDULER_MAX_QUEUE", 16)),
+                    max_wait=float(os.getenv("IMAGEFLOW_SCHEDULER_MAX_WAIT", 60))
+                )
+    return _scheduler
+
+
+def thread_capacity() -> int:
+    """Потоков на рендеры: слоты по максимальному лимиту плюс полные очереди всех классов."""
+    scheduler = get_scheduler()
+    return scheduler.limit.max_limit + len(PRIORITIES) * scheduler.max_queue
+
+
+@contextmanager
+def slot(claim: Claim) -> Iterator[Optional[Ticket]]:
+    """Слот рендера на время блока (планировщик выключен - без ограничений)."""
+    if not enabled():
+        yield None
+        return
+    with get_scheduler().slot(claim) as ticket:
+        yield ticket
+
+
+def promote(claim: Claim, priority: str) -> None:
+    """Повысить класс заявки (планировщик выключен - ничего не делает)."""
+    if enabled():
+        get_scheduler().promote(claim, priority)
+
+
+def set_shape(shape: Hashable) -> None:
+    """Размер холста рендера текущего запроса: минимумы стадий ведутся отдельно для каждого размера."""
+    ticket = _current_ticket.get()
+    if ticket is not None:
+        ticket.shape = shape
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    """Учесть длительность стадии пайплайна в слоте текущего запроса (вне слота - ничего)."""
+    ticket = _current_ticket.get()
+    if ticket is not None:
+        ticket.observe(stage, seconds)
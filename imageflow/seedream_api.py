@@ -1,20 +1,27 @@
 """Интеграция с Seedream (Fal AI) API для очистки изображений."""
+import os
 import time
 import requests
 from PIL import Image
-from typing import Optional
+from typing import Dict, Optional, Tuple, Union
 from .utils import fetch_image
 from .retry_utils import safe_request
+from .metrics import SEEDREAM_QUEUE_SECONDS, SEEDREAM_RUN_SECONDS
+from .tracing import span
+from . import hedging
+from . import deadline
+from .circuit_breaker import SEEDREAM_BREAKER
 
 
 def run_seedream(
     image_url: str,
     prompt: str,
     api_key: str,
-    size: str = "square_hd",
+    size: Union[str, Dict[str, int]] = "square_hd",
     seed: int = 2069714305,
     timeout: int = 300,
-    max_retries: int = 2
+    max_retries: int = 2,
+    result_size: Optional[Tuple[int, int]] = None
 ) -> Image.Image:
     """
     Вызвать Seedream API для очистки изображения.
@@ -23,10 +30,12 @@ def run_seedream(
         image_url: URL исходного изображения
         prompt: Промпт для очистки
         api_key: FAL API ключ
-        size: Размер выходного изображения (square_hd = 2048x2048)
+        size: Размер выходного изображения: пресет (square_hd = 2048x2048) или
+            {"width": ..., "height": ...} - сразу рабочий размер, без лишней передачи и уменьшения
         seed: Фиксированный seed для детерминизма
-        timeout: Таймаут в секундах
+        timeout: Таймаут в секундах (не дольше оставшегося до дедлайна запроса)
         max_retries: Максимальное количество попыток при ошибках
+        result_size: Рабочий размер результата - большой результат уменьшается при декодировании
         
     Returns:
         PIL Image очищенного изображения
@@ -35,7 +44,9 @@ def run_seedream(
         RuntimeError: Если задача завершилась с ошибкой
         requests.RequestException: При ошибках HTTP запросов
     """
-    endpoint = "https://queue.fal.run/fal-ai/bytedance/seedream/v4/edit"
+    # FAL_QUEUE_URL позволяет направить запросы в локальный fake fal (нагрузочные тесты)
+    queue_url = os.getenv("FAL_QUEUE_URL", "https://queue.fal.run").rstrip("/")
+    endpoint = f"{queue_url}/fal-ai/bytedance/seedream/v4/edit"
     headers = {
         "Authorization": f"Key {api_key}",
         "Content-Type": "application/json"
@@ -53,7 +64,9 @@ def run_seedream(
     for attempt in range(max_retries):
         try:
             print(f"[Seedream] Отправка запроса для очистки изображения (попытка {attempt + 1}/{max_retries})...", flush=True)
-            response = safe_request("POST", endpoint, json=payload, headers=headers, max_retries=2, timeout=60)
+            # Breaker: при недоступности fal сразу CircuitOpenError -> fallback, без ретраев
+            with span("seedream_submit", attempt=attempt + 1), SEEDREAM_BREAKER.call():
+                response = safe_request("POST", endpoint, json=payload, headers=headers, max_retries=2, timeout=60)
             
             result = response.json()
             status_url = result.get("status_url")
@@ -65,25 +78,30 @@ def run_seedream(
             
         except (requests.RequestException, requests.Timeout) as e:
             last_exception = e
-            if attempt < max_retries - 1:
+            if attempt < max_retries - 1 and deadline.can_wait(2):
                 print(f"[Seedream] Ошибка при создании задачи, повтор через 2 секунды...", flush=True)
-                time.sleep(2)
+                hedging.sleep(2)
             else:
-                raise RuntimeError(f"Не удалось создать задачу Seedream после {max_retries} попыток: {e}") from e
+                raise RuntimeError(f"Не удалось создать задачу Seedream после {attempt + 1} попыток: {e}") from e
     
     # Опрос статуса с retry для запросов статуса
     start_time = time.time()
+    timeout = deadline.timeout(timeout, stage="seedream")
+    running_since = None  # Момент выхода задачи из очереди fal (для метрик)
     poll_count = 0
     consecutive_errors = 0
     max_consecutive_errors = 5
     
     while True:
+        hedging.check_cancelled()
         if time.time() - start_time > timeout:
-            raise RuntimeError(f"Seedream timeout после {timeout} секунд")
+            deadline.check("seedream")
+            raise RuntimeError(f"Seedream timeout после {timeout:.0f} секунд")
         
         try:
             poll_count += 1
-            status_response = safe_request("GET", status_url, headers=headers, max_retries=2, timeout=30)
+            with span("seedream_poll", poll=poll_count), SEEDREAM_BREAKER.call():
+                status_response = safe_request("GET", status_url, headers=headers, max_retries=2, timeout=30)
             status_data = status_response.json()
             consecutive_errors = 0  # Сбрасываем счетчик ошибок при успехе
             
@@ -93,21 +111,32 @@ def run_seedream(
                 raise RuntimeError(f"Слишком много ошибок подряд при опросе статуса Seedream: {e}") from e
             
             print(f"[Seedream] Ошибка при опросе статуса ({consecutive_errors}/{max_consecutive_errors}), повтор через 3 секунды...", flush=True)
-            time.sleep(3)
+            hedging.sleep(3)
             continue
         
         status = status_data.get("status")
         
+        if status == "IN_PROGRESS" and running_since is None:
+            running_since = time.time()
+            SEEDREAM_QUEUE_SECONDS.observe(running_since - start_time)
+        
         if status == "COMPLETED":
             print(f"[Seedream] Задача завершена за {poll_count} опросов")
+            completed_at = time.time()
+            if running_since is None:
+                # Задача прошла очередь и выполнилась между двумя опросами
+                running_since = completed_at
+                SEEDREAM_QUEUE_SECONDS.observe(running_since - start_time)
+            SEEDREAM_RUN_SECONDS.observe(completed_at - running_since)
             response_url = status_data.get("response_url")
             if not response_url:
                 raise RuntimeError("Seedream не вернул response_url")
             
             # Получаем результат с retry
             try:
-                result_response = safe_request("GET", response_url, headers=headers, max_retries=3, timeout=60)
-                result_data = result_response.json()
+                with span("seedream_result"), SEEDREAM_BREAKER.call():
+                    result_response = safe_request("GET", response_url, headers=headers, max_retries=3, timeout=60)
+                    result_data = result_response.json()
             except requests.exceptions.HTTPError as e:
                 # Проверяем статус ошибки
                 if e.response.status_code == 422:
@@ -129,7 +158,8 @@ def run_seedream(
                 raise RuntimeError("Seedream не вернул URL изображения")
             
             print(f"[Seedream] Скачивание результата...")
-            return fetch_image(image_url_result)
+            with span("seedream_result_download"):
+                return fetch_image(image_url_result, source="seedream_result", target_size=result_size)
         
         elif status == "FAILED":
             error_msg = status_data.get("error", "Unknown error")
@@ -137,6 +167,7 @@ def run_seedream(
         
         elif status in ("IN_QUEUE", "IN_PROGRESS"):
             print(f"[Seedream] Статус: {status}, опрос #{poll_count}...")
-            time.sleep(3)
+            # При хеджировании ожидание прерывается, если выбран fallback
+            hedging.sleep(3)
         else:
             raise RuntimeError(f"Неизвестный статус Seedream: {status}")
@@ -0,0 +1,110 @@
+"""Исходное изображение запроса и учёт переданных байт.
+
+SourceImage скачивает исходник не более одного раза и только когда стадии
+действительно нужны пиксели (Seedream получает URL и сам его скачивает);
+загруженный в запрос исходник (uploads) декодируется из байт без скачивания.
+TransferLog собирает байты, загруженные за запрос, по источникам - для
+итогового лога пайплайна (метрика imageflow_bytes_in_total пишется в fetch_image).
+"""
+import threading
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+
+from PIL import Image
+
+
+class TransferLog:
+    """Байты, загруженные в рамках одного запроса, по источникам."""
+
+    def __init__(self):
+        self._bytes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def add(self, source: str, nbytes: int) -> None:
+        with self._lock:
+            self._bytes[source] = self._bytes.get(source, 0) + nbytes
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._bytes)
+
+    @property
+    def total(self) -> int:
+        with self._lock:
+            return sum(self._bytes.values())
+
+    def __str__(self) -> str:
+        parts = [f"{source}={nbytes}" for source, nbytes in self.snapshot().items()]
+        return ", ".join(parts) if parts else "нет загрузок"
+
+
+_transfer_log: ContextVar[Optional[TransferLog]] = ContextVar("imageflow_transfer_log", default=None)
+
+
+def start_transfer_log() -> TransferLog:
+    """Начать учёт загрузок для текущего контекста (запроса)."""
+    log = TransferLog()
+    _transfer_log.set(log)
+    return log
+
+
+def record_transfer(source: str, nbytes: int) -> None:
+    """Учесть загруженные байты в логе текущего запроса (если он начат)."""
+    log = _transfer_log.get()
+    if log is not None:
+        log.add(source, nbytes)
+
+
+class SourceImage:
+    """
+    Исходное изображение запроса с ленивой однократной загрузкой.
+
+    Args:
+        url: URL исходного изображения
+        data: Байты исходника, загруженного в запрос: пиксели декодируются из них, без скачивания
+    """
+
+    def __init__(self, url: str, data: Optional[bytes] = None):
+        self.url = url
+        self.data = data
+        self._image: Optional[Image.Image] = None
+        self._target_size: Optional[Tuple[int, int]] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._image is not None
+
+    def image(self, target_size: Optional[Tuple[int, int]] = None) -> Image.Image:
+        """
+        Получить пиксели исходника (RGB), скачав его при первом обращении.
+
+        Args:
+            target_size: Рабочий размер для уменьшения при декодировании (см. utils.decode_image).
+                Повторное обращение с тем же или меньшим target_size использует уже загруженное
+                изображение.
+        """
+        from .utils import decode_image, fetch_image
+
+        with self._lock:
+            if self._image is not None and self._covers(target_size):
+                print(f"[Source] Исходник уже загружен ({self._image.size}), повторная загрузка не нужна", flush=True)
+                return self._image
+
+            if self.data is not None:
+                image = decode_image(self.data, target_size)
+            else:
+                image = fetch_image(self.url, source="source", target_size=target_size)
+            if image.mode != "RGB":
+                image = image.convert("RGB")
+            self._image = image
+            self._target_size = target_size
+            return image
+
+    def _covers(self, target_size: Optional[Tuple[int, int]]) -> bool:
+        """Подходит ли уже загруженное изображение для запрошенного target_size."""
+        if self._target_size is None:
+            return True
+        if target_size is None:
+            return False
+        return target_size[0] <= self._target_size[0] and target_size[1] <= self._target_size[1]
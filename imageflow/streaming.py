@@ -0,0 +1,205 @@
+"""Потоковая загрузка изображений: декодирование параллельно с передачей.
+
+Тело ответа читается фоновым потоком в StreamBuffer, а Pillow читает из
+буфера как из обычного файла, блокируясь, пока нужные байты не пришли.
+Так Image.open разбирает заголовок по первым килобайтам (размеры доступны
+до загрузки остального тела), а декодер JPEG/PNG работает, пока идёт
+передача. Для последовательно читаемых форматов уже прочитанный декодером
+префикс сжатых данных освобождается, поэтому сжатая и декодированная копии
+не лежат в памяти целиком одновременно.
+"""
+import contextvars
+import io
+import os
+import threading
+import time
+from typing import Optional
+
+import requests
+
+from . import deadline, hedging
+
+MB = 1024 * 1024
+
+# Максимальный размер тела ответа (сжатого изображения)
+MAX_DOWNLOAD_BYTES = int(float(os.getenv("IMAGEFLOW_MAX_DOWNLOAD_MB", 50)) * MB)
+
+CHUNK_SIZE = 64 * 1024
+
+# Сколько уже прочитанных байт держать для коротких seek назад (маркеры JPEG, чанки PNG)
+_TRIM_KEEP = 256 * 1024
+
+# Content-Type, которые принимаем помимо image/*: многие CDN/хранилища отдают картинки так
+_GENERIC_CONTENT_TYPES = ("", "application/octet-stream", "binary/octet-stream")
+
+# Форматы, которые Pillow декодирует строго последовательно (безопасно освобождать префикс)
+SEQUENTIAL_FORMATS = ("JPEG", "PNG")
+
+
+class StreamBuffer(io.RawIOBase):
+    """
+    Файлоподобный буфер, который наполняется из другого потока.
+
+    read() и seek() вперёд блокируются до поступления нужных данных или конца
+    потока. Ошибка производителя (сеть, превышение лимита) пробрасывается
+    читателю.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._buf = bytearray()
+        self._base = 0  # абсолютное смещение первого байта в _buf
+        self._pos = 0
+        self._eof = False
+        self._error: Optional[BaseException] = None
+        self._cancelled = False
+        self._trim = False
+        self._cond = threading.Condition()
+        self.received = 0
+
+    # --- производитель ---
+
+    def feed(self, chunk: bytes) -> bool:
+        """Добавить данные. Возвращает False, если читатель отменил загрузку."""
+        with self._cond:
+            if self._cancelled:
+                return False
+            self._buf.extend(chunk)
+            self.received += len(chunk)
+            self._cond.notify_all()
+            return True
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        with self._cond:
+            self._eof = True
+            self._error = error
+            self._cond.notify_all()
+
+    # --- читатель ---
+
+    def cancel(self) -> None:
+        """Прекратить загрузку (производитель остановится на следующем чанке)."""
+        with self._cond:
+            self._cancelled = True
+            self._cond.notify_all()
+
+    def release_consumed(self) -> None:
+        """Разрешить освобождать уже прочитанный префикс (только для последовательного чтения)."""
+        with self._cond:
+            self._trim = True
+
+    def _wait_until(self, end: Optional[int]) -> None:
+        while not self._eof and (end is None or self._base + len(self._buf) < end):
+            self._cond.wait()
+        if self._error is not None:
+            raise self._error
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        with self._cond:
+            if whence == io.SEEK_SET:
+                target = offset
+            elif whence == io.SEEK_CUR:
+                target = self._pos + offset
+            else:
+                self._wait_until(None)
+                target = self._base + len(self._buf) + offset
+            if target < self._base:
+                raise io.UnsupportedOperation(
+                    f"seek на {target}: данные до {self._base} уже освобождены"
+                )
+            self._pos = target
+            return target
+
+    def read(self, size: int = -1) -> bytes:
+        with self._cond:
+            if size is None or size < 0:
+                self._wait_until(None)
+            else:
+                self._wait_until(self._pos + size)
+            available_end = self._base + len(self._buf)
+            end = available_end if size is None or size < 0 else min(self._pos + size, available_end)
+            start = self._pos - self._base
+            data = bytes(self._buf[start:max(start, end - self._base)])
+            self._pos = max(self._pos, end)
+
+            if self._trim:
+                drop = self._pos - self._base - _TRIM_KEEP
+                if drop >= _TRIM_KEEP:
+                    del self._buf[:drop]
+                    self._base += drop
+            return data
+
+    def readinto(self, b) -> int:
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+
+def check_image_response(response: requests.Response, max_bytes: Optional[int] = None) -> None:
+    """
+    Проверить заголовки ответа до чтения тела.
+
+    Raises:
+        ValueError: Content-Type не изображение или Content-Length больше лимита
+    """
+    max_bytes = MAX_DOWNLOAD_BYTES if max_bytes is None else max_bytes
+    content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+    if not content_type.startswith("image/") and content_type not in _GENERIC_CONTENT_TYPES:
+        raise ValueError(f"URL вернул не изображение (Content-Type: {content_type})")
+
+    content_length = response.headers.get("Content-Length")
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+        raise ValueError(
+            f"Изображение слишком большое: {int(content_length) // MB} МБ (лимит {max_bytes // MB} МБ)"
+        )
+
+
+def start_streaming(response: requests.Response, max_bytes: Optional[int] = None) -> tuple:
+    """
+    Запустить фоновое чтение тела ответа в StreamBuffer.
+
+    Передача прерывается DeadlineExceeded, если дедлайн запроса (взятый из
+    контекста вызывающего потока) истекает до конца тела, и HedgeCancelled,
+    если отменена ветка хеджирования вызывающего потока.
+
+    Returns:
+        (StreamBuffer, поток-производитель)
+    """
+    max_bytes = MAX_DOWNLOAD_BYTES if max_bytes is None else max_bytes
+    deadline_at = deadline.current()
+    stream = StreamBuffer()
+
+    def pump():
+        error = None
+        try:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                hedging.check_cancelled()
+                if deadline_at is not None and time.monotonic() > deadline_at:
+                    deadline.DEADLINE_EXCEEDED_TOTAL.inc(stage="download")
+                    deadline.record_shortfall()
+                    error = deadline.DeadlineExceeded("download")
+                    break
+                if stream.received + len(chunk) > max_bytes:
+                    error = ValueError(f"Изображение больше лимита {max_bytes // MB} МБ, загрузка прервана")
+                    break
+                if not stream.feed(chunk):
+                    break
+        except (requests.RequestException, OSError, hedging.HedgeCancelled) as e:
+            error = e
+        finally:
+            stream.finish(error)
+
+    # Копия контекста: отметка влияния дедлайна (deadline.record_shortfall) доходит до запроса,
+    # флаг отмены ветки хеджирования виден производителю
+    thread = threading.Thread(target=contextvars.copy_context().run, args=(pump,), name="imageflow-download", daemon=True)
+    thread.start()
+    return stream, thread
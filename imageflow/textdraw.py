@@ -1,20 +1,142 @@
-"""Добавление текстовых оверлеев."""
+"""Добавление текстовых оверлеев.
+
+Шрифты и метрики кэшируются на процесс:
+- путь к шрифту ищется один раз на имя файла;
+- загруженные шрифты - LRU по (путь, размер): бинарный поиск размера и
+  повторные оверлеи не перечитывают TrueType-файл;
+- ширины слов (advance) - на каждый загруженный шрифт, поэтому разбиение
+  на строки линейно по числу слов, а не измеряет каждый растущий префикс;
+- результат подбора размера (find_fit_font_size) - LRU по тексту, ширине и
+  шрифту: названия игр и провайдеров повторяются от запроса к запросу.
+
+Текст рисуется в слой размером с его bbox (TextOverlay), и композитится
+только эта область кадра: без копии всего кадра в RGBA, полноразмерного
+прозрачного слоя и обратной конвертации в RGB. Несколько оверлеев
+накладываются за один проход apply_text_overlays.
+
+Готовый текст - TextSprite: альфа-маска и цвет со смещением относительно
+точки привязки. Спрайты названий и провайдеров кэшируются (LRU по
+суммарному размеру масок) по тексту, шрифту, размеру, цвету и ширине
+контейнера, так что повторный оверлей - одна вставка цвета по маске.
+
+Переменные окружения:
+- IMAGEFLOW_FONT_CACHE_SIZE - шрифтов (путь, размер) в LRU-кэше (по умолчанию 64)
+- IMAGEFLOW_FIT_CACHE_SIZE - результатов подбора размера шрифта в LRU-кэше (по умолчанию 1024)
+- IMAGEFLOW_TEXT_SPRITE_CACHE_MB - бюджет кэша текстовых спрайтов, МБ (по умолчанию 64)
+"""
 import os
+import threading
+from collections import OrderedDict
 from PIL import Image, ImageDraw, ImageFont
-from typing import Optional, Tuple, List
+from typing import Callable, Dict, Hashable, Optional, Tuple, List
 
+from .metrics import record_cache
 
-def find_font(font_name: str, fallback_size: int = 100) -> ImageFont.FreeTypeFont:
+FONT_CACHE_SIZE = int(os.getenv("IMAGEFLOW_FONT_CACHE_SIZE", 64))
+FIT_CACHE_SIZE = int(os.getenv("IMAGEFLOW_FIT_CACHE_SIZE", 1024))
+TEXT_SPRITE_CACHE_BYTES = int(float(os.getenv("IMAGEFLOW_TEXT_SPRITE_CACHE_MB", 64)) * 1024 * 1024)
+
+# Ширин слов на один шрифт: при переполнении словарь сбрасывается
+MAX_CACHED_WIDTHS = 4096
+
+
+class _LRUCache:
     """
-    Найти шрифт или использовать fallback.
+    Потокобезопасный LRU-кэш; попадания и промахи идут в imageflow_cache_requests_total.
     
     Args:
-        font_name: Имя файла шрифта (например, "blackrumbleregular.ttf")
-        fallback_size: Размер для fallback шрифта
-        
-    Returns:
-        ImageFont объект
+        maxsize: Предел числа элементов или, с weight, суммарного веса
+        weight: Вес элемента (например, размер в байтах); по умолчанию 1
     """
+
+    def __init__(self, name: str, maxsize: int, weight: Optional[Callable[[object], int]] = None):
+        self.name = name
+        self.maxsize = maxsize
+        self._weight = weight or (lambda value: 1)
+        self._items = OrderedDict()
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def get_or_create(self, key: Hashable, factory: Callable[[], object]):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+        record_cache(self.name, value is not None)
+        if value is not None:
+            return value
+
+        # Создаём вне блокировки: одновременный промах по ключу создаст значение дважды, но не заблокирует остальных
+        value = factory()
+        if value is None:
+            return None
+        weight = self._weight(value)
+        if weight > self.maxsize:
+            # Больше всего кэша - не вытесняем ради него остальное
+            return value
+        with self._lock:
+            previous = self._items.pop(key, None)
+            if previous is not None:
+                self._total -= self._weight(previous)
+            self._items[key] = value
+            self._total += weight
+            while self._total > self.maxsize:
+                _, evicted = self._items.popitem(last=False)
+                self._total -= self._weight(evicted)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._total = 0
+
+
+class _Font:
+    """Загруженный шрифт и кэш ширин слов для него."""
+
+    __slots__ = ("font", "widths")
+
+    def __init__(self, font):
+        self.font = font
+        self.widths: Dict[str, float] = {}
+
+    def width(self, text: str) -> float:
+        """Advance-ширина текста (без кернинга с соседним текстом), кэшируется."""
+        width = self.widths.get(text)
+        if width is None:
+            if len(self.widths) >= MAX_CACHED_WIDTHS:
+                self.widths.clear()
+            width = self.font.getlength(text)
+            self.widths[text] = width
+        return width
+
+
+_fonts = _LRUCache("font", FONT_CACHE_SIZE)
+_fit_sizes = _LRUCache("font_fit", FIT_CACHE_SIZE)
+
+# Имя шрифта -> найденный путь (None - встроенный шрифт Pillow)
+_font_paths: Dict[str, Optional[str]] = {}
+_font_paths_lock = threading.Lock()
+
+# Системный fallback, если шрифт не найден ни по одному пути
+_FALLBACK_FONT = "arial.ttf"
+
+
+def _probe_font(path: str) -> bool:
+    try:
+        ImageFont.truetype(path, 10)
+        return True
+    except Exception:
+        return False
+
+
+def _font_path(font_name: Optional[str]) -> Optional[str]:
+    """Путь к файлу шрифта (ищется один раз на имя); None - встроенный шрифт Pillow."""
+    if not font_name:
+        return None
+    if font_name in _font_paths:
+        return _font_paths[font_name]
+
     # Возможные пути к шрифтам
     font_paths = [
         font_name,  # Текущая директория
@@ -23,19 +145,247 @@ def find_font(font_name: str, fallback_size: int = 100) -> ImageFont.FreeTypeFon
         f"./fonts/{font_name}",
         f"fonts/{font_name}",
     ]
+    path = next((p for p in font_paths if os.path.exists(p) and _probe_font(p)), None)
+    if path is None and _probe_font(_FALLBACK_FONT):
+        # Fallback на системный шрифт
+        path = _FALLBACK_FONT
+    if path is None:
+        print(f"[TextDraw] Шрифт {font_name} не найден, используется встроенный шрифт", flush=True)
+
+    with _font_paths_lock:
+        _font_paths[font_name] = path
+    return path
+
+
+def _get_font(font_name: Optional[str], size: int) -> _Font:
+    """Шрифт из LRU-кэша по (путь, размер); без font_name - встроенный шрифт Pillow."""
+    path = _font_path(font_name)
+
+    def load() -> _Font:
+        if path is None:
+            return _Font(ImageFont.load_default())
+        return _Font(ImageFont.truetype(path, size))
+
+    # Встроенный шрифт не масштабируется - один на все размеры
+    return _fonts.get_or_create((path, size if path else None), load)
+
+
+def find_font(font_name: str, fallback_size: int = 100) -> ImageFont.FreeTypeFont:
+    """
+    Найти шрифт или использовать fallback.
     
-    for path in font_paths:
-        if os.path.exists(path):
-            try:
-                return ImageFont.truetype(path, fallback_size)
-            except Exception:
-                continue
+    Args:
+        font_name: Имя файла шрифта (например, "blackrumbleregular.ttf")
+        fallback_size: Размер для fallback шрифта
+        
+    Returns:
+        ImageFont объект (кэшируется по пути и размеру)
+    """
+    return _get_font(font_name, fallback_size).font
+
+
+def _parse_color(color: str, opacity: float) -> Tuple[int, int, int, int]:
+    """Цвет hex + opacity -> RGBA."""
+    rgb = tuple(int(color[i:i+2], 16) for i in (1, 3, 5))
+    return (*rgb, int(255 * opacity))
+
+
+class TextOverlay:
+    """
+    Текстовый слой: одна или несколько строк одним шрифтом и цветом.
     
-    # Fallback на встроенный шрифт
-    try:
-        return ImageFont.truetype("arial.ttf", fallback_size)
-    except:
-        return ImageFont.load_default()
+    Строки рисуются в общий слой размером с их объединённый bbox - так же,
+    как в полноразмерный прозрачный слой, но без пустых пикселей вокруг.
+    """
+
+    __slots__ = ("font", "fill", "items")
+
+    def __init__(self, font, fill: Tuple[int, int, int, int]):
+        self.font = font
+        self.fill = fill
+        self.items: List[Tuple[Tuple[int, int], str, Optional[str]]] = []
+
+    def add(self, xy: Tuple[int, int], text: str, anchor: Optional[str] = None) -> "TextOverlay":
+        self.items.append((xy, text, anchor))
+        return self
+
+    def bbox(self) -> Optional[Tuple[int, int, int, int]]:
+        """Объединённый bbox строк в координатах кадра (None - нечего рисовать)."""
+        boxes = []
+        for (x, y), text, anchor in self.items:
+            left, top, right, bottom = self.font.getbbox(text, anchor=anchor) if anchor else self.font.getbbox(text)
+            if right > left and bottom > top:
+                boxes.append((x + left, y + top, x + right, y + bottom))
+        if not boxes:
+            return None
+        # +1 пиксель с каждой стороны: запас на округление позиции глифов
+        return (
+            int(min(b[0] for b in boxes)) - 1,
+            int(min(b[1] for b in boxes)) - 1,
+            int(max(b[2] for b in boxes)) + 2,
+            int(max(b[3] for b in boxes)) + 2,
+        )
+
+    def render(self, bbox: Tuple[int, int, int, int]) -> Image.Image:
+        """Нарисовать строки в прозрачный RGBA-слой размером с bbox."""
+        left, top, right, bottom = bbox
+        layer = Image.new("RGBA", (right - left, bottom - top), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(layer)
+        for (x, y), text, anchor in self.items:
+            draw.text((x - left, y - top), text, font=self.font, fill=self.fill, anchor=anchor)
+        return layer
+
+    def sprite(self, origin: Tuple[int, int] = (0, 0)) -> Optional["TextSprite"]:
+        """Отрисовать в спрайт со смещением относительно origin (None - нечего рисовать)."""
+        bbox = self.bbox()
+        if bbox is None:
+            return None
+        # Цвет слоя одинаков во всех пикселях текста - достаточно альфа-канала
+        mask = self.render(bbox).getchannel("A")
+        return TextSprite(mask, self.fill[:3], (bbox[0] - origin[0], bbox[1] - origin[1]))
+
+
+class TextSprite:
+    """
+    Отрисованный текст: альфа-маска (L), цвет и смещение левого верхнего угла
+    маски относительно точки привязки.
+    
+    Вставка цвета по маске на RGB-кадр даёт те же пиксели, что alpha_composite
+    RGBA-слоя с текстом.
+    """
+
+    __slots__ = ("mask", "color", "offset")
+
+    def __init__(self, mask: Image.Image, color: Tuple[int, int, int], offset: Tuple[int, int]):
+        self.mask = mask
+        self.color = color
+        self.offset = offset
+
+    @property
+    def nbytes(self) -> int:
+        return self.mask.width * self.mask.height
+
+
+def apply_sprites(
+    image: Image.Image,
+    placements: List[Tuple[TextSprite, Tuple[int, int]]],
+    in_place: bool = False
+) -> Image.Image:
+    """
+    Наложить спрайты на изображение за один проход.
+    
+    На RGB-кадр каждый спрайт - одна вставка цвета по маске в своей области.
+    Для кадров с прозрачностью область переводится в RGBA и композитится.
+    
+    Args:
+        image: PIL Image
+        placements: (спрайт, точка привязки) в порядке наложения
+        in_place: Менять image (только RGB), а не его копию
+        
+    Returns:
+        RGB изображение с текстом
+    """
+    if image.mode == "RGB":
+        result = image if in_place else image.copy()
+    else:
+        # Прозрачность исходника учитывается так же, как при композите всего кадра
+        result = image.convert("RGBA")
+    
+    for sprite, (x, y) in placements:
+        left, top = x + sprite.offset[0], y + sprite.offset[1]
+        right, bottom = left + sprite.mask.width, top + sprite.mask.height
+        # Обрезаем область по границам кадра
+        box = (max(left, 0), max(top, 0), min(right, result.width), min(bottom, result.height))
+        if box[0] >= box[2] or box[1] >= box[3]:
+            continue
+        mask = sprite.mask
+        if box != (left, top, right, bottom):
+            mask = mask.crop((box[0] - left, box[1] - top, box[2] - left, box[3] - top))
+        
+        if result.mode == "RGB":
+            result.paste(sprite.color, box, mask)
+        else:
+            layer = Image.new("RGBA", mask.size, sprite.color)
+            layer.putalpha(mask)
+            region = result.crop(box)
+            region.alpha_composite(layer)
+            result.paste(region, box[:2])
+    
+    return result if result.mode == "RGB" else result.convert("RGB")
+
+
+def apply_text_overlays(image: Image.Image, overlays: List[TextOverlay], in_place: bool = False) -> Image.Image:
+    """
+    Наложить текстовые слои на изображение за один проход.
+    
+    Каждый слой рисуется в маску размером с его bbox и накладывается только
+    в своей области (см. apply_sprites).
+    
+    Args:
+        image: PIL Image
+        overlays: Слои в порядке наложения
+        in_place: Менять image (только RGB), а не его копию
+        
+    Returns:
+        RGB изображение с текстом
+    """
+    sprites = (overlay.sprite() for overlay in overlays)
+    return apply_sprites(image, [(sprite, (0, 0)) for sprite in sprites if sprite is not None], in_place)
+
+
+_sprites = _LRUCache("text_sprite", TEXT_SPRITE_CACHE_BYTES, weight=lambda sprite: sprite.nbytes)
+
+
+def centered_text_sprite(
+    text: str,
+    container_width: int,
+    font_size: int = 48,
+    color: str = "#FFFFFF",
+    font_name: Optional[str] = "blackrumbleregular.ttf",
+    opacity: float = 1.0,
+    auto_fit: bool = False
+) -> Optional[TextSprite]:
+    """
+    Спрайт центрированного текста из кэша (см. layout_centered_text).
+    
+    Точка привязки - центр текста: накладывается в (центр кадра по X, y_position).
+    """
+    key = ("centered", text, _font_path(font_name), font_size, color, opacity, container_width, auto_fit)
+    
+    def build() -> Optional[TextSprite]:
+        overlay = layout_centered_text(
+            container_width, text, 0, font_size, color, font_name, opacity, auto_fit=auto_fit
+        )
+        return overlay.sprite(origin=(container_width // 2, 0))
+    
+    return _sprites.get_or_create(key, build)
+
+
+def centered_multiline_text_sprite(
+    text: str,
+    container_width: int,
+    font_size: int = 48,
+    color: str = "#FFFFFF",
+    font_name: Optional[str] = None,
+    opacity: float = 1.0,
+    min_font_size: int = 30,
+    line_spacing: float = 1.2
+) -> Optional[TextSprite]:
+    """
+    Спрайт центрированного многострочного текста из кэша (см. layout_centered_multiline_text).
+    
+    Точка привязки - центр нижней строки: накладывается в (центр кадра по X, bottom_y_position).
+    """
+    key = ("multiline", text, _font_path(font_name), font_size, color, opacity, container_width, min_font_size, line_spacing)
+    
+    def build() -> Optional[TextSprite]:
+        overlay = layout_centered_multiline_text(
+            container_width, text, 0, font_size, color, font_name, opacity,
+            min_font_size=min_font_size, line_spacing=line_spacing
+        )
+        return overlay.sprite(origin=(container_width // 2, 0))
+    
+    return _sprites.get_or_create(key, build)
 
 
 def add_text_overlay(
@@ -62,41 +412,23 @@ def add_text_overlay(
     Returns:
         Изображение с добавленным текстом
     """
-    # Создаём копию изображения
-    result = image.copy()
-    
-    # Конвертируем в RGBA для работы с прозрачностью
-    if result.mode != "RGBA":
-        result = result.convert("RGBA")
-    
-    # Создаём отдельный слой для текста
-    text_layer = Image.new("RGBA", result.size, (0, 0, 0, 0))
-    draw = ImageDraw.Draw(text_layer)
-    
+    return apply_text_overlays(image, [layout_text(text, position, font_size, color, font_name, opacity)])
+
+
+def layout_text(
+    text: str,
+    position: Tuple[int, int],
+    font_size: int = 100,
+    color: str = "#FFFFFF",
+    font_name: Optional[str] = "blackrumbleregular.ttf",
+    opacity: float = 1.0
+) -> TextOverlay:
+    """Слой текста с левым верхним углом в position (см. add_text_overlay)."""
     # Загружаем шрифт
-    if font_name:
-        font = find_font(font_name, font_size)
-    else:
-        font = ImageFont.load_default()
-    
-    # Получаем размеры текста
-    bbox = draw.textbbox((0, 0), text, font=font)
-    text_width = bbox[2] - bbox[0]
-    text_height = bbox[3] - bbox[1]
-    
-    # Конвертируем цвет в RGBA с учётом opacity
-    rgb = tuple(int(color[i:i+2], 16) for i in (1, 3, 5))
-    rgba = (*rgb, int(255 * opacity))
-    
-    # Рисуем текст
-    x, y = position
-    draw.text((x, y), text, font=font, fill=rgba)
+    font = _get_font(font_name, font_size).font
     
-    # Композит текстового слоя на изображение
-    result = Image.alpha_composite(result, text_layer)
-    
-    # Конвертируем обратно в RGB
-    return result.convert("RGB")
+    # Конвертируем цвет в RGBA с учётом opacity и рисуем текст
+    return TextOverlay(font, _parse_color(color, opacity)).add(position, text)
 
 
 def find_fit_font_size(
@@ -117,12 +449,21 @@ def find_fit_font_size(
         min_size: Минимальный размер шрифта
         
     Returns:
-        Оптимальный размер шрифта
+        Оптимальный размер шрифта (кэшируется)
     """
-    # Создаем временный ImageDraw для измерения
-    temp_img = Image.new("RGB", (100, 100))
-    temp_draw = ImageDraw.Draw(temp_img)
-    
+    key = (text, max_width, _font_path(font_name), initial_size, min_size)
+    return _fit_sizes.get_or_create(
+        key, lambda: _search_fit_font_size(text, max_width, font_name, initial_size, min_size)
+    )
+
+
+def _search_fit_font_size(
+    text: str,
+    max_width: int,
+    font_name: Optional[str],
+    initial_size: int,
+    min_size: int
+) -> int:
     # Используем бинарный поиск для нахождения оптимального размера
     low = min_size
     high = initial_size
@@ -131,12 +472,9 @@ def find_fit_font_size(
     while low <= high:
         mid = (low + high) // 2
         try:
-            if font_name:
-                font = find_font(font_name, mid)
-            else:
-                font = ImageFont.load_default()
+            font = _get_font(font_name, mid).font
             
-            bbox = temp_draw.textbbox((0, 0), text, font=font)
+            bbox = font.getbbox(text)  # то же, что textbbox((0, 0)), без временного изображения
             text_width = bbox[2] - bbox[0]
             
             if text_width <= max_width * 0.95:  # Оставляем небольшой запас (95%)
@@ -180,45 +518,50 @@ def add_centered_multiline_text(
     Returns:
         PIL Image с добавленным текстом
     """
+    overlay = layout_centered_multiline_text(
+        image.width, text, bottom_y_position, font_size, color, font_name,
+        opacity, max_width, min_font_size, line_spacing
+    )
+    return apply_text_overlays(image, [overlay])
+
+
+def layout_centered_multiline_text(
+    image_width: int,
+    text: str,
+    bottom_y_position: int,
+    font_size: int = 48,
+    color: str = "#FFFFFF",
+    font_name: Optional[str] = None,
+    opacity: float = 1.0,
+    max_width: Optional[int] = None,
+    min_font_size: int = 30,
+    line_spacing: float = 1.2
+) -> TextOverlay:
+    """Слой центрированного многострочного текста для кадра шириной image_width (см. add_centered_multiline_text)."""
     # Определяем максимальную ширину для контейнера
     if max_width is None:
-        container_width = image.width
+        container_width = image_width
     else:
         container_width = max_width
     
     # Разбиваем текст на строки
     lines, final_font_size = split_text_to_lines(text, container_width, font_name, font_size, min_font_size)
     
-    # Создаем копию изображения
-    result = image.copy()
-    
-    # Конвертируем в RGBA для работы с прозрачностью
-    if result.mode != "RGBA":
-        result = result.convert("RGBA")
-    
-    # Создаём отдельный слой для текста
-    text_layer = Image.new("RGBA", result.size, (0, 0, 0, 0))
-    draw = ImageDraw.Draw(text_layer)
-    
     # Загружаем шрифт
-    if font_name:
-        font = find_font(font_name, final_font_size)
-    else:
-        font = ImageFont.load_default()
+    font = _get_font(font_name, final_font_size).font
     
     # Вычисляем высоты всех строк
     line_heights = []
     for line in lines:
-        bbox = draw.textbbox((0, 0), line, font=font)
+        bbox = font.getbbox(line)
         line_heights.append(bbox[3] - bbox[1])
     
     # Вычисляем позиции строк снизу вверх
     # bottom_y_position - это центр нижней строки
-    x_position = image.width // 2  # Центр изображения
+    x_position = image_width // 2  # Центр изображения
     
     # Конвертируем цвет в RGBA с учётом opacity
-    rgb = tuple(int(color[i:i+2], 16) for i in (1, 3, 5))
-    rgba = (*rgb, int(255 * opacity))
+    overlay = TextOverlay(font, _parse_color(color, opacity))
     
     # Рисуем строки снизу вверх, начиная с нижней строки
     current_y = bottom_y_position  # Центр нижней строки
@@ -230,13 +573,8 @@ def add_centered_multiline_text(
         # Центрируем строку по Y относительно её высоты
         line_y = current_y - line_height // 2
         
-        draw.text(
-            (x_position, line_y),
-            line,
-            font=font,
-            fill=rgba,
-            anchor="mm"  # middle-middle: текст центрирован по X и Y
-        )
+        # middle-middle: текст центрирован по X и Y
+        overlay.add((x_position, line_y), line, anchor="mm")
         
         # Переходим к следующей строке выше (если есть)
         if i > 0:
@@ -244,11 +582,7 @@ def add_centered_multiline_text(
             spacing = int(line_height * (line_spacing - 1.0))
             current_y = current_y - line_height - spacing
     
-    # Композит текстового слоя на изображение
-    result = Image.alpha_composite(result, text_layer)
-    
-    # Конвертируем обратно в RGB
-    return result.convert("RGB")
+    return overlay
 
 
 def split_text_to_lines(
@@ -272,43 +606,42 @@ def split_text_to_lines(
     Returns:
         Tuple[list[str], int]: (список строк, финальный размер шрифта - всегда равен font_size)
     """
-    # Создаем временный ImageDraw для измерения
-    temp_img = Image.new("RGB", (1000, 1000))
-    temp_draw = ImageDraw.Draw(temp_img)
-    
     # Используем фиксированный размер шрифта
-    if font_name:
-        fixed_font = find_font(font_name, font_size)
-    else:
-        fixed_font = ImageFont.load_default()
+    fixed_font = _get_font(font_name, font_size)
     
     # Разбиваем текст на слова
     words = text.split()
     
     # Проверяем, помещается ли весь текст с фиксированным размером
-    full_text_width = temp_draw.textbbox((0, 0), text, font=fixed_font)[2] - temp_draw.textbbox((0, 0), text, font=fixed_font)[0]
+    bbox = fixed_font.font.getbbox(text)
+    full_text_width = bbox[2] - bbox[0]
     
     # Если помещается, возвращаем как одну строку с фиксированным размером
     if full_text_width <= max_width:
         return [text], font_size
     
-    # Если не помещается, разбиваем на строки с фиксированным размером шрифта
+    # Если не помещается, разбиваем на строки с фиксированным размером шрифта.
+    # Ширина строки - сумма кэшированных ширин слов и пробелов, а не textbbox
+    # каждого растущего префикса (квадратично по числу слов)
     lines = []
     current_line = []
+    line_width = 0.0
+    space_width = fixed_font.width(" ")
     
     for word in words:
-        # Проверяем ширину слова с пробелом
-        test_line = ' '.join(current_line + [word]) if current_line else word
-        bbox = temp_draw.textbbox((0, 0), test_line, font=fixed_font)
-        word_width = bbox[2] - bbox[0]
+        # Проверяем ширину строки с пробелом и словом
+        word_width = fixed_font.width(word)
+        test_width = line_width + space_width + word_width if current_line else word_width
         
-        if word_width <= max_width:
+        if test_width <= max_width:
             current_line.append(word)
+            line_width = test_width
         else:
             # Сохраняем текущую строку и начинаем новую
             if current_line:
                 lines.append(' '.join(current_line))
             current_line = [word]
+            line_width = word_width
     
     # Добавляем последнюю строку
     if current_line:
@@ -347,9 +680,29 @@ def add_centered_text(
     Returns:
         PIL Image с добавленным текстом
     """
+    overlay = layout_centered_text(
+        image.width, text, y_position, font_size, color, font_name,
+        opacity, bold, auto_fit, max_width
+    )
+    return apply_text_overlays(image, [overlay])
+
+
+def layout_centered_text(
+    image_width: int,
+    text: str,
+    y_position: int,
+    font_size: int = 48,
+    color: str = "#FFFFFF",
+    font_name: Optional[str] = "blackrumbleregular.ttf",
+    opacity: float = 1.0,
+    bold: bool = False,
+    auto_fit: bool = False,
+    max_width: Optional[int] = None
+) -> TextOverlay:
+    """Слой центрированного текста для кадра шириной image_width (см. add_centered_text)."""
     # Определяем максимальную ширину для контейнера
     if max_width is None:
-        container_width = image.width
+        container_width = image_width
     else:
         container_width = max_width
     
@@ -358,64 +711,26 @@ def add_centered_text(
         max_text_width = int(container_width * 0.95)  # 95% ширины контейнера для запаса
         font_size = find_fit_font_size(text, max_text_width, font_name, initial_size=font_size)
     
-    # Создаем копию изображения
-    result = image.copy()
-    
-    # Конвертируем в RGBA для работы с прозрачностью
-    if result.mode != "RGBA":
-        result = result.convert("RGBA")
-    
-    # Создаём отдельный слой для текста
-    text_layer = Image.new("RGBA", result.size, (0, 0, 0, 0))
-    draw = ImageDraw.Draw(text_layer)
-    
     # Загружаем шрифт
-    if font_name:
-        font = find_font(font_name, font_size)
-    else:
-        font = ImageFont.load_default()
+    font = _get_font(font_name, font_size).font
     
     # Получаем размеры текста
-    bbox = draw.textbbox((0, 0), text, font=font)
+    bbox = font.getbbox(text)
     text_width = bbox[2] - bbox[0]
-    text_height = bbox[3] - bbox[1]
     
     # Проверяем, не превышает ли текст максимальную ширину контейнера
     if text_width > container_width:
         # Если текст шире контейнера, уменьшаем размер шрифта
         scale_factor = container_width / text_width
         font_size = int(font_size * scale_factor * 0.95)  # 95% для запаса
-        if font_name:
-            font = find_font(font_name, font_size)
-        else:
-            font = ImageFont.load_default()
-        # Пересчитываем размеры
-        bbox = draw.textbbox((0, 0), text, font=font)
-        text_width = bbox[2] - bbox[0]
-        text_height = bbox[3] - bbox[1]
+        font = _get_font(font_name, font_size).font
     
     # ТОЧНОЕ центрирование по X и Y
-    x_position = image.width // 2  # Центр изображения
+    x_position = image_width // 2  # Центр изображения
     text_y = y_position  # Используем y_position как baseline
     
-    # Конвертируем цвет в RGBA с учётом opacity
-    rgb = tuple(int(color[i:i+2], 16) for i in (1, 3, 5))
-    rgba = (*rgb, int(255 * opacity))
-    
-    # Рисуем текст БЕЗ обводки (stroke_width=0)
-    draw.text(
-        (x_position, text_y), 
-        text, 
-        font=font, 
-        fill=rgba,
-        anchor="mm"  # middle-middle: текст центрирован по X и Y
-    )
-    
-    # Композит текстового слоя на изображение
-    result = Image.alpha_composite(result, text_layer)
-    
-    # Конвертируем обратно в RGB
-    return result.convert("RGB")
+    # Рисуем текст БЕЗ обводки (stroke_width=0), middle-middle: центрирован по X и Y
+    return TextOverlay(font, _parse_color(color, opacity)).add((x_position, text_y), text, anchor="mm")
 
 
 def add_watermark(
@@ -0,0 +1,228 @@
+"""Общий бюджет потоков для OpenCV, ONNX Runtime и BLAS/OpenMP.
+
+OpenCV, ONNX Runtime (внутри rembg) и OpenMP/BLAS (KMeans scikit-learn)
+по умолчанию заводят по пулу на каждое ядро. Несколько одновременных
+рендеров в одном процессе тогда запускают (рендеры x библиотеки x ядра)
+потоков, хост переподписан, и хвосты задержки растут. Бюджет делит ядра
+между ожидаемыми одновременными рендерами и применяет одно и то же число
+потоков на рендер ко всем библиотекам:
+- OpenCV - cv2.setNumThreads (на процесс);
+- BLAS - threadpoolctl (на процесс);
+- OpenMP - threadpoolctl в каждом потоке, выполняющем стадии: число потоков
+  OpenMP хранится отдельно для каждого потока, поэтому ограничение из
+  главного потока на потоки пула запросов не действует;
+- ONNX Runtime - SessionOptions сессий rembg (intra-op потоки, последовательное
+  выполнение графа, без активного ожидания простаивающих потоков).
+
+По умолчанию ядра делятся между слотами планировщика, и бюджет следует за
+адаптивным лимитом (AIMD): при его изменении OpenCV, BLAS и OpenMP получают
+новое число потоков. ONNX Runtime остаётся с числом на момент создания
+сессии (сессия rembg создаётся один раз). Заданные IMAGEFLOW_THREADS_CONCURRENCY
+или IMAGEFLOW_THREADS_PER_REQUEST фиксируют бюджет.
+
+Переменные окружения:
+- IMAGEFLOW_THREADS_CPUS - доступные ядра (по умолчанию по affinity и квоте cgroup)
+- IMAGEFLOW_THREADS_CONCURRENCY - одновременных рендеров, между которыми делятся ядра
+  (по умолчанию текущий лимит планировщика, без планировщика - число ядер)
+- IMAGEFLOW_THREADS_PER_REQUEST - потоков на рендер (по умолчанию ядра / рендеры, не меньше 1)
+- IMAGEFLOW_THREADS_OPENCV, IMAGEFLOW_THREADS_ORT, IMAGEFLOW_THREADS_BLAS - переопределить
+  для отдельной библиотеки (по умолчанию IMAGEFLOW_THREADS_PER_REQUEST)
+"""
+import math
+import os
+import threading
+from typing import Dict, Optional
+
+from .metrics import gauge
+
+LIBRARIES = ("opencv", "ort", "blas")
+
+THREAD_BUDGET = gauge(
+    "imageflow_thread_budget",
+    "Потоков на рендер по библиотекам (бюджет потоков)",
+    ["library"]
+)
+
+
+def _cgroup_cpu_quota() -> Optional[float]:
+    """Квота CPU контейнера в ядрах (cgroup v2 или v1), если она задана."""
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()[:2]
+        if quota != "max":
+            return int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        if quota > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def available_cpus() -> int:
+    """Ядра, доступные процессу: affinity, ограниченная квотой cgroup."""
+    configured = os.getenv("IMAGEFLOW_THREADS_CPUS")
+    if configured:
+        return max(1, int(configured))
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota = _cgroup_cpu_quota()
+    if quota:
+        cpus = min(cpus, math.ceil(quota))
+    return max(1, cpus)
+
+
+class ThreadBudget:
+    """Потоков на рендер для каждой библиотеки."""
+
+    def __init__(self, cpus: int, concurrency: int, opencv: int, ort: int, blas: int):
+        self.cpus = cpus
+        self.concurrency = concurrency
+        self.opencv = opencv
+        self.ort = ort
+        self.blas = blas
+
+    @classmethod
+    def from_env(cls, concurrency: Optional[int] = None) -> "ThreadBudget":
+        """Бюджет из переменных окружения; concurrency - лимит планировщика (по умолчанию текущий)."""
+        cpus = available_cpus()
+        configured = os.getenv("IMAGEFLOW_THREADS_CONCURRENCY")
+        if configured:
+            concurrency = int(configured)
+        elif concurrency is None:
+            concurrency = _scheduler_limit() or cpus
+        concurrency = max(1, concurrency)
+        per_request = int(os.getenv("IMAGEFLOW_THREADS_PER_REQUEST") or max(1, cpus // concurrency))
+        threads = {
+            library: max(1, int(os.getenv(f"IMAGEFLOW_THREADS_{library.upper()}") or per_request))
+            for library in LIBRARIES
+        }
+        return cls(cpus, concurrency, **threads)
+
+    def as_dict(self) -> Dict[str, int]:
+        return {
+            "cpus": self.cpus,
+            "concurrency": self.concurrency,
+            **{library: getattr(self, library) for library in LIBRARIES},
+        }
+
+
+def _scheduler_limit() -> Optional[int]:
+    """Текущий лимит планировщика или None, если он выключен."""
+    from . import scheduler
+
+    return scheduler.get_scheduler().limit.value if scheduler.enabled() else None
+
+
+def follows_scheduler() -> bool:
+    """Следует ли бюджет за адаптивным лимитом (не зафиксирован переменными окружения)."""
+    return not (os.getenv("IMAGEFLOW_THREADS_CONCURRENCY") or os.getenv("IMAGEFLOW_THREADS_PER_REQUEST"))
+
+
+_budget: Optional[ThreadBudget] = None
+_controller = None
+_applied = False
+_apply_lock = threading.Lock()
+_thread_state = threading.local()
+
+
+def get_budget() -> ThreadBudget:
+    global _budget
+    if _budget is None:
+        with _apply_lock:
+            if _budget is None:
+                _budget = ThreadBudget.from_env()
+    return _budget
+
+
+def _threadpool_controller():
+    """Контроллер threadpoolctl (зависимость scikit-learn) или None, если его нет."""
+    global _controller
+    if _controller is None:
+        try:
+            from threadpoolctl import ThreadpoolController
+        except ImportError:
+            return None
+        _controller = ThreadpoolController()
+    return _controller
+
+
+def apply() -> ThreadBudget:
+    """Применить бюджет ко всем процессным пулам (один раз; повторные вызовы ничего не делают)."""
+    global _applied
+    budget = get_budget()
+    if _applied:
+        return budget
+    with _apply_lock:
+        if _applied:
+            return budget
+        _configure(budget)
+        _applied = True
+    if follows_scheduler() and _scheduler_limit() is not None:
+        from . import scheduler
+
+        scheduler.get_scheduler().add_limit_listener(_follow_limit)
+    print(f"[Threads] Бюджет потоков: {budget.as_dict()}", flush=True)
+    return budget
+
+
+def _configure(budget: ThreadBudget) -> None:
+    """Процессные пулы OpenCV и BLAS и гейджи (вызывается под _apply_lock)."""
+    import cv2
+    cv2.setNumThreads(budget.opencv)
+    controller = _threadpool_controller()
+    if controller is not None:
+        controller.limit(limits=budget.blas, user_api="blas")
+    for library in LIBRARIES:
+        THREAD_BUDGET.set(getattr(budget, library), library=library)
+
+
+def _follow_limit(limit: int) -> None:
+    """Пересчитать бюджет под новый лимит планировщика (ONNX Runtime не меняется)."""
+    global _budget
+    with _apply_lock:
+        budget = ThreadBudget.from_env(concurrency=limit)
+        budget.ort = _budget.ort
+        if budget.as_dict() == _budget.as_dict():
+            return
+        _budget = budget
+        _configure(budget)
+    print(f"[Threads] Бюджет потоков по лимиту планировщика {limit}: {budget.as_dict()}", flush=True)
+
+
+def apply_to_thread() -> None:
+    """
+    Ограничить OpenMP в текущем потоке (повторно - только после изменения бюджета).
+
+    Вызывается на границах стадий пайплайна: стадии выполняются в потоках
+    пула запросов и ветках хеджирования, у каждого из которых свой OpenMP.
+    """
+    budget = apply()
+    if getattr(_thread_state, "openmp", None) == budget.blas:
+        return
+    controller = _threadpool_controller()
+    if controller is not None:
+        controller.limit(limits=budget.blas, user_api="openmp")
+    _thread_state.openmp = budget.blas
+
+
+def ort_session_options():
+    """SessionOptions ONNX Runtime по бюджету: intra-op потоки, граф последовательно, без spin-ожидания."""
+    import onnxruntime as ort
+
+    budget = apply()
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = budget.ort
+    options.inter_op_num_threads = 1
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    # Простаивающие потоки ORT не крутятся в ожидании и не отнимают CPU у других рендеров
+    options.add_session_config_entry("session.intra_op.allow_spinning", "0")
+    return options
@@ -0,0 +1,236 @@
+"""Трассировка запросов: span'ы по стадиям, заголовок Server-Timing и экспорт в OTLP.
+
+Трасса живёт в contextvar на время запроса /render. Модули пайплайна открывают
+span'ы через `span(name)`; если трасса не начата (скрипты, бенчмарки), span
+ничего не делает.
+
+Экспорт (опционально, в фоновом потоке):
+- IMAGEFLOW_OTLP_ENDPOINT - базовый URL OTLP/HTTP коллектора (JSON, POST {endpoint}/v1/traces)
+- IMAGEFLOW_TRACE_FILE - файл, куда трассы дописываются в том же OTLP JSON (по строке на трассу)
+"""
+import json
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional
+
+_current_trace: ContextVar[Optional["Trace"]] = ContextVar("imageflow_trace", default=None)
+_current_span_id: ContextVar[Optional[str]] = ContextVar("imageflow_span_id", default=None)
+
+_TRACEPARENT_RE = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+
+class Span:
+    """Один замер внутри трассы."""
+
+    __slots__ = ("name", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, name: str, parent_id: Optional[str], attributes: Dict):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+        self.error = None
+
+    @property
+    def duration_ms(self) -> float:
+        end_ns = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end_ns - self.start_ns) / 1e6
+
+
+class Trace:
+    """Трасса одного запроса: идентификатор и список завершённых span'ов."""
+
+    def __init__(self, trace_id: Optional[str] = None, parent_span_id: Optional[str] = None):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.parent_span_id = parent_span_id
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def server_timing(self) -> str:
+        """
+        Значение заголовка Server-Timing.
+
+        Span'ы с одинаковым именем (например, опросы статуса Seedream)
+        суммируются, количество указывается в desc.
+        """
+        totals: Dict[str, List[float]] = {}
+        with self._lock:
+            spans = list(self.spans)
+        for s in spans:
+            entry = totals.setdefault(s.name, [0.0, 0])
+            entry[0] += s.duration_ms
+            entry[1] += 1
+
+        parts = []
+        for name, (duration_ms, count) in totals.items():
+            metric = re.sub(r"[^A-Za-z0-9_.-]", "_", name)
+            if count > 1:
+                parts.append(f'{metric};desc="x{count}";dur={duration_ms:.1f}')
+            else:
+                parts.append(f"{metric};dur={duration_ms:.1f}")
+        return ", ".join(parts)
+
+    def to_otlp(self, service_name: str = "imageflow") -> Dict:
+        """Трасса в формате OTLP/HTTP JSON (ExportTraceServiceRequest)."""
+        with self._lock:
+            spans = list(self.spans)
+
+        otlp_spans = []
+        for s in spans:
+            otlp_span = {
+                "traceId": self.trace_id,
+                "spanId": s.span_id,
+                "name": s.name,
+                "kind": 1,  # SPAN_KIND_INTERNAL
+                "startTimeUnixNano": str(s.start_ns),
+                "endTimeUnixNano": str(s.end_ns or s.start_ns),
+                "attributes": [_otlp_attribute(k, v) for k, v in s.attributes.items()],
+                "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+            }
+            parent_id = s.parent_id or self.parent_span_id
+            if parent_id:
+                otlp_span["parentSpanId"] = parent_id
+            otlp_spans.append(otlp_span)
+
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [_otlp_attribute("service.name", service_name)]},
+                "scopeSpans": [{"scope": {"name": "imageflow"}, "spans": otlp_spans}],
+            }]
+        }
+
+
+def _otlp_attribute(key: str, value) -> Dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def parse_traceparent(header: Optional[str]):
+    """Разобрать W3C traceparent. Возвращает (trace_id, parent_span_id) или (None, None)."""
+    if not header:
+        return None, None
+    match = _TRACEPARENT_RE.match(header.strip().lower())
+    if not match:
+        return None, None
+    return match.group(1), match.group(2)
+
+
+def start_trace(traceparent: Optional[str] = None) -> Trace:
+    """Начать трассу для текущего контекста (продолжая входящий traceparent, если он валиден)."""
+    trace_id, parent_span_id = parse_traceparent(traceparent)
+    trace = Trace(trace_id, parent_span_id)
+    _current_trace.set(trace)
+    _current_span_id.set(None)
+    return trace
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def current_trace_id() -> Optional[str]:
+    trace = _current_trace.get()
+    return trace.trace_id if trace is not None else None
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Optional[Span]]:
+    """
+    Замерить блок кода как span текущей трассы.
+
+    Без активной трассы ничего не записывает (yield None).
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+
+    s = Span(name, _current_span_id.get(), attributes)
+    token = _current_span_id.set(s.span_id)
+    try:
+        yield s
+    except BaseException as e:
+        s.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span_id.reset(token)
+        s.end_ns = time.time_ns()
+        trace.add(s)
+
+
+# ============================================================================
+# Экспорт
+# ============================================================================
+
+_export_queue: "queue.Queue[Trace]" = queue.Queue(maxsize=1000)
+_export_thread: Optional[threading.Thread] = None
+_export_lock = threading.Lock()
+
+
+def export_enabled() -> bool:
+    return bool(os.getenv("IMAGEFLOW_OTLP_ENDPOINT") or os.getenv("IMAGEFLOW_TRACE_FILE"))
+
+
+def export_trace(trace: Trace) -> None:
+    """Поставить трассу в очередь на экспорт (не блокирует запрос)."""
+    if not export_enabled():
+        return
+    _ensure_export_thread()
+    try:
+        _export_queue.put_nowait(trace)
+    except queue.Full:
+        print(f"[Tracing] Очередь экспорта переполнена, трасса {trace.trace_id} пропущена", flush=True)
+
+
+def _ensure_export_thread() -> None:
+    global _export_thread
+    if _export_thread is not None and _export_thread.is_alive():
+        return
+    with _export_lock:
+        if _export_thread is None or not _export_thread.is_alive():
+            _export_thread = threading.Thread(target=_export_worker, name="imageflow-trace-export", daemon=True)
+            _export_thread.start()
+
+
+def _export_worker() -> None:
+    import requests
+
+    while True:
+        trace = _export_queue.get()
+        payload = trace.to_otlp()
+
+        endpoint = os.getenv("IMAGEFLOW_OTLP_ENDPOINT")
+        if endpoint:
+            try:
+                requests.post(
+                    endpoint.rstrip("/") + "/v1/traces",
+                    json=payload,
+                    timeout=5
+                ).raise_for_status()
+            except requests.RequestException as e:
+                print(f"[Tracing] Ошибка экспорта в OTLP коллектор: {type(e).__name__}: {e}", flush=True)
+
+        trace_file = os.getenv("IMAGEFLOW_TRACE_FILE")
+        if trace_file:
+            try:
+                with open(trace_file, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(payload, ensure_ascii=False) + "\n")
+            except OSError as e:
+                print(f"[Tracing] Ошибка записи трассы в файл: {e}", flush=True)
@@ -0,0 +1,163 @@
+"""Исходник, загруженный прямо в /render (multipart или бинарное тело).
+
+Раньше изображение, которое клиент уже держит в памяти, приходилось
+выкладывать на внешний хост, откуда его снова скачивали fetch_image и
+Seedream. Теперь байты запроса сразу идут в пайплайн (SourceImage
+декодирует их без загрузки), а Seedream получает исходник одним из способов:
+- data_uri - base64 data URI прямо в запросе к fal (без внешнего хостинга);
+- url - короткоживущая ссылка IMAGEFLOW_PUBLIC_URL/uploads/<токен>, которую
+  отдаёт сам сервис; ссылка удаляется после рендера (или по TTL).
+
+Переменные окружения:
+- IMAGEFLOW_UPLOAD_SEEDREAM - data_uri, url или auto (по умолчанию auto: url, если задан
+  IMAGEFLOW_PUBLIC_URL, иначе data_uri)
+- IMAGEFLOW_PUBLIC_URL - внешний базовый URL сервиса для коротких ссылок
+- IMAGEFLOW_UPLOAD_TTL - максимальное время жизни короткой ссылки, секунды (по умолчанию 600)
+"""
+import base64
+import hashlib
+import io
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple
+
+from PIL import Image
+
+from .metrics import counter
+from .streaming import MAX_DOWNLOAD_BYTES
+from .utils import MAX_IMAGE_PIXELS
+
+# Загрузка ограничена тем же пределом, что и скачивание исходника по URL
+MAX_UPLOAD_BYTES = MAX_DOWNLOAD_BYTES
+
+SEEDREAM_MODES = ("auto", "data_uri", "url")
+
+UPLOADS_TOTAL = counter(
+    "imageflow_uploads_total",
+    "Исходники, загруженные в /render, по способу передачи в Seedream",
+    ["seedream"]
+)
+
+
+class Upload:
+    """
+    Загруженный исходник: байты, формат из заголовка изображения и SHA-256.
+
+    Args:
+        data: Байты изображения
+    """
+
+    def __init__(self, data: bytes, format: str, size: Tuple[int, int]):
+        self.data = data
+        self.format = format
+        self.size = size
+        self.content_type = Image.MIME.get(format, "application/octet-stream")
+        self.digest = hashlib.sha256(data).hexdigest()
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+
+def inspect(data: bytes) -> Upload:
+    """
+    Проверить загруженные байты по заголовку изображения (без декодирования пикселей).
+
+    Raises:
+        ValueError: Пустое тело, не изображение, больше MAX_UPLOAD_BYTES или IMAGEFLOW_MAX_IMAGE_PIXELS
+    """
+    if not data:
+        raise ValueError("Пустое изображение")
+    if len(data) > MAX_UPLOAD_BYTES:
+        raise ValueError(f"Изображение {len(data)} байт больше допустимого ({MAX_UPLOAD_BYTES} байт)")
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            format, size = image.format, image.size
+    except Image.DecompressionBombError as e:
+        raise ValueError(f"Изображение отклонено как decompression bomb: {e}") from e
+    except (OSError, SyntaxError) as e:
+        raise ValueError(f"Не удалось распознать изображение: {e}") from e
+    if size[0] * size[1] > MAX_IMAGE_PIXELS:
+        raise ValueError(f"Изображение {size[0]}x{size[1]} больше допустимого ({MAX_IMAGE_PIXELS} пикселей)")
+    return Upload(data, format, size)
+
+
+def seedream_mode() -> str:
+    mode = os.getenv("IMAGEFLOW_UPLOAD_SEEDREAM", "auto").lower()
+    if mode not in SEEDREAM_MODES:
+        mode = "auto"
+    if mode == "auto":
+        mode = "url" if public_url() else "data_uri"
+    return mode
+
+
+def public_url() -> str:
+    return os.getenv("IMAGEFLOW_PUBLIC_URL", "").rstrip("/")
+
+
+def ttl() -> float:
+    return float(os.getenv("IMAGEFLOW_UPLOAD_TTL", 600))
+
+
+def data_uri(upload: Upload) -> str:
+    return f"data:{upload.content_type};base64,{base64.b64encode(upload.data).decode('ascii')}"
+
+
+class UploadStore:
+    """Загрузки, доступные по коротким ссылкам /uploads/<токен>, с ограниченным временем жизни."""
+
+    def __init__(self):
+        self._uploads: Dict[str, Tuple[Upload, float]] = {}
+        self._lock = threading.Lock()
+
+    def publish(self, upload: Upload, lifetime: float) -> str:
+        token = secrets.token_urlsafe(24)
+        with self._lock:
+            self._prune()
+            self._uploads[token] = (upload, time.monotonic() + lifetime)
+        return token
+
+    def get(self, token: str) -> Optional[Upload]:
+        with self._lock:
+            self._prune()
+            entry = self._uploads.get(token)
+        return entry[0] if entry is not None else None
+
+    def remove(self, token: str) -> None:
+        with self._lock:
+            self._uploads.pop(token, None)
+
+    def _prune(self) -> None:
+        now = time.monotonic()
+        for token in [t for t, (_, expires) in self._uploads.items() if expires <= now]:
+            del self._uploads[token]
+
+
+STORE = UploadStore()
+
+
+@contextmanager
+def seedream_source(image_url: Optional[str], upload: Optional[Upload]) -> Iterator[str]:
+    """
+    URL исходника для Seedream на время блока.
+
+    Без загрузки - image_url как есть; с загрузкой - data URI или короткая
+    ссылка на этот сервис (см. IMAGEFLOW_UPLOAD_SEEDREAM), удаляемая после блока.
+    """
+    if upload is None:
+        yield image_url
+        return
+    mode = seedream_mode()
+    UPLOADS_TOTAL.inc(seedream=mode)
+    if mode == "data_uri":
+        yield data_uri(upload)
+        return
+    if not public_url():
+        raise RuntimeError("IMAGEFLOW_UPLOAD_SEEDREAM=url требует IMAGEFLOW_PUBLIC_URL")
+    token = STORE.publish(upload, ttl())
+    try:
+        yield f"{public_url()}/uploads/{token}"
+    finally:
+        STORE.remove(token)
@@ -1,8 +1,9 @@
 """Утилиты для работы с изображениями и цветовыми пространствами."""
 import io
+import os
 import numpy as np
 from PIL import Image
-from typing import Tuple
+from typing import BinaryIO, Callable, Optional, Tuple, Union
 
 
 def srgb_to_linear(rgb: np.ndarray) -> np.ndarray:
@@ -29,38 +30,162 @@ def pil_to_bytes(img: Image.Image, format: str = "PNG") -> bytes:
     return buf.getvalue()
 
 
-def fetch_image(url: str) -> Image.Image:
-    """Скачать изображение по URL и вернуть PIL Image."""
+# Предел размера исходника в пикселях (защита от decompression bomb).
+# Pillow сам бросает DecompressionBombError только после 2x MAX_IMAGE_PIXELS,
+# поэтому проверяем явно и выравниваем его предел с нашим.
+MAX_IMAGE_PIXELS = int(os.getenv("IMAGEFLOW_MAX_IMAGE_PIXELS", 50_000_000))
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+
+# Режимы, в которых Image.reduce усредняет пиксели корректно; палитровые (P, PA),
+# 1-битные и 16/32-битные перед уменьшением переводятся в RGB/RGBA
+_REDUCE_MODES = ("L", "LA", "RGB", "RGBA", "CMYK", "YCbCr")
+
+
+def _reduce_factor(size: Tuple[int, int], target_size: Tuple[int, int]) -> int:
+    """Максимальный целый коэффициент уменьшения, после которого обе стороны не меньше target_size."""
+    return max(1, min(size[0] // max(target_size[0], 1), size[1] // max(target_size[1], 1)))
+
+
+def decode_image(
+    data: Union[bytes, BinaryIO],
+    target_size: Optional[Tuple[int, int]] = None,
+    on_header: Optional[Callable[[Image.Image], None]] = None
+) -> Image.Image:
+    """
+    Декодировать изображение с уменьшением на этапе декодирования.
+    
+    Если задан target_size, изображение декодируется сразу в размере, близком к
+    рабочему, но не меньше target_size по обеим сторонам (подходит и для
+    cover-crop, и для последующего resize):
+    - JPEG: draft mode - libjpeg масштабирует DCT в 1/2, 1/4 или 1/8 при декодировании;
+    - остальные форматы: полное декодирование и Image.reduce (усреднение блоков).
+    
+    Args:
+        data: Байты изображения или файлоподобный объект (в т.ч. streaming.StreamBuffer)
+        target_size: (ширина, высота) рабочего размера или None - декодировать как есть
+        on_header: Вызывается после разбора заголовка и проверок, перед декодированием пикселей
+        
+    Returns:
+        Загруженное (load()) PIL Image
+        
+    Raises:
+        ValueError: Если изображение больше IMAGEFLOW_MAX_IMAGE_PIXELS
+    """
+    from . import admission
+    
+    try:
+        img = Image.open(io.BytesIO(data) if isinstance(data, (bytes, bytearray)) else data)
+    except Image.DecompressionBombError as e:
+        raise ValueError(f"Изображение отклонено как decompression bomb: {e}") from e
+    width, height = img.size
+    if width * height > MAX_IMAGE_PIXELS:
+        raise ValueError(
+            f"Изображение {width}x{height} больше допустимого ({MAX_IMAGE_PIXELS} пикселей)"
+        )
+    
+    if target_size is not None and img.format == "JPEG" and _reduce_factor(img.size, target_size) >= 2:
+        # draft меняет img.size до декодирования - резерв памяти ниже уже по уменьшенному размеру
+        img.draft("RGB", target_size)
+    
+    # Image.open читает только заголовок - резервируем память до декодирования
+    admission.reserve(admission.estimate_decoded_bytes(*img.size), f"decode {img.size[0]}x{img.size[1]}")
+    if on_header is not None:
+        on_header(img)
+    img.load()
+    
+    if target_size is not None:
+        factor = _reduce_factor(img.size, target_size)
+        if factor >= 2:
+            if img.mode not in _REDUCE_MODES:
+                # Пайплайн всё равно работает в RGB: конвертация до reduce (прозрачность сохраняется)
+                img = img.convert("RGBA" if "A" in img.mode or "transparency" in img.info else "RGB")
+            img = img.reduce(factor)
+    
+    if img.size != (width, height):
+        print(f"[decode_image] Уменьшено при декодировании: {width}x{height} -> {img.size[0]}x{img.size[1]}", flush=True)
+    return img
+
+
+def fetch_image(
+    url: str,
+    source: str = "source",
+    target_size: Optional[Tuple[int, int]] = None
+) -> Image.Image:
+    """
+    Скачать изображение по URL и вернуть PIL Image.
+    
+    Тело ответа читается потоково: размеры проверяются по заголовку изображения
+    до загрузки остального тела, декодирование идёт параллельно с передачей
+    (см. streaming.py).
+    
+    Args:
+        url: URL изображения
+        source: Метка источника для метрики imageflow_bytes_in_total и лога загрузок запроса
+        target_size: Рабочий размер (ширина, высота) для уменьшения при декодировании (см. decode_image)
+    """
     import requests
     import sys
     from .retry_utils import safe_request
+    from .metrics import BYTES_IN_TOTAL
+    from .tracing import span
+    from .source import record_transfer
+    from .streaming import SEQUENTIAL_FORMATS, check_image_response, start_streaming
     
     print(f"[fetch_image] Начало загрузки: {url[:80]}...", flush=True)
     sys.stdout.flush()
     
-    try:
-        # Используем безопасный запрос с retry
-        response = safe_request("GET", url, max_retries=3, timeout=30)
-        
-        print(f"[fetch_image] HTTP статус: {response.status_code}", flush=True)
-        sys.stdout.flush()
+    with span("fetch_image", source=source) as fetch_span:
+        try:
+            # Используем безопасный запрос с retry; тело читаем потоково
+            response = safe_request("GET", url, max_retries=3, timeout=30, stream=True)
         
-        print(f"[fetch_image] Изображение загружено, размер: {len(response.content)} байт", flush=True)
-        sys.stdout.flush()
+            print(f"[fetch_image] HTTP статус: {response.status_code}", flush=True)
+            sys.stdout.flush()
+            
+            stream, pump = None, None
+            try:
+                # Content-Type и Content-Length проверяем до чтения тела
+                check_image_response(response)
+                stream, pump = start_streaming(response)
+                
+                def on_header(img: Image.Image) -> None:
+                    # Заголовок разобран, размеры проверены и память зарезервирована - дальше
+                    # декодер читает данные по мере поступления
+                    print(f"[fetch_image] Заголовок получен после {stream.received} байт: "
+                          f"{img.format} {img.size}, mode={img.mode}", flush=True)
+                    if img.format in SEQUENTIAL_FORMATS:
+                        stream.release_consumed()
+                
+                with span("decode_image"):
+                    img = decode_image(stream, target_size, on_header=on_header)
+            finally:
+                # Если декодирование прервано (лимиты, ошибка) - останавливаем загрузку
+                if stream is not None:
+                    stream.cancel()
+                response.close()
+                if pump is not None:
+                    pump.join(timeout=5)
         
-        img = Image.open(io.BytesIO(response.content))
-        print(f"[fetch_image] Изображение открыто: {img.size}, mode={img.mode}", flush=True)
-        sys.stdout.flush()
+            print(f"[fetch_image] Изображение загружено, размер: {stream.received} байт", flush=True)
+            sys.stdout.flush()
+            BYTES_IN_TOTAL.inc(stream.received, source=source)
+            record_transfer(source, stream.received)
+            if fetch_span is not None:
+                fetch_span.attributes["bytes"] = stream.received
+            
+            print(f"[fetch_image] Изображение открыто: {img.size}, mode={img.mode}", flush=True)
+            sys.stdout.flush()
         
-        return img
-    except requests.exceptions.RequestException as e:
-        print(f"[fetch_image] ОШИБКА загрузки: {type(e).__name__}: {e}", flush=True)
-        sys.stdout.flush()
-        raise
-    except Exception as e:
-        print(f"[fetch_image] ОШИБКА обработки: {type(e).__name__}: {e}", flush=True)
-        sys.stdout.flush()
-        raise
+            return img
+        except requests.exceptions.RequestException as e:
+            print(f"[fetch_image] ОШИБКА загрузки: {type(e).__name__}: {e}", flush=True)
+            sys.stdout.flush()
+            raise
+        except Exception as e:
+            print(f"[fetch_image] ОШИБКА обработки: {type(e).__name__}: {e}", flush=True)
+            sys.stdout.flush()
+            raise
 
 
 def split_game_title(title: str) -> str:
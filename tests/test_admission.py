@@ -0,0 +1,97 @@
+"""Контроль допуска: резервы по оценке памяти, очередь, 413 и 503."""
+import io
+import threading
+import time
+
+import pytest
+from PIL import Image
+
+from imageflow import admission, deadline
+from imageflow.utils import decode_image
+
+MB = admission.MB
+
+
+def test_estimate_is_proportional_to_pixels():
+    assert admission.estimate_decoded_bytes(1000, 1000) == 1000 * 1000 * 4 * 2
+    assert admission.estimate_decoded_bytes(2000, 1000) == 2 * admission.estimate_decoded_bytes(1000, 1000)
+
+
+def test_request_larger_than_budget_is_rejected_at_once():
+    budget = admission.MemoryBudget(100 * MB, queue_timeout=5)
+    start = time.monotonic()
+
+    with pytest.raises(admission.AdmissionRejected) as info:
+        budget.acquire(200 * MB)
+
+    assert info.value.status_code == 413
+    assert time.monotonic() - start < 1
+    assert budget.reserved == 0
+
+
+def test_full_budget_rejects_after_queue_timeout():
+    budget = admission.MemoryBudget(100 * MB, queue_timeout=0.1)
+    budget.acquire(80 * MB)
+
+    with pytest.raises(admission.AdmissionRejected) as info:
+        budget.acquire(30 * MB)
+
+    assert info.value.status_code == 503
+    assert info.value.retry_after >= 1
+    assert budget.reserved == 80 * MB
+
+
+def test_queued_request_is_admitted_after_release():
+    budget = admission.MemoryBudget(100 * MB, queue_timeout=5)
+    budget.acquire(80 * MB)
+    threading.Timer(0.1, budget.release, args=(80 * MB,)).start()
+
+    budget.acquire(30 * MB)
+
+    assert budget.reserved == 30 * MB
+
+
+@pytest.fixture
+def small_budget(monkeypatch):
+    budget = admission.MemoryBudget(100 * MB, queue_timeout=0.1)
+    monkeypatch.setattr(admission, "_budget", budget)
+    return budget
+
+
+def test_request_scope_releases_everything_it_grew(small_budget):
+    with admission.request_scope() as reservation:
+        admission.reserve(10 * MB, "decode")
+        admission.reserve(20 * MB, "pipeline")
+        assert reservation.nbytes == small_budget.reserved == 30 * MB
+
+    assert small_budget.reserved == 0
+
+
+def test_decode_is_rejected_by_header_before_pixels(small_budget):
+    buf = io.BytesIO()
+    Image.new("RGB", (4000, 4000)).save(buf, format="PNG")
+    headers = []
+
+    with admission.request_scope():
+        with pytest.raises(admission.AdmissionRejected) as info:
+            decode_image(buf.getvalue(), on_header=headers.append)
+
+    assert info.value.status_code == 413
+    assert not headers
+
+
+def test_reserve_outside_request_is_noop():
+    admission.reserve(10 ** 12)
+
+
+def test_queue_wait_is_bounded_by_request_deadline():
+    budget = admission.MemoryBudget(100 * MB, queue_timeout=30)
+    budget.acquire(100 * MB)
+    reservation = admission.Reservation(budget)
+    start = time.monotonic()
+
+    with deadline.request_deadline(0.2):
+        with pytest.raises(admission.AdmissionRejected):
+            reservation.grow(10 * MB)
+
+    assert time.monotonic() - start < 2
@@ -0,0 +1,69 @@
+"""CircuitBreaker: вызовы, прерванные отменой или дедлайном запроса, не учитываются как сбой."""
+import pytest
+import requests
+
+from imageflow import deadline, retry_utils
+from imageflow.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+from imageflow.deadline import DeadlineExceeded
+from imageflow.hedging import HedgeCancelled
+
+
+def _half_open_breaker() -> CircuitBreaker:
+    breaker = CircuitBreaker("test", min_calls=1, open_seconds=0.0, half_open_calls=1)
+    with pytest.raises(requests.ConnectionError):
+        with breaker.call():
+            raise requests.ConnectionError("down")
+    assert breaker.state == HALF_OPEN
+    return breaker
+
+
+@pytest.mark.parametrize("error", [HedgeCancelled("cancelled"), DeadlineExceeded("seedream")])
+def test_interrupted_probe_keeps_half_open_and_frees_slot(error):
+    breaker = _half_open_breaker()
+
+    with pytest.raises(type(error)):
+        with breaker.call():
+            raise error
+
+    assert breaker.state == HALF_OPEN
+    # Слот пробы возвращён: следующий вызов допускается
+    with breaker.call():
+        pass
+
+
+def test_probe_slots_are_limited():
+    breaker = _half_open_breaker()
+    breaker.allow()
+
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+
+def test_timeout_shortened_by_deadline_is_not_a_failure(monkeypatch):
+    def slow_request(method, url, timeout, **kwargs):
+        raise requests.ReadTimeout(f"read timeout={timeout}")
+
+    monkeypatch.setattr(requests, "request", slow_request)
+    breaker = CircuitBreaker("test", min_calls=1)
+
+    # Короткий X-Request-Timeout сжимает таймаут попытки: это дедлайн клиента, не сбой сервиса
+    with deadline.request_deadline(0.5):
+        with pytest.raises(DeadlineExceeded):
+            with breaker.call():
+                retry_utils.safe_request("GET", "http://seedream.invalid", timeout=30)
+
+    assert breaker.state == CLOSED
+
+
+def test_full_timeout_is_a_failure(monkeypatch):
+    def slow_request(method, url, timeout, **kwargs):
+        raise requests.ReadTimeout(f"read timeout={timeout}")
+
+    monkeypatch.setattr(requests, "request", slow_request)
+    breaker = CircuitBreaker("test", min_calls=1)
+
+    with pytest.raises(requests.ReadTimeout):
+        with breaker.call():
+            retry_utils.safe_request("GET", "http://seedream.invalid", max_retries=1, timeout=30)
+
+    assert breaker.state == OPEN
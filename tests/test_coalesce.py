@@ -0,0 +1,89 @@
+"""SingleFlight: урезанный дедлайном результат не отдаётся более позднему дедлайну; ошибка копируется для каждого."""
+import threading
+import time
+
+from imageflow import coalesce, deadline
+
+
+def _run(flight, key, fn, seconds, results):
+    with deadline.request_deadline(seconds):
+        results.append(flight.do(key, fn))
+
+
+def _leader_with_waiter(leader_fn, waiter_seconds, leader_seconds=5.0):
+    flight = coalesce.SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    results = []
+
+    def leader():
+        started.set()
+        release.wait(5)
+        return leader_fn()
+
+    def waiter_fn():
+        return "waiter"
+
+    leader_thread = threading.Thread(target=_run, args=(flight, "key", leader, leader_seconds, results))
+    leader_thread.start()
+    started.wait(5)
+    waiter_results = []
+    waiter_thread = threading.Thread(target=_run, args=(flight, "key", waiter_fn, waiter_seconds, waiter_results))
+    waiter_thread.start()
+    time.sleep(0.1)
+    release.set()
+    leader_thread.join(5)
+    waiter_thread.join(5)
+    return waiter_results[0]
+
+
+def _cut_by_deadline():
+    # Как пайплайн: времени на Seedream не хватает - дешёвый путь
+    deadline.can_wait(3600)
+    return "fallback"
+
+
+def test_result_is_shared_when_deadline_did_not_matter():
+    assert _leader_with_waiter(lambda: "seedream", waiter_seconds=60) == ("seedream", True)
+
+
+def test_deadline_cut_result_is_rerun_for_later_deadline():
+    assert _leader_with_waiter(_cut_by_deadline, waiter_seconds=60) == ("waiter", False)
+
+
+def test_deadline_cut_result_is_shared_with_earlier_deadline():
+    assert _leader_with_waiter(_cut_by_deadline, waiter_seconds=1) == ("fallback", True)
+
+
+def test_each_waiter_gets_its_own_error():
+    flight = coalesce.SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    errors = []
+
+    def leader():
+        started.set()
+        release.wait(5)
+        raise ValueError("upstream")
+
+    def run(fn):
+        try:
+            flight.do("key", fn)
+        except ValueError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(leader,))]
+    threads[0].start()
+    started.wait(5)
+    threads += [threading.Thread(target=run, args=(lambda: "waiter",)) for _ in range(2)]
+    for thread in threads[1:]:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    original = next(e for e in errors if e.__cause__ is None)
+    copies = [e for e in errors if e is not original]
+    assert len(copies) == 2 and copies[0] is not copies[1]
+    assert all(e.__cause__ is original and e.args == ("upstream",) for e in copies)
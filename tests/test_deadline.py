@@ -0,0 +1,100 @@
+"""Дедлайн запроса: заголовок, сжатие таймаутов и повторов, отметка влияния на результат."""
+import time
+
+import pytest
+import requests
+
+from imageflow import deadline, retry_utils
+
+
+def test_header_timeout_is_capped_by_server_limit(monkeypatch):
+    monkeypatch.setenv("IMAGEFLOW_REQUEST_TIMEOUT", "60")
+
+    assert deadline.parse_timeout(None) == 60
+    assert deadline.parse_timeout("10") == 10
+    assert deadline.parse_timeout("600") == 60
+    with pytest.raises(ValueError):
+        deadline.parse_timeout("0")
+
+
+def test_zero_server_limit_means_no_deadline(monkeypatch):
+    monkeypatch.setenv("IMAGEFLOW_REQUEST_TIMEOUT", "0")
+
+    assert deadline.parse_timeout(None) is None
+    assert deadline.parse_timeout("10") == 10
+
+
+def test_timeout_is_shortened_to_remaining_time_and_marked():
+    with deadline.track_shortfall() as shortfall:
+        with deadline.request_deadline(60):
+            assert deadline.timeout(30) == 30
+        assert not shortfall.hit
+        with deadline.request_deadline(5):
+            assert deadline.timeout(30) <= 5
+    assert shortfall.hit
+
+
+def test_expired_deadline_raises():
+    with deadline.request_deadline(0):
+        with pytest.raises(deadline.DeadlineExceeded) as info:
+            deadline.check("seedream")
+    assert info.value.stage == "seedream"
+
+
+def test_reserve_narrows_deadline_for_nested_block():
+    with deadline.request_deadline(10):
+        with deadline.reserve(4):
+            assert deadline.remaining() <= 6
+        assert deadline.remaining() > 9
+    with deadline.reserve(4):
+        assert deadline.current() is None
+
+
+def test_safe_request_passes_shortened_timeout(monkeypatch):
+    timeouts = []
+
+    class Response:
+        def raise_for_status(self):
+            pass
+
+    def fake_request(method, url, timeout, **kwargs):
+        timeouts.append(timeout)
+        return Response()
+
+    monkeypatch.setattr(requests, "request", fake_request)
+    with deadline.request_deadline(2):
+        retry_utils.safe_request("GET", "http://example.invalid", timeout=30)
+
+    assert 0 < timeouts[0] <= 2
+
+
+def test_safe_request_does_not_retry_past_deadline(monkeypatch):
+    calls = []
+
+    def failing_request(*args, **kwargs):
+        calls.append(args)
+        raise requests.ConnectionError("down")
+
+    monkeypatch.setattr(requests, "request", failing_request)
+    start = time.monotonic()
+    with deadline.request_deadline(0.5):
+        with pytest.raises(requests.ConnectionError):
+            retry_utils.safe_request("GET", "http://example.invalid", max_retries=3)
+
+    assert len(calls) == 1  # задержка перед повтором (1 с) не помещается в дедлайн
+    assert time.monotonic() - start < 0.5
+
+
+def test_retry_on_failure_stops_before_deadline():
+    calls = []
+
+    @retry_utils.retry_on_failure(max_retries=3, delay=1.0, log_errors=False)
+    def flaky():
+        calls.append(True)
+        raise RuntimeError("flaky")
+
+    with deadline.request_deadline(0.5):
+        with pytest.raises(RuntimeError):
+            flaky()
+
+    assert len(calls) == 1
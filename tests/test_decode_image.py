@@ -0,0 +1,83 @@
+"""decode_image: уменьшение при декодировании (JPEG draft, Image.reduce, режимы без reduce) и лимит пикселей."""
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from imageflow.utils import decode_image
+
+
+def _encode(image: Image.Image, format: str, **params) -> bytes:
+    buf = io.BytesIO()
+    image.save(buf, format=format, **params)
+    return buf.getvalue()
+
+
+def _noise(width: int, height: int) -> Image.Image:
+    rng = np.random.default_rng(0)
+    return Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8), "RGB")
+
+
+def test_large_palette_png_is_reduced():
+    image = _noise(2500, 2500).quantize(colors=64)
+    assert image.mode == "P"
+
+    decoded = decode_image(_encode(image, "PNG"), target_size=(1024, 1024))
+
+    assert decoded.mode == "RGB"
+    assert decoded.size == (1250, 1250)
+
+
+def test_palette_png_with_transparency_keeps_alpha():
+    image = _noise(2500, 2500).quantize(colors=64)
+    image.info["transparency"] = 0
+
+    decoded = decode_image(_encode(image, "PNG", transparency=0), target_size=(1024, 1024))
+
+    assert decoded.mode == "RGBA"
+    assert decoded.size == (1250, 1250)
+
+
+def test_large_gif_is_reduced():
+    decoded = decode_image(_encode(_noise(4000, 3000), "GIF"), target_size=(1024, 1024))
+
+    assert decoded.mode in ("RGB", "RGBA")
+    assert decoded.size == (2000, 1500)
+
+
+def test_small_image_is_not_converted():
+    image = _noise(800, 600).quantize(colors=16)
+
+    decoded = decode_image(_encode(image, "PNG"), target_size=(1024, 1024))
+
+    assert decoded.mode == "P"
+    assert decoded.size == (800, 600)
+
+
+def test_jpeg_uses_draft_without_going_below_target():
+    data = _encode(_noise(4000, 3000), "JPEG")
+
+    decoded = decode_image(data, target_size=(1000, 700))
+
+    assert decoded.mode == "RGB"
+    assert decoded.size == (1000, 750)
+
+
+def test_rgb_png_is_reduced_by_whole_factor():
+    decoded = decode_image(_encode(_noise(3000, 2000), "PNG"), target_size=(1000, 600))
+
+    assert decoded.size == (1000, 667)
+
+
+def test_without_target_size_decodes_full_image():
+    assert decode_image(_encode(_noise(1200, 900), "JPEG")).size == (1200, 900)
+
+
+def test_image_over_pixel_limit_is_rejected(monkeypatch):
+    import imageflow.utils
+
+    monkeypatch.setattr(imageflow.utils, "MAX_IMAGE_PIXELS", 1000)
+
+    with pytest.raises(ValueError):
+        decode_image(_encode(_noise(100, 100), "PNG"))
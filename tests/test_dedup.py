@@ -0,0 +1,66 @@
+"""dedup: удаление из индекса и вытеснение давно не использованных записей."""
+import os
+import random
+
+from PIL import Image
+
+from imageflow import dedup
+
+
+def test_index_remove_keeps_nearest_consistent():
+    rng = random.Random(0)
+    index = dedup.HashIndex(max_distance=4)
+    values = [rng.getrandbits(64) for _ in range(500)]
+    for value in values:
+        index.add(value)
+    removed = set(values[::3])
+    for value in removed:
+        assert index.remove(value)
+
+    assert len(index) == len(values) - len(removed)
+    for value in values:
+        assert (index.nearest(value) == (value, 0)) == (value not in removed)
+    # Близкий хеш находит оставшуюся запись через корзины полос
+    kept = values[1]
+    assert index.nearest(kept ^ 0b101) == (kept, 2)
+
+
+def _store(directory, **limits):
+    return dedup.Store(str(directory), max_distance=4, **limits)
+
+
+def test_store_evicts_least_recently_used(tmp_path):
+    store = _store(tmp_path, max_entries=10)
+    image = Image.new("RGB", (8, 8), "red")
+    for entry in range(10):
+        store.write(entry, {"seedream-0.png": image}, register=True)
+    store.flush()
+    assert store.read(0, "seedream-0.png") is not None  # 0 - недавно использована
+
+    store.write(10, {"seedream-0.png": image}, register=True)
+    store.flush()
+
+    # Предел превышен: вытесняются самые старые до 90% предела
+    kept = [entry for entry in range(11) if entry in store.index]
+    assert kept == [0] + list(range(3, 11))
+    assert not os.path.exists(store.entry_dir(1)) and not os.path.exists(store.entry_dir(2))
+
+    reloaded = _store(tmp_path, max_entries=10)
+    assert [entry for entry in range(11) if entry in reloaded.index] == kept
+    assert reloaded.nbytes == store.nbytes
+
+
+def test_store_respects_byte_limit(tmp_path):
+    image = Image.new("RGB", (64, 64), "blue")
+    store = _store(tmp_path)
+    store.write(1, {"seedream-0.png": image}, register=True)
+    store.flush()
+    entry_bytes = store.nbytes
+
+    limited = _store(tmp_path / "limited", max_bytes=entry_bytes * 3)
+    for entry in range(1, 6):
+        limited.write(entry, {"seedream-0.png": image}, register=True)
+    limited.flush()
+
+    assert limited.nbytes <= entry_bytes * 3
+    assert 5 in limited.index and 1 not in limited.index
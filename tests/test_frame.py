@@ -0,0 +1,61 @@
+"""Frame: один буфер без копий на границах стадий."""
+import numpy as np
+import pytest
+from PIL import Image
+
+from imageflow.frame import Frame, as_array, as_pil
+
+
+def test_contiguous_uint8_array_is_not_copied():
+    array = np.zeros((8, 6, 3), dtype=np.uint8)
+    frame = Frame(array)
+
+    assert frame.array is array
+    assert (frame.mode, frame.size) == ("RGB", (6, 8))
+    assert as_array(frame) is array
+
+
+def test_non_contiguous_or_float_array_is_copied_once():
+    array = np.zeros((8, 12), dtype=np.uint8)[:, ::2]
+
+    frame = Frame(array)
+
+    assert frame.array.flags["C_CONTIGUOUS"] and frame.array.dtype == np.uint8
+    assert Frame(np.ones((4, 4), dtype=np.float32)).array.dtype == np.uint8
+
+
+@pytest.mark.parametrize("shape, mode", [((4, 4, 3), "L"), ((4, 4), "RGB"), ((4, 4, 2), None)])
+def test_mode_must_match_channels(shape, mode):
+    with pytest.raises(ValueError):
+        Frame(np.zeros(shape, dtype=np.uint8), mode)
+
+
+@pytest.mark.parametrize("mode", ["L", "RGBA"])
+def test_pil_view_shares_buffer(mode):
+    frame = Frame.empty((6, 4), mode)
+
+    view = frame.pil()
+    frame.array[1, 2] = 200
+
+    assert view.size == (6, 4) and view.mode == mode
+    assert np.asarray(view)[1, 2].flat[0] == 200
+    assert frame.pil() is view
+
+
+def test_rgb_pil_is_a_copy():
+    frame = Frame.empty((6, 4), "RGB")
+
+    image = frame.pil()
+    frame.array[1, 2] = 200
+
+    assert image.getpixel((2, 1)) == (0, 0, 0)
+
+
+def test_from_pil_and_as_pil_convert_mode_only_when_needed():
+    image = Image.new("RGBA", (5, 3), (10, 20, 30, 255))
+
+    frame = Frame.from_pil(image)
+    assert frame.mode == "RGBA" and frame.array.shape == (3, 5, 4)
+    assert as_pil(frame, "RGB").mode == "RGB"
+    assert as_pil(image) is image
+    assert as_array(image, "L").shape == (3, 5)
@@ -0,0 +1,132 @@
+"""run_hedged: порог по готовности Seedream, остановка проигравшей ветки; резервация после release."""
+import contextvars
+import threading
+import time
+
+import pytest
+import requests
+
+from imageflow import admission, hedging, retry_utils, streaming
+
+
+def test_losing_branch_is_joined_before_return():
+    stopped = threading.Event()
+
+    def slow_primary():
+        try:
+            while True:
+                hedging.sleep(0.01)
+        finally:
+            stopped.set()
+
+    result, winner = hedging.run_hedged(slow_primary, lambda: "fallback", delay=0.05, policy="first")
+
+    assert (result, winner) == ("fallback", "secondary")
+    assert stopped.is_set()
+
+
+def test_reservation_grow_after_release_does_not_leak():
+    budget = admission.MemoryBudget(100 * admission.MB)
+    reservation = admission.Reservation(budget)
+    reservation.grow(10 * admission.MB)
+    reservation.release()
+
+    with pytest.raises(RuntimeError):
+        reservation.grow(10 * admission.MB)
+    assert budget.reserved == 0
+
+
+def test_seedream_within_delay_does_not_start_fallback():
+    started = []
+
+    def primary():
+        time.sleep(0.05)  # Seedream успевает до порога
+        hedging.mark_ready()
+        time.sleep(0.3)  # рендер дольше порога
+        return "seedream"
+
+    def secondary():
+        started.append(True)
+        return "fallback"
+
+    assert hedging.run_hedged(primary, secondary, delay=0.2) == ("seedream", "primary")
+    assert not started
+
+
+def test_grace_waits_for_seedream_not_for_its_render():
+    def primary():
+        time.sleep(0.3)
+        hedging.mark_ready()
+        time.sleep(0.5)  # рендер дольше окна ожидания
+        return "seedream"
+
+    result = hedging.run_hedged(primary, lambda: "fallback", delay=0.05, policy="prefer_seedream", grace=0.5)
+
+    assert result == ("seedream", "primary")
+
+
+def test_join_of_stuck_loser_is_bounded(monkeypatch):
+    monkeypatch.setenv("IMAGEFLOW_HEDGE_JOIN_TIMEOUT", "0.2")
+    release = threading.Event()
+
+    def stuck_primary():
+        release.wait(5)  # не проверяет отмену, как отправленный HTTP-запрос
+        return "seedream"
+
+    start = time.monotonic()
+    result = hedging.run_hedged(stuck_primary, lambda: "fallback", delay=0.05, policy="first")
+    elapsed = time.monotonic() - start
+    release.set()
+
+    assert result == ("fallback", "secondary")
+    assert elapsed < 1.0
+
+
+def test_safe_request_stops_retrying_in_cancelled_branch(monkeypatch):
+    calls = []
+
+    def failing_request(*args, **kwargs):
+        calls.append(args)
+        raise requests.ConnectionError("down")
+
+    monkeypatch.setattr(requests, "request", failing_request)
+
+    def branch():
+        try:
+            retry_utils.safe_request("GET", "http://example.invalid", max_retries=5)
+        except hedging.HedgeCancelled:
+            return "cancelled"
+
+    cancel = threading.Event()
+    context = contextvars.copy_context()
+    context.run(hedging._cancel_event.set, cancel)
+    threading.Timer(0.3, cancel.set).start()
+    start = time.monotonic()
+
+    assert context.run(branch) == "cancelled"
+    # Отмена прерывает ожидание перед повтором (без отмены - 1+2+4+8 секунд)
+    assert time.monotonic() - start < 1.5
+    assert len(calls) == 1
+
+
+def test_stream_pump_stops_in_cancelled_branch():
+    class EndlessResponse:
+        def iter_content(self, chunk_size):
+            while True:
+                time.sleep(0.01)
+                yield b"x" * 16
+
+    def branch():
+        stream, thread = streaming.start_streaming(EndlessResponse())
+        thread.join(5)
+        return stream, thread
+
+    cancel = threading.Event()
+    cancel.set()
+    context = contextvars.copy_context()
+    context.run(hedging._cancel_event.set, cancel)
+    stream, thread = context.run(branch)
+
+    assert not thread.is_alive()
+    with pytest.raises(hedging.HedgeCancelled):
+        stream.read()
@@ -0,0 +1,62 @@
+"""Метрики в формате Prometheus: счётчики, gauge, гистограммы и /metrics."""
+import pytest
+from fastapi.testclient import TestClient
+
+from imageflow import metrics
+
+
+def test_counter_by_labels():
+    c = metrics.Counter("test_total", "Тест", ["result"])
+    c.inc(result="ok")
+    c.inc(2, result="ok")
+    c.inc(result='say "hi"')
+
+    assert c.get(result="ok") == 3
+    assert 'test_total{result="ok"} 3' in c.render()
+    assert 'test_total{result="say \\"hi\\""} 1' in c.render()
+    with pytest.raises(ValueError):
+        c.inc(-1, result="ok")
+    with pytest.raises(ValueError):
+        c.inc(stage="other")
+
+
+def test_gauge_tracks_in_progress():
+    g = metrics.Gauge("test_in_flight", "Тест")
+
+    with g.track_inprogress():
+        assert g.get() == 1
+    assert g.get() == 0
+
+
+def test_histogram_buckets_are_cumulative():
+    h = metrics.Histogram("test_seconds", "Тест", ["stage"], buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 5.0):
+        h.observe(value, stage="rmbg")
+
+    lines = h.render().splitlines()
+
+    assert 'test_seconds_bucket{stage="rmbg",le="0.1"} 2' in lines
+    assert 'test_seconds_bucket{stage="rmbg",le="1"} 3' in lines
+    assert 'test_seconds_bucket{stage="rmbg",le="+Inf"} 4' in lines
+    assert 'test_seconds_sum{stage="rmbg"} 5.65' in lines
+    assert 'test_seconds_count{stage="rmbg"} 4' in lines
+
+
+def test_duplicate_metric_name_is_rejected():
+    registry = metrics.Registry()
+    registry.register(metrics.Counter("dup_total", "Тест"))
+
+    with pytest.raises(ValueError):
+        registry.register(metrics.Counter("dup_total", "Тест"))
+
+
+def test_metrics_endpoint_serves_stage_histogram():
+    from imageflow.app import app
+
+    metrics.STAGE_SECONDS.observe(0.2, stage="rmbg")
+    response = TestClient(app).get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert "# TYPE imageflow_stage_duration_seconds histogram" in response.text
+    assert 'imageflow_stage_duration_seconds_count{stage="rmbg"}' in response.text
@@ -0,0 +1,40 @@
+"""Выходные размеры: проверка, холст render_at_target и пирамида resize."""
+import pytest
+from PIL import Image
+
+from imageflow.outputs import RENDER_SIZE, build_pyramid, validate_sizes
+from imageflow.pipeline import _render_size
+
+
+def test_validate_sizes_keeps_order_and_drops_duplicates():
+    assert validate_sizes(["512x640", "256x320", "512x640"]) == [(512, 640), (256, 320)]
+
+
+@pytest.mark.parametrize("value", ["512x512", "2048x2560", "0x0", "512", "axb"])
+def test_validate_sizes_rejects_invalid(value):
+    with pytest.raises(ValueError):
+        validate_sizes([value])
+
+
+def test_render_size_covers_every_requested_size():
+    # Пропорции в пределах допуска: по площади больше 801x999, но 800x1000 выше
+    sizes = validate_sizes(["801x999", "800x1000"])
+
+    canvas = _render_size(sizes, render_at_target=True)
+
+    assert canvas == (801, 1000)
+    pyramid = build_pyramid(Image.new("RGB", canvas), sizes)
+    assert [image.size for image in pyramid.values()] == sizes
+
+
+def test_render_size_default_is_full_render():
+    assert _render_size([(512, 640)], render_at_target=False) == RENDER_SIZE
+
+
+def test_pyramid_builds_each_size_from_nearest_larger_level():
+    sizes = [(128, 160), (512, 640), (256, 320)]
+
+    pyramid = build_pyramid(Image.new("RGB", RENDER_SIZE), sizes)
+
+    assert list(pyramid) == sizes
+    assert all(pyramid[size].size == size for size in sizes)
@@ -0,0 +1,30 @@
+"""Пайплайн после очистки: общие стадии один раз на несколько концепций."""
+from imageflow import pipeline
+from imageflow.benchmarks.synthetic import make_foreground, make_image, make_mask
+
+SIZES = [(256, 320)]
+
+
+def test_shared_stages_run_once_for_both_concepts(monkeypatch):
+    calls = []
+
+    def fake_rmbg(image, model="u2net"):
+        calls.append(image.size)
+        return make_foreground(image, make_mask(*image.size, coverage=0.3))
+
+    inpaint = pipeline.inpaint_pil_image
+
+    def counted_inpaint(*args, **kwargs):
+        calls.append("inpaint")
+        return inpaint(*args, **kwargs)
+
+    monkeypatch.setattr(pipeline, "remove_background", fake_rmbg)
+    monkeypatch.setattr(pipeline, "inpaint_pil_image", counted_inpaint)
+
+    renders = pipeline._render(make_image(1024, 1024), ("v1", "v2"), SIZES, render_size=SIZES[0])
+
+    assert calls == [(1024, 1024), "inpaint"]
+    assert list(renders) == ["v1", "v2"]
+    assert all(renders[concept][SIZES[0]].size == SIZES[0] for concept in renders)
+    # v1 размывает фон, v2 - нет: концепции не делят итоговый кадр
+    assert renders["v1"][SIZES[0]].tobytes() != renders["v2"][SIZES[0]].tobytes()
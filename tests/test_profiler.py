@@ -0,0 +1,91 @@
+"""Профайлер медленных запросов: порог, режимы sample и cprofile, кольцо файлов."""
+import os
+import time
+
+import pytest
+
+from imageflow import profiler
+
+
+@pytest.fixture
+def profiles(tmp_path, monkeypatch):
+    monkeypatch.setenv("IMAGEFLOW_PROFILE_DIR", str(tmp_path))
+    monkeypatch.setenv("IMAGEFLOW_PROFILE_THRESHOLD", "0.1")
+    monkeypatch.setenv("IMAGEFLOW_PROFILE_INTERVAL_MS", "5")
+    return tmp_path
+
+
+def _busy_wait(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+@profiler.profiled
+def slow_render(seconds=0.3):
+    _busy_wait(seconds)
+    return "done"
+
+
+def test_fast_request_is_not_saved(profiles):
+    assert slow_render(0.01) == "done"
+    assert profiler.list_profiles() == []
+
+
+def test_slow_request_saves_sampled_stacks(profiles):
+    assert slow_render() == "done"
+
+    [record] = profiler.list_profiles()
+    assert record["mode"] == "sample" and record["duration_s"] >= 0.3
+    assert not record["has_pstats"]
+    assert "_busy_wait" in profiler.collapsed_stacks(record["id"])
+
+
+def test_cprofile_mode_saves_pstats(profiles, monkeypatch):
+    monkeypatch.setenv("IMAGEFLOW_PROFILE_MODE", "cprofile")
+
+    slow_render()
+
+    [record] = profiler.list_profiles()
+    assert record["mode"] == "cprofile" and record["has_pstats"]
+    assert profiler.profile_path(record["id"], ".prof") is not None
+
+
+def test_error_is_recorded_and_reraised(profiles):
+    @profiler.profiled
+    def failing():
+        _busy_wait(0.2)
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        failing()
+
+    assert profiler.list_profiles()[0]["error"] == "RuntimeError: boom"
+
+
+def test_only_latest_profiles_are_kept(profiles, monkeypatch):
+    monkeypatch.setenv("IMAGEFLOW_PROFILE_KEEP", "2")
+
+    for _ in range(3):
+        slow_render(0.15)
+
+    assert len(profiler.list_profiles()) == 2
+    assert len([name for name in os.listdir(profiles) if name.endswith(".json")]) == 2
+
+
+def test_off_mode_and_nested_calls_do_not_save(profiles, monkeypatch):
+    @profiler.profiled
+    def outer():
+        return slow_render()
+
+    outer()
+    assert len(profiler.list_profiles()) == 1  # вложенный вызов - та же сессия
+
+    monkeypatch.setenv("IMAGEFLOW_PROFILE_MODE", "off")
+    slow_render()
+    assert len(profiler.list_profiles()) == 1
+
+
+@pytest.mark.parametrize("profile_id", ["../secret", "20260101T000000-zz", ""])
+def test_invalid_profile_id_is_not_served(profiles, profile_id):
+    assert profiler.profile_path(profile_id) is None
@@ -0,0 +1,90 @@
+"""Scheduler: повышение класса заявки в очереди, отказ по дедлайну."""
+import threading
+import time
+
+import pytest
+
+from imageflow import deadline, scheduler
+
+
+def _scheduler() -> scheduler.Scheduler:
+    return scheduler.Scheduler(scheduler.AIMDLimit(1, 1, 1, tolerance=1.5, backoff=0.9))
+
+
+def _acquire_in_thread(sched, claim, order):
+    def run():
+        ticket = sched.acquire(claim)
+        order.append(claim.client)
+        sched.release(ticket, 0.0)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def _wait_depth(sched, depth):
+    for _ in range(100):
+        if sched.queue_depth() == depth:
+            return
+        time.sleep(0.01)
+    raise AssertionError(f"очередь не достигла {depth}")
+
+
+def test_promoted_claim_is_served_first():
+    sched = _scheduler()
+    busy = sched.acquire(scheduler.Claim("default", "busy"))
+    order = []
+    batch = scheduler.Claim("batch", "leader")
+    threads = [_acquire_in_thread(sched, batch, order)]
+    _wait_depth(sched, 1)
+    threads.append(_acquire_in_thread(sched, scheduler.Claim("default", "other"), order))
+    _wait_depth(sched, 2)
+
+    assert sched.promote(batch, "interactive")
+    assert sched.queue_depth("batch") == 0 and sched.queue_depth("interactive") == 1
+    sched.release(busy, 0.0)
+    for thread in threads:
+        thread.join(5)
+
+    assert order == ["leader", "other"]
+
+
+def test_promote_never_lowers_priority():
+    sched = _scheduler()
+    claim = scheduler.Claim("interactive", "client")
+
+    assert not sched.promote(claim, "batch")
+    assert claim.priority == "interactive"
+
+
+def test_request_that_cannot_finish_before_deadline_is_rejected():
+    sched = _scheduler()
+    busy = sched.acquire(scheduler.Claim("default", "busy"))
+    # Ожидание ~30с (слот) + рендер ~30с не укладываются в 45с дедлайна
+    with deadline.request_deadline(45):
+        with pytest.raises(scheduler.SchedulerRejected):
+            sched.acquire(scheduler.Claim("default", "late"))
+    assert sched.queue_depth() == 0
+    sched.release(busy, 0.0)
+
+
+def _ticket(shape, stages):
+    ticket = scheduler.Ticket("default")
+    ticket.shape = shape
+    for stage, seconds in stages:
+        ticket.observe(stage, seconds)
+    return ticket
+
+
+def test_slowdown_does_not_sum_concepts_or_mix_canvas_sizes():
+    sched = _scheduler()
+    sched._slowdown(_ticket((1024, 1280), [("inpaint", 1.0), ("compose", 0.1)]))
+    sched._slowdown(_ticket((512, 640), [("inpaint", 0.1), ("compose", 0.01)]))
+
+    # Две концепции: compose дважды, каждый замер - отдельно; Seedream и дедупликация не учитываются
+    slowdown = sched._slowdown(_ticket((1024, 1280), [
+        ("inpaint", 1.0), ("compose", 0.1), ("compose", 0.1), ("seedream", 60.0), ("dedup_lookup", 5.0),
+    ]))
+
+    assert slowdown == pytest.approx(1.0)
+    assert sched._slowdown(_ticket((512, 640), [("inpaint", 0.1), ("compose", 0.01)])) == pytest.approx(1.0)
@@ -0,0 +1,66 @@
+"""SourceImage: исходник скачивается лениво и не больше одного раза; учёт байт запроса."""
+import contextvars
+
+from PIL import Image
+
+import imageflow.utils
+from imageflow import source
+
+
+def _fake_fetch(monkeypatch, calls):
+    def fetch_image(url, source="source", target_size=None):
+        calls.append(target_size)
+        size = (2000, 1500) if target_size is None else target_size
+        return Image.new("RGBA", size)
+
+    monkeypatch.setattr(imageflow.utils, "fetch_image", fetch_image)
+
+
+def test_source_is_not_downloaded_until_pixels_are_needed(monkeypatch):
+    calls = []
+    _fake_fetch(monkeypatch, calls)
+
+    image = source.SourceImage("https://example.com/a.png")
+
+    assert not image.loaded and not calls
+
+
+def test_source_is_downloaded_once_for_covered_sizes(monkeypatch):
+    calls = []
+    _fake_fetch(monkeypatch, calls)
+    image = source.SourceImage("https://example.com/a.png")
+
+    first = image.image((1024, 1280))
+    second = image.image((512, 640))
+
+    assert first is second and first.mode == "RGB"
+    assert calls == [(1024, 1280)]
+
+
+def test_larger_target_size_downloads_again(monkeypatch):
+    calls = []
+    _fake_fetch(monkeypatch, calls)
+    image = source.SourceImage("https://example.com/a.png")
+
+    image.image((512, 640))
+    image.image(None)
+
+    assert calls == [(512, 640), None]
+
+
+def test_transfer_log_sums_bytes_per_source():
+    def run():
+        log = source.start_transfer_log()
+        source.record_transfer("source", 100)
+        source.record_transfer("seedream", 50)
+        source.record_transfer("source", 20)
+        return log
+
+    log = contextvars.copy_context().run(run)
+
+    assert log.snapshot() == {"source": 120, "seedream": 50}
+    assert log.total == 170
+
+
+def test_record_transfer_without_log_is_noop():
+    contextvars.copy_context().run(source.record_transfer, "source", 100)
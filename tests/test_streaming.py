@@ -0,0 +1,92 @@
+"""Потоковая загрузка: проверка заголовков ответа, StreamBuffer, лимиты и декодирование по мере передачи."""
+import io
+import threading
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from imageflow import deadline, streaming
+from imageflow.utils import decode_image
+
+
+class FakeResponse:
+    def __init__(self, body=b"", headers=None, gate=None, chunk=16 * 1024):
+        self.headers = headers or {}
+        self._body = body
+        self._gate = gate
+        self._chunk = chunk
+
+    def iter_content(self, chunk_size):
+        for offset in range(0, len(self._body), self._chunk):
+            if self._gate is not None and offset >= 2 * self._chunk:
+                self._gate.wait(5)  # остаток тела - только после разбора заголовка
+            yield self._body[offset:offset + self._chunk]
+
+
+def _jpeg(width, height):
+    rng = np.random.default_rng(0)
+    buf = io.BytesIO()
+    Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8)).save(buf, format="JPEG")
+    return buf.getvalue()
+
+
+@pytest.mark.parametrize("headers", [
+    {"Content-Type": "text/html"},
+    {"Content-Type": "image/png", "Content-Length": str(100 * streaming.MB)},
+])
+def test_response_rejected_by_headers(headers):
+    with pytest.raises(ValueError):
+        streaming.check_image_response(FakeResponse(headers=headers), max_bytes=10 * streaming.MB)
+
+
+@pytest.mark.parametrize("content_type", ["image/jpeg; charset=binary", "application/octet-stream", ""])
+def test_image_and_generic_content_types_are_accepted(content_type):
+    streaming.check_image_response(FakeResponse(headers={"Content-Type": content_type}))
+
+
+def test_reader_waits_for_producer_and_sees_its_error():
+    stream = streaming.StreamBuffer()
+    threading.Timer(0.05, stream.feed, args=(b"abcd",)).start()
+
+    assert stream.read(4) == b"abcd"
+
+    stream.finish(ValueError("network"))
+    with pytest.raises(ValueError):
+        stream.read(1)
+
+
+def test_body_over_limit_aborts_download():
+    stream, thread = streaming.start_streaming(FakeResponse(b"x" * 100_000), max_bytes=50_000)
+    thread.join(5)
+
+    with pytest.raises(ValueError):
+        stream.read()
+    assert stream.received <= 50_000
+
+
+def test_expired_deadline_aborts_download():
+    with deadline.request_deadline(0):
+        stream, thread = streaming.start_streaming(FakeResponse(b"x" * 100_000))
+    thread.join(5)
+
+    with pytest.raises(deadline.DeadlineExceeded):
+        stream.read()
+
+
+def test_header_is_parsed_before_body_is_downloaded():
+    body = _jpeg(1200, 900)
+    gate = threading.Event()
+    stream, thread = streaming.start_streaming(FakeResponse(body, gate=gate))
+    received_at_header = []
+
+    def on_header(img):
+        received_at_header.append(stream.received)
+        gate.set()
+
+    image = decode_image(stream, on_header=on_header)
+    thread.join(5)
+
+    assert image.size == (1200, 900)
+    assert received_at_header[0] < len(body)
+    assert stream.received == len(body)
@@ -0,0 +1,152 @@
+"""textdraw: кэши шрифтов и метрик, слои по bbox текста, спрайты."""
+import numpy as np
+import pytest
+from PIL import Image
+
+from imageflow import textdraw
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = textdraw._LRUCache("test", 2)
+    cache.get_or_create("a", lambda: 1)
+    cache.get_or_create("b", lambda: 2)
+    cache.get_or_create("a", lambda: pytest.fail("a должен быть в кэше"))
+    cache.get_or_create("c", lambda: 3)
+
+    assert cache.get_or_create("a", lambda: "new") == 1
+    assert cache.get_or_create("b", lambda: "new") == "new"
+
+
+def test_weighted_cache_keeps_total_under_limit_and_skips_oversized():
+    cache = textdraw._LRUCache("test", 10, weight=len)
+    cache.get_or_create("a", lambda: "x" * 6)
+    cache.get_or_create("b", lambda: "x" * 6)
+    cache.get_or_create("huge", lambda: "x" * 20)
+
+    assert cache._total == 6 and list(cache._items) == ["b"]
+
+
+def test_font_is_loaded_once_per_size():
+    assert textdraw._get_font(None, 40) is textdraw._get_font(None, 40)
+
+
+def test_font_path_is_probed_once_per_name(monkeypatch):
+    probes = []
+    monkeypatch.setattr(textdraw, "_probe_font", lambda path: probes.append(path) or False)
+
+    textdraw._font_path("missing-test-font.ttf")
+    count = len(probes)
+    textdraw._font_path("missing-test-font.ttf")
+
+    assert len(probes) == count
+
+
+def test_fit_font_size_is_cached(monkeypatch):
+    searches = []
+    search = textdraw._search_fit_font_size
+    monkeypatch.setattr(textdraw, "_search_fit_font_size", lambda *args: searches.append(args) or search(*args))
+
+    first = textdraw.find_fit_font_size("Cached Fit Title", 300, None)
+    second = textdraw.find_fit_font_size("Cached Fit Title", 300, None)
+
+    assert first == second and len(searches) == 1
+
+
+def test_split_text_to_lines_keeps_words_and_width():
+    text = "Sweet Bonanza Super Scatter Gates of Olympus Mega Ways"
+    font = textdraw._get_font(None, 30).font
+
+    lines, size = textdraw.split_text_to_lines(text, 120, None, 30)
+
+    assert size == 30 and len(lines) > 1
+    assert " ".join(lines).split() == text.split()
+    assert all(font.getlength(line) <= 120 for line in lines if " " in line)
+
+
+def _full_frame_reference(image, overlays):
+    """Прежний способ: полноразмерный прозрачный слой и композит всего кадра в RGBA."""
+    from PIL import ImageDraw
+
+    result = image.convert("RGBA")
+    for overlay in overlays:
+        layer = Image.new("RGBA", image.size, (0, 0, 0, 0))
+        draw = ImageDraw.Draw(layer)
+        for xy, text, anchor in overlay.items:
+            draw.text(xy, text, font=overlay.font, fill=overlay.fill, anchor=anchor)
+        result = Image.alpha_composite(result, layer)
+    return result.convert("RGB")
+
+
+def _frame():
+    rng = np.random.default_rng(0)
+    return Image.fromarray(rng.integers(0, 256, (320, 256, 3), dtype=np.uint8), "RGB")
+
+
+def test_cropped_layers_match_full_frame_compositing():
+    image = _frame()
+    overlays = [
+        textdraw.layout_centered_text(image.width, "Gates of Olympus", 40, 30, "#FFEE00", None, opacity=0.8),
+        textdraw.layout_text("Provider", (10, 280), 24, "#FFFFFF", None),
+    ]
+
+    result = textdraw.apply_text_overlays(image, overlays)
+    reference = _full_frame_reference(image, overlays)
+
+    assert result.mode == "RGB" and result.tobytes() == reference.tobytes()
+    assert result.tobytes() != image.tobytes()
+
+
+def test_overlay_does_not_modify_input_unless_in_place():
+    image = _frame()
+    before = image.tobytes()
+    overlay = textdraw.layout_text("Title", (10, 10), 30, "#FFFFFF", None)
+
+    textdraw.apply_text_overlays(image, [overlay])
+    assert image.tobytes() == before
+
+    assert textdraw.apply_text_overlays(image, [overlay], in_place=True) is image
+    assert image.tobytes() != before
+
+
+def test_empty_text_leaves_image_unchanged():
+    image = _frame()
+    overlay = textdraw.layout_text("", (10, 10), 30, "#FFFFFF", None)
+
+    assert textdraw.apply_text_overlays(image, [overlay]).tobytes() == image.tobytes()
+
+
+def test_text_sprite_is_cached_and_matches_overlay():
+    image = _frame()
+    sprite = textdraw.centered_text_sprite("Sprite Title", image.width, 30, "#FFEE00", None)
+
+    assert textdraw.centered_text_sprite("Sprite Title", image.width, 30, "#FFEE00", None) is sprite
+    overlay = textdraw.layout_centered_text(image.width, "Sprite Title", 50, 30, "#FFEE00", None)
+    placed = textdraw.apply_sprites(image, [(sprite, (image.width // 2, 50))])
+    assert placed.tobytes() == textdraw.apply_text_overlays(image, [overlay]).tobytes()
+
+
+def test_multiline_sprite_is_cached_per_container_width():
+    first = textdraw.centered_multiline_text_sprite("Pragmatic Play Studios", 120, 30, font_name=None)
+
+    assert textdraw.centered_multiline_text_sprite("Pragmatic Play Studios", 120, 30, font_name=None) is first
+    assert textdraw.centered_multiline_text_sprite("Pragmatic Play Studios", 240, 30, font_name=None) is not first
+
+
+def test_sprite_is_clipped_at_frame_edges():
+    image = _frame()
+    sprite = textdraw.centered_text_sprite("Edge", image.width, 30, "#FFFFFF", None)
+
+    for anchor in [(0, 0), (image.width, image.height), (-1000, -1000)]:
+        assert textdraw.apply_sprites(image, [(sprite, anchor)]).size == image.size
+
+
+def test_sprite_on_transparent_frame_matches_overlay():
+    image = _frame().convert("RGBA")
+    image.putalpha(128)
+    sprite = textdraw.centered_text_sprite("Alpha", image.width, 30, "#FFFFFF", None)
+    overlay = textdraw.layout_centered_text(image.width, "Alpha", 60, 30, "#FFFFFF", None)
+
+    placed = textdraw.apply_sprites(image, [(sprite, (image.width // 2, 60))])
+
+    assert placed.mode == "RGB"
+    assert placed.tobytes() == textdraw.apply_text_overlays(image, [overlay]).tobytes()
@@ -0,0 +1,37 @@
+"""Бюджет потоков: делит ядра между слотами планировщика и следует за его лимитом."""
+import pytest
+
+from imageflow import scheduler, thread_budget
+
+
+@pytest.fixture
+def sixteen_cpus(monkeypatch):
+    monkeypatch.setattr(thread_budget, "available_cpus", lambda: 16)
+    for name in ("IMAGEFLOW_THREADS_CONCURRENCY", "IMAGEFLOW_THREADS_PER_REQUEST", "IMAGEFLOW_SCHEDULER"):
+        monkeypatch.delenv(name, raising=False)
+
+
+def test_default_concurrency_is_scheduler_limit(sixteen_cpus):
+    limit = scheduler.get_scheduler().limit.value
+    budget = thread_budget.ThreadBudget.from_env()
+
+    assert budget.concurrency == limit
+    assert budget.opencv == max(1, 16 // limit)
+
+
+def test_budget_follows_limit_but_keeps_ort(sixteen_cpus, monkeypatch):
+    monkeypatch.setattr(thread_budget, "_configure", lambda budget: None)
+    monkeypatch.setattr(thread_budget, "_budget", thread_budget.ThreadBudget.from_env(concurrency=16))
+
+    thread_budget._follow_limit(4)
+    budget = thread_budget.get_budget()
+
+    assert (budget.concurrency, budget.opencv, budget.blas) == (4, 4, 4)
+    assert budget.ort == 1  # сессия ONNX Runtime уже создана
+
+
+def test_explicit_concurrency_pins_budget(sixteen_cpus, monkeypatch):
+    monkeypatch.setenv("IMAGEFLOW_THREADS_CONCURRENCY", "2")
+
+    assert thread_budget.ThreadBudget.from_env(concurrency=8).concurrency == 2
+    assert not thread_budget.follows_scheduler()
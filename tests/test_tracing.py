@@ -0,0 +1,73 @@
+"""Трассировка: вложенные span'ы, traceparent, Server-Timing и OTLP."""
+import contextvars
+
+import pytest
+
+from imageflow import tracing
+
+
+def _in_trace(fn, traceparent=None):
+    def run():
+        trace = tracing.start_trace(traceparent)
+        fn()
+        return trace
+
+    return contextvars.copy_context().run(run)
+
+
+def test_span_without_trace_records_nothing():
+    with tracing.span("rmbg") as s:
+        assert s is None
+
+
+def test_nested_spans_and_error():
+    def work():
+        with tracing.span("seedream") as outer:
+            with tracing.span("seedream_poll"):
+                pass
+        with pytest.raises(ValueError):
+            with tracing.span("rmbg"):
+                raise ValueError("bad")
+        assert outer.end_ns is not None
+
+    trace = _in_trace(work)
+    spans = {s.name: s for s in trace.spans}
+
+    assert spans["seedream_poll"].parent_id == spans["seedream"].span_id
+    assert spans["seedream"].parent_id is None
+    assert spans["rmbg"].error == "ValueError: bad"
+
+
+def test_server_timing_sums_repeated_spans():
+    def work():
+        for _ in range(3):
+            with tracing.span("seedream_poll"):
+                pass
+        with tracing.span("mask step"):
+            pass
+
+    header = _in_trace(work).server_timing()
+
+    assert 'seedream_poll;desc="x3";dur=' in header
+    assert "mask_step;dur=" in header
+
+
+def test_incoming_traceparent_is_continued():
+    trace_id, parent = "0af7651916cd43dd8448eb211c80319c", "b7ad6b7169203331"
+
+    def work():
+        with tracing.span("rmbg", pixels=1024, cached=False):
+            pass
+
+    trace = _in_trace(work, f"00-{trace_id}-{parent}-01")
+    span = trace.to_otlp()["resourceSpans"][0]["scopeSpans"][0]["spans"][0]
+
+    assert trace.trace_id == trace_id
+    assert span["traceId"] == trace_id and span["parentSpanId"] == parent
+    assert {"key": "pixels", "value": {"intValue": "1024"}} in span["attributes"]
+    assert {"key": "cached", "value": {"boolValue": False}} in span["attributes"]
+
+
+@pytest.mark.parametrize("header", [None, "", "garbage", "00-xyz-b7ad6b7169203331-01"])
+def test_invalid_traceparent_starts_new_trace(header):
+    assert tracing.parse_traceparent(header) == (None, None)
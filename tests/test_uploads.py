@@ -0,0 +1,118 @@
+"""Исходник в теле /render: разбор multipart и бинарного тела, проверка байт, передача в Seedream."""
+import io
+
+import pytest
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from imageflow import app as api
+from imageflow import uploads
+
+
+def _png(size=(64, 48)) -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", size, (200, 100, 50)).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+@pytest.fixture(scope="module")
+def client():
+    # Только разбор тела, без пайплайна
+    parser = FastAPI()
+
+    @parser.post("/parse")
+    def parse(body=Depends(api.render_body)):
+        request, upload = body
+        return {
+            "request": request.model_dump(),
+            "upload": None if upload is None else {"format": upload.format, "size": list(upload.size)},
+        }
+
+    return TestClient(parser)
+
+
+def test_inspect_reads_header_only():
+    upload = uploads.inspect(_png())
+
+    assert (upload.format, upload.size, upload.content_type) == ("PNG", (64, 48), "image/png")
+    assert len(upload.digest) == 64
+
+
+@pytest.mark.parametrize("data", [b"", b"not an image"])
+def test_inspect_rejects_invalid_bytes(data):
+    with pytest.raises(ValueError):
+        uploads.inspect(data)
+
+
+def test_multipart_upload_with_form_fields(client):
+    response = client.post(
+        "/parse",
+        files={"image": ("cover.png", _png(), "image/png")},
+        data={"game_title": "Game", "provider": "Studio", "concepts": "v1,v2", "sizes": ["512x640", "256x320"]},
+    )
+
+    body = response.json()
+    assert response.status_code == 200
+    assert body["upload"] == {"format": "PNG", "size": [64, 48]}
+    assert body["request"]["concepts"] == ["v1", "v2"]
+    assert body["request"]["sizes"] == ["512x640", "256x320"]
+
+
+def test_binary_body_with_query_parameters(client):
+    response = client.post(
+        "/parse?game_title=Game&provider=Studio&concepts=v2",
+        content=_png(), headers={"Content-Type": "image/png"},
+    )
+
+    body = response.json()
+    assert body["upload"]["format"] == "PNG"
+    assert (body["request"]["game_title"], body["request"]["concepts"]) == ("Game", ["v2"])
+
+
+def test_json_body_has_no_upload(client):
+    response = client.post("/parse", json={"image_url": "https://example.com/a.png", "game_title": "G", "provider": "P"})
+
+    assert response.json()["upload"] is None
+
+
+@pytest.mark.parametrize("kwargs", [
+    {"files": {"file": ("cover.png", _png(), "image/png")}, "data": {"game_title": "G", "provider": "P"}},
+    {"content": b"not an image", "headers": {"Content-Type": "image/png"}},
+    {"content": _png(), "headers": {"Content-Type": "image/png"}, "params": {"image_url": "https://example.com/a.png"}},
+])
+def test_invalid_upload_is_rejected(client, kwargs):
+    params = {"game_title": "G", "provider": "P", **kwargs.pop("params", {})}
+
+    assert client.post("/parse", params=params, **kwargs).status_code == 400
+
+
+def test_oversized_body_is_rejected(client, monkeypatch):
+    monkeypatch.setattr(uploads, "MAX_UPLOAD_BYTES", 100)
+
+    response = client.post("/parse?game_title=G&provider=P", content=_png(), headers={"Content-Type": "image/png"})
+
+    assert response.status_code == 413
+
+
+def test_seedream_gets_data_uri_or_short_lived_link(monkeypatch):
+    upload = uploads.inspect(_png())
+
+    monkeypatch.setenv("IMAGEFLOW_UPLOAD_SEEDREAM", "data_uri")
+    with uploads.seedream_source(None, upload) as url:
+        assert url.startswith("data:image/png;base64,")
+
+    monkeypatch.setenv("IMAGEFLOW_UPLOAD_SEEDREAM", "url")
+    monkeypatch.setenv("IMAGEFLOW_PUBLIC_URL", "https://render.example.com/")
+    with uploads.seedream_source(None, upload) as url:
+        token = url.rsplit("/", 1)[1]
+        assert url == f"https://render.example.com/uploads/{token}"
+        assert uploads.STORE.get(token) is upload
+    assert uploads.STORE.get(token) is None
+
+
+def test_short_link_expires():
+    store = uploads.UploadStore()
+    token = store.publish(uploads.inspect(_png()), lifetime=0)
+
+    assert store.get(token) is None